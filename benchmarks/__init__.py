@@ -0,0 +1 @@
+"""Benchmarks of the recommendation service, see the Benchmarks section of the README."""
@@ -0,0 +1,62 @@
+"""Compare two benchmark result files and flag the regressions.
+
+    python -m benchmarks.compare baseline.json current.json --threshold 0.1
+
+Exits with 1 when a benchmark is slower than the threshold allows: a higher time (``*_seconds``) or a lower
+throughput (``throughput_rps``).
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Any
+
+DEFAULT_THRESHOLD = 0.10
+# Metric compared for each kind of results, and whether higher is better
+METRICS = {"micro": ("median_seconds", False), "load": ("p95_seconds", False)}
+THROUGHPUT_METRIC = "throughput_rps"
+
+
+def load_results(path: str) -> tuple[str, dict[str, dict[str, Any]]]:
+    """The kind of a result file and its results by name"""
+    document = json.loads(Path(path).read_text())
+    return document["kind"], {result["name"]: result for result in document["results"]}
+
+
+def compare(baseline: str, current: str, threshold: float) -> list[str]:
+    """Print the change of every benchmark, returns the regressions"""
+    kind, baseline_results = load_results(baseline)
+    current_kind, current_results = load_results(current)
+    if kind != current_kind:
+        message = f"Cannot compare {kind} results with {current_kind} results"
+        raise ValueError(message)
+
+    metrics = [METRICS[kind]] + ([(THROUGHPUT_METRIC, True)] if kind == "load" else [])
+    regressions = []
+    for name, result in current_results.items():
+        if (reference := baseline_results.get(name)) is None:
+            continue
+        for metric, higher_is_better in metrics:
+            before, after = reference[metric], result[metric]
+            change = (after - before) / before if before else 0.0
+            regressed = change < -threshold if higher_is_better else change > threshold
+            line = f"{name:<24} {metric:<16} {before:12.6g} -> {after:12.6g} {change:+8.1%}"
+            print(line + ("  REGRESSION" if regressed else ""))  # noqa: T201
+            if regressed:
+                regressions.append(line)
+    return regressions
+
+
+def main() -> None:
+    """Compare a benchmark result file with a baseline"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="relative change allowed")
+    args = parser.parse_args()
+    sys.exit(1 if compare(args.baseline, args.current, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Local stand-in of the multi-search endpoint of the search service.
+
+Serves synthetic assets, sorted by the field named by each query of the multi-search (``likes_count``,
+``downloads_count``, optionally prefixed by a batch position as ``0:likes_count``), with a configurable
+number of assets, latency and error rate. A share of the responses can be made slow, to reproduce a latency tail:
+
+    python -m benchmarks.fake_search --port 8765 --assets 10000 --latency 0.02 --error-rate 0.01
+    python -m benchmarks.fake_search --latency 0.01 --slow-rate 0.05 --slow-latency 0.5
+"""
+
+import argparse
+import asyncio
+import random
+from typing import Any
+
+from aiohttp import web
+
+DEFAULT_ASSETS = 1000
+CATEGORIES = 20
+ASSET_TYPES = ("dataset", "model", "paper", "application", "other")
+
+
+def synthetic_asset(position: int) -> dict[str, Any]:
+    """A deterministic synthetic asset, shaped like the documents of the search service"""
+    rng = random.Random(position)  # noqa: S311
+    return {
+        "id": f"asset-{position}",
+        "documentType": ASSET_TYPES[position % len(ASSET_TYPES)],
+        "name": f"Synthetic asset {position}",
+        "metadata": {"description": f"Description of the synthetic asset {position}", "tag": f"tag{position % 50}"},
+        "date": "2024-01-01T00:00:00+00:00",
+        "score": 0.0,
+        "categoryId": f"category-{position % CATEGORIES}",
+        "source": "user",
+        "likes_count": rng.randrange(1000),
+        "downloads_count": rng.randrange(5000),
+    }
+
+
+class FakeSearch:
+    """The multi-search handler and its settings"""
+
+    def __init__(  # noqa: PLR0913
+        self,
+        assets: int = DEFAULT_ASSETS,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        slow_rate: float = 0.0,
+        slow_latency: float = 0.0,
+    ) -> None:
+        self.latency = latency
+        self.error_rate = error_rate
+        # Share of the responses delayed by slow_latency on top of the latency
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.requests = 0
+        self.assets = [synthetic_asset(position) for position in range(assets)]
+        # The assets sorted by each field, computed on first use
+        self._sorted: dict[str, list[dict[str, Any]]] = {}
+
+    def sorted_by(self, field: str) -> list[dict[str, Any]]:
+        """The assets by decreasing value of the field"""
+        if field not in self._sorted:
+            self._sorted[field] = sorted(self.assets, key=lambda asset: asset.get(field, 0), reverse=True)
+        return self._sorted[field]
+
+    async def multi_search(self, request: web.Request) -> web.Response:
+        """POST /multi-search"""
+        self.requests += 1
+        body = await request.json()
+        if self.latency:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)  # noqa: S311
+        if self.slow_rate and random.random() < self.slow_rate:  # noqa: S311
+            await asyncio.sleep(self.slow_latency)
+        if random.random() < self.error_rate:  # noqa: S311
+            return web.json_response({"error": "synthetic error"}, status=500)
+        offset, limit = body.get("offset", 0), body.get("limit", 20)
+        results = {}
+        for name in body["queries"]:
+            field = name.rpartition(":")[2]
+            results[name] = {"count": len(self.assets), "assets": self.sorted_by(field)[offset : offset + limit]}
+        return web.json_response({"data": {"results": results}})
+
+    def application(self) -> web.Application:
+        """The aiohttp application serving /multi-search"""
+        app = web.Application()
+        app.router.add_post("/multi-search", self.multi_search)
+        return app
+
+
+async def start_fake_search(
+    fake_search: FakeSearch, host: str = "127.0.0.1", port: int = 0
+) -> tuple[web.AppRunner, str]:
+    """Serve the fake search in the running loop, returns the runner to clean up and the base URL"""
+    runner = web.AppRunner(fake_search.application())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]  # noqa: SLF001
+    return runner, f"http://{host}:{bound_port}"
+
+
+def main() -> None:
+    """Run the fake search service"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--assets", type=int, default=DEFAULT_ASSETS, help="number of synthetic assets")
+    parser.add_argument("--latency", type=float, default=0.0, help="mean latency of a response, in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of the responses in error")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="share of the responses delayed by --slow-latency")
+    parser.add_argument("--slow-latency", type=float, default=0.0, help="extra latency of the slow responses")
+    args = parser.parse_args()
+    fake_search = FakeSearch(args.assets, args.latency, args.error_rate, args.slow_rate, args.slow_latency)
+    web.run_app(fake_search.application(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
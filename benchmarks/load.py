@@ -0,0 +1,155 @@
+"""End-to-end load generator of GET /recommend.
+
+By default the FastAPI app runs in process, in front of the fake search service (benchmarks.fake_search), and
+is called through the ASGI transport of httpx: no network, no extra process. With --url, a running service is
+loaded instead (its search service is then whatever it is configured with).
+
+    python -m benchmarks.load --concurrency 32 --duration 20 --latency 0.01 --output load.json
+
+The queries are drawn from --distinct-queries combinations, so the share served by the cache is controlled.
+The hedged and retried calls (--hedging) are compared against a fake search service with a latency tail:
+
+    python -m benchmarks.load --distinct-queries 5000 --latency 0.01 --slow-rate 0.05 --slow-latency 0.5 --hedging
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from typing import Any
+
+import httpx
+import numpy as np
+
+from benchmarks.fake_search import ASSET_TYPES, CATEGORIES, DEFAULT_ASSETS, FakeSearch, start_fake_search
+from benchmarks.results import write_results
+
+DEFAULT_CONCURRENCY = 16
+DEFAULT_DURATION = 10.0
+DEFAULT_DISTINCT_QUERIES = 100
+PERCENTILES = (50, 95, 99)
+
+
+def query_params(distinct_queries: int, seed: int = 0, diversity: str | None = None) -> list[dict[str, Any]]:
+    """The parameters of the distinct queries sent by the load generator"""
+    rng = random.Random(seed)  # noqa: S311
+    queries = []
+    for position in range(distinct_queries):
+        params: dict[str, Any] = {"type": ASSET_TYPES[position % len(ASSET_TYPES)], "limit": 10}
+        if position % 3:
+            params["q"] = f"term{position}"
+        if position % 4 == 0:
+            params["categories"] = f"category-{rng.randrange(CATEGORIES)}"
+        if position % 5 == 0:
+            params["offset"] = 10 * rng.randrange(1, 5)
+        if diversity is not None:
+            params["diversity"] = diversity
+        queries.append(params)
+    return queries
+
+
+async def worker(
+    client: httpx.AsyncClient,
+    queries: list[dict[str, Any]],
+    deadline: float,
+    latencies: list[float],
+    errors: list[int],
+    rng: random.Random,
+) -> None:
+    """Send requests one after the other until the deadline"""
+    while time.perf_counter() < deadline:
+        params = rng.choice(queries)
+        start = time.perf_counter()
+        try:
+            response = await client.get("/recommend", params=params)
+            ok = response.status_code == 200  # noqa: PLR2004
+        except httpx.HTTPError:
+            ok = False
+        latencies.append(time.perf_counter() - start)
+        if not ok:
+            errors.append(1)
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    concurrency: int,
+    duration: float,
+    distinct_queries: int,
+    diversity: str | None = None,
+) -> dict[str, Any]:
+    """Load the service with concurrent workers, returns the throughput and latency percentiles"""
+    queries = query_params(distinct_queries, diversity=diversity)
+    latencies: list[float] = []
+    errors: list[int] = []
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(
+        *(
+            worker(client, queries, deadline, latencies, errors, random.Random(position))  # noqa: S311
+            for position in range(concurrency)
+        )
+    )
+    elapsed = time.perf_counter() - start
+    percentiles = np.percentile(np.asarray(latencies), PERCENTILES) if latencies else [float("nan")] * 3
+    return {
+        "name": "recommend",
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput_rps": len(latencies) / elapsed,
+        **{f"p{percentile}_seconds": float(value) for percentile, value in zip(PERCENTILES, percentiles, strict=True)},
+    }
+
+
+async def run_in_process(args: argparse.Namespace) -> dict[str, Any]:
+    """Run the app and the fake search service in process and load the app"""
+    fake_search = FakeSearch(args.assets, args.latency, args.error_rate, args.slow_rate, args.slow_latency)
+    runner, search_url = await start_fake_search(fake_search)
+    try:
+        from msfwk.context import current_config
+
+        from recommendation.main import app
+
+        config = current_config.get()
+        config.setdefault("services", {}).setdefault("search", {})["host"] = search_url
+        if args.hedging:
+            config.setdefault("hedging", {})["enabled"] = True
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://recommendation") as client:
+                result = await run_load(client, args.concurrency, args.duration, args.distinct_queries, args.diversity)
+    finally:
+        await runner.cleanup()
+    result["upstream_requests"] = fake_search.requests
+    return result
+
+
+async def run_remote(args: argparse.Namespace) -> dict[str, Any]:
+    """Load a running service"""
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30) as client:
+        return await run_load(client, args.concurrency, args.duration, args.distinct_queries, args.diversity)
+
+
+def main() -> None:
+    """Load GET /recommend and write the throughput and latency percentiles as JSON"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--url", help="base URL of a running service, the app runs in process otherwise")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="seconds")
+    parser.add_argument("--distinct-queries", type=int, default=DEFAULT_DISTINCT_QUERIES)
+    parser.add_argument("--diversity", choices=["none", "mmr", "quota"], help="diversity re-ranking of the queries")
+    parser.add_argument("--assets", type=int, default=DEFAULT_ASSETS, help="assets of the fake search service")
+    parser.add_argument("--latency", type=float, default=0.0, help="mean latency of the fake search service")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="error rate of the fake search service")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="share of slow responses of the fake search")
+    parser.add_argument("--slow-latency", type=float, default=0.0, help="extra latency of its slow responses")
+    parser.add_argument("--hedging", action="store_true", help="hedge and retry the calls (see services.hedging)")
+    parser.add_argument("--output", help="JSON file of the results, stdout by default")
+    args = parser.parse_args()
+    result = asyncio.run(run_remote(args) if args.url else run_in_process(args))
+    parameters = {key: value for key, value in vars(args).items() if key != "output"}
+    write_results("load", [result], args.output, **parameters)
+
+
+if __name__ == "__main__":
+    main()
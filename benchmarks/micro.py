@@ -0,0 +1,143 @@
+"""Microbenchmarks of the scoring path: parsing, normalization, merge (by each fusion strategy), top-k selection,
+diversity re-ranking and serialization.
+
+    python -m benchmarks.micro --sizes 20 1000 100000 --output micro.json
+
+Each benchmark is timed on fresh data (the setup is not timed) for at least --min-time seconds and at least
+--min-rounds rounds, the results hold the median and the best time of a round.
+"""
+
+import argparse
+import json
+import statistics
+import time
+from collections.abc import Callable
+from typing import Any
+
+from benchmarks.fake_search import synthetic_asset
+from benchmarks.results import write_results
+from recommendation.filters.utils import normalize_and_ponderate_r_score
+from recommendation.models.interfaces import Candidate, CandidateList, parse_candidate_lists
+from recommendation.services.codec import json_loads
+from recommendation.services.diversity import DiversitySettings, diversify
+from recommendation.services.fusion import FilterResults, ScoreFusion
+from recommendation.services.selection import Ranking
+
+DEFAULT_SIZES = (20, 1_000, 100_000)
+PAGE_SIZE = 20
+
+
+def measure(setup: Callable[[], Any], run: Callable[[Any], Any], min_time: float, min_rounds: int) -> list[float]:
+    """Durations of the rounds of run(setup())"""
+    durations = []
+    deadline = time.perf_counter() + min_time
+    while len(durations) < min_rounds or time.perf_counter() < deadline:
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def candidates(size: int, start: int = 0) -> list[Candidate]:
+    """Fresh candidates of synthetic assets"""
+    return [Candidate(synthetic_asset(position)) for position in range(start, start + size)]
+
+
+def scored(size: int) -> list[Candidate]:
+    """Fresh candidates with their r_score computed"""
+    assets = candidates(size)
+    normalize_and_ponderate_r_score("likes_count", 1.0, CandidateList(assets))
+    return assets
+
+
+def ranked(size: int) -> list[Candidate]:
+    """Fresh candidates with their r_score computed, in rank order"""
+    ranking = Ranking(scored(size))
+    return ranking.page(0, len(ranking))
+
+
+def multi_search_body(size: int) -> bytes:
+    """Response of a multi-search with two lists of size / 2 assets, half of them in both lists"""
+    half = size // 2
+    likes = [synthetic_asset(position) for position in range(half)]
+    downloads = [synthetic_asset(position) for position in range(half // 2, half // 2 + half)]
+    return json.dumps(
+        {
+            "data": {
+                "results": {
+                    "likes_count": {"count": size, "assets": likes},
+                    "downloads_count": {"count": size, "assets": downloads},
+                }
+            }
+        }
+    ).encode()
+
+
+def filter_results(body: bytes) -> FilterResults:
+    """Lists of a multi-search response, keyed like the results of the search filter"""
+    lists = parse_candidate_lists(json_loads(body)["data"])
+    return {("search", name): asset_list for name, asset_list in lists.items()}
+
+
+def benchmarks(size: int) -> dict[str, tuple[Callable[[], Any], Callable[[Any], Any]]]:
+    """(setup, run) of each benchmark at a number of candidates"""
+    body = multi_search_body(size)
+    return {
+        "parse": (lambda: body, lambda state: parse_candidate_lists(json_loads(state)["data"])),
+        "normalize": (
+            lambda: CandidateList(candidates(size)),
+            lambda state: normalize_and_ponderate_r_score("likes_count", 1.0, state),
+        ),
+        "merge": (lambda: filter_results(body), ScoreFusion("weighted_sum").fuse),
+        "merge_rrf": (lambda: filter_results(body), ScoreFusion("rrf").fuse),
+        "merge_max": (lambda: filter_results(body), ScoreFusion("max").fuse),
+        "top_k": (lambda: scored(size), lambda state: Ranking(state).page(0, PAGE_SIZE)),
+        "deep_page": (lambda: scored(size), lambda state: Ranking(state).page(size // 2, PAGE_SIZE)),
+        "diversify_mmr": (lambda: ranked(size), lambda state: diversify(state, DiversitySettings(mode="mmr"))),
+        "diversify_quota": (lambda: ranked(size), lambda state: diversify(state, DiversitySettings(mode="quota"))),
+        "serialize": (
+            lambda: candidates(size),
+            lambda state: [candidate.to_document_dict() for candidate in state],
+        ),
+    }
+
+
+def run_benchmarks(
+    sizes: list[int], selected: list[str] | None, min_time: float, min_rounds: int
+) -> list[dict[str, Any]]:
+    """Run the benchmarks at each size"""
+    results = []
+    for size in sizes:
+        for name, (setup, run) in benchmarks(size).items():
+            if selected and name not in selected:
+                continue
+            durations = measure(setup, run, min_time, min_rounds)
+            results.append(
+                {
+                    "name": f"{name}[{size}]",
+                    "benchmark": name,
+                    "size": size,
+                    "rounds": len(durations),
+                    "median_seconds": statistics.median(durations),
+                    "min_seconds": min(durations),
+                }
+            )
+    return results
+
+
+def main() -> None:
+    """Run the microbenchmarks and write their results as JSON"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="numbers of candidates")
+    parser.add_argument("--only", nargs="+", help="names of the benchmarks to run")
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds spent on each benchmark at least")
+    parser.add_argument("--min-rounds", type=int, default=5)
+    parser.add_argument("--output", help="JSON file of the results, stdout by default")
+    args = parser.parse_args()
+    results = run_benchmarks(args.sizes, args.only, args.min_time, args.min_rounds)
+    write_results("micro", results, args.output, sizes=args.sizes, min_time=args.min_time, min_rounds=args.min_rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Machine-readable benchmark results: one JSON document per run, comparable between commits."""
+
+import json
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+
+def git_commit() -> str | None:
+    """The commit of the working tree, None outside of a git checkout"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],  # noqa: S607
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(kind: str, results: list[dict[str, Any]], output: str | None, **parameters: Any) -> dict[str, Any]:
+    """Write the results of a run as JSON to the output file, or to stdout when there is none
+
+    Args:
+        kind (str): name of the suite (micro, load)
+        results (list[dict[str, Any]]): one entry per benchmark, each one with a unique "name"
+        output (str | None): path of the JSON file
+        parameters: settings of the run, stored with the results
+    """
+    document = {
+        "kind": kind,
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "machine": platform.machine(),
+        "parameters": parameters,
+        "results": results,
+    }
+    dumped = json.dumps(document, indent=2)
+    if output is None:
+        print(dumped)  # noqa: T201
+    else:
+        Path(output).write_text(dumped + "\n")
+    return document
@@ -1,12 +1,19 @@
 import asyncio
+import hashlib
+from abc import abstractmethod
+from collections.abc import Sequence
 from typing import Any
 
 import aiohttp
 from msfwk.utils.logging import get_logger
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 from recommendation.filters.utils import normalize_and_ponderate_r_score
-from recommendation.models.interfaces import RecommendAssetList, ToRecommendResponse
+from recommendation.models.interfaces import CandidateList, EventBatch, SearchQuery, parse_candidate_lists
+from recommendation.services.codec import json_loads
+from recommendation.services.hedging import RETRYABLE_STATUSES, get_upstream_policy
+from recommendation.services.http_client import get_http_client
+from recommendation.services.timing import span
 
 logger = get_logger(__name__)
 
@@ -16,38 +23,87 @@ class AbstractFilter(BaseModel):
 
     filter_name: str
     url: str
+    # Other hosts of the service, for the hedged and retried requests (see services.hedging)
+    hedge_urls: list[str] = []
     http_method: str = "GET"
     payload: dict[str, Any] | None = None
     headers: dict[str, Any] | None = None
     ponderation: float
+    # Overrides the filters.filter_timeout config for this filter
+    timeout: float | None = None
+    _fingerprint: str | None = PrivateAttr(default=None)
 
-    async def apply(self) -> dict[str, RecommendAssetList] | None:
+    @classmethod
+    @abstractmethod
+    def from_config(cls) -> "AbstractFilter | None":
+        """Build the filter once from the config, the per-request part is done by build_payload.
+        Returns None when the filter is disabled in the config.
+        """
+
+    def start(self) -> None:
+        """Start loading the in-process state of the filter in background, called at startup.
+        Nothing to do for the filters answered by a remote service.
+        """
+
+    @property
+    def fingerprint(self) -> str:
+        """Digest of the settings of the filter, the same filter built from another config has another one"""
+        if self._fingerprint is None:
+            self._fingerprint = hashlib.blake2b(self.model_dump_json().encode(), digest_size=8).hexdigest()
+        return self._fingerprint
+
+    def ready(self) -> bool:
+        """Whether the filter can answer now, the filters loading their in-process state are left out of the
+        requests (see filters_ready)
+        """
+        return True
+
+    def build_payload(self, query: SearchQuery) -> dict[str, Any] | None:  # noqa: ARG002
+        """Build the payload sent to the service for the given query"""
+        return self.payload
+
+    async def apply_events(self, batch: EventBatch) -> None:
+        """Update the in-process state of the filter with a batch of asset/interaction events.
+        Nothing to do for the filters answered by a remote service.
+        """
+
+    def rescore(self, name: str, asset_list: CandidateList) -> bool:
+        """Score again a list of the filter after the fields of its candidates changed, as _apply_norm_and_pond does.
+        Returns False when the scores of the filter do not derive from the fields of the candidates.
+        """
+        for candidate in asset_list.assets:
+            candidate.r_score = 0.0
+        normalize_and_ponderate_r_score(name, self.ponderation, asset_list)
+        return True
+
+    async def apply(self, query: SearchQuery) -> dict[str, CandidateList] | None:
         """Apply the filter by calling the service API."""
-        try:
-            async with aiohttp.ClientSession() as session:
-                if self.http_method == "GET":
-                    async with session.get(self.url, headers=self.headers, params=self.payload) as response:
-                        return await self._handle_response(response)
-
-                elif self.http_method == "POST":
-                    response = await session.post(
-                        self.url,
-                        json=self.payload,
-                    )
-                    if (asset_dict := await self._handle_response(response)) is not None:
-                        return await self._apply_norm_and_pond(asset_dict)
-
-                elif self.http_method in {"POST", "PUT", "PATCH", "DELETE"}:
-                    logger.debug("Use %s on %s with payload: %s ", self.http_method, self.url, self.payload)
-                    async with getattr(session, self.http_method.lower())(
-                        self.url, headers=self.headers, data=str(self.payload)
-                    ) as response:
-                        if (asset_dict := await self._handle_response(response)) is not None:
-                            return await self._apply_norm_and_pond(asset_dict)
-                else:
-                    logger.error("Unsupported HTTP method: %s", self.http_method)
-                    return None
+        return await self._call(self.build_payload(query), query.poolMaxima)
+
+    async def apply_batch(self, queries: Sequence[SearchQuery]) -> list[dict[str, CandidateList] | None]:
+        """Apply the filter to several queries, one result per query. The remote filters able to answer several
+        queries in one call override it.
+        """
+        return list(await asyncio.gather(*(self.apply(query) for query in queries)))
 
+    async def _call(
+        self, payload: dict[str, Any] | None, maxima: dict[str, float] | None = None
+    ) -> dict[str, CandidateList] | None:
+        """Send the payload to the service, the candidates are normalized and ponderated except for GET"""
+        if (asset_dict := await self._request(payload)) is not None and self.http_method != "GET":
+            return await self._apply_norm_and_pond(asset_dict, maxima)
+        return asset_dict
+
+    async def _request(self, payload: dict[str, Any] | None) -> dict[str, CandidateList] | None:
+        """Send the payload to the service and parse the candidate lists of the response.
+        The request is hedged and retried following the policy of the filter, see services.hedging.
+        """
+        try:
+            return await get_upstream_policy(self.filter_name).call(
+                [self.url, *self.hedge_urls], lambda url: self._send(url, payload)
+            )
+        except aiohttp.ClientResponseError as cre:
+            logger.warning("Filter '%s' returned status %s", self.filter_name, cre.status)
         except aiohttp.ClientError as ce:
             message = f"HTTP client error during apply() in filter '{self.filter_name}': {ce}"
             logger.exception(message, exc_info=ce)
@@ -56,25 +112,55 @@ class AbstractFilter(BaseModel):
             logger.exception(message, exc_info=te)
         return None
 
-    async def _handle_response(self, response: aiohttp.ClientResponse) -> dict[str, RecommendAssetList] | None:
+    async def _send(self, url: str, payload: dict[str, Any] | None) -> dict[str, CandidateList] | None:
+        """Send the payload to a host of the service, raises on the errors worth a retry"""
+        session = get_http_client().session
+        if self.http_method == "GET":
+            async with session.get(url, headers=self.headers, params=payload) as response:
+                return await self._handle_response(response)
+
+        elif self.http_method == "POST":
+            async with session.post(url, headers=self.headers, json=payload) as response:
+                return await self._handle_response(response)
+
+        elif self.http_method in {"POST", "PUT", "PATCH", "DELETE"}:
+            logger.debug("Use %s on %s with payload: %s ", self.http_method, url, payload)
+            async with getattr(session, self.http_method.lower())(
+                url, headers=self.headers, data=str(payload)
+            ) as response:
+                return await self._handle_response(response)
+        else:
+            logger.error("Unsupported HTTP method: %s", self.http_method)
+            return None
+
+    async def _handle_response(self, response: aiohttp.ClientResponse) -> dict[str, CandidateList] | None:
         if response.status >= 300:
+            if response.status in RETRYABLE_STATUSES:
+                # A transient error, raised to be retried
+                response.raise_for_status()
             logger.warning("Filter '%s' returned status %s", self.filter_name, response.status)
             return None
         try:
-            data = (await response.json()).get("data")
-            # check validity
-            return ToRecommendResponse(**data).results
+            with span("read", self.filter_name):
+                body = await response.read()
+            with span("parse", self.filter_name):
+                # The documents are only validated for the returned page, see Candidate
+                return parse_candidate_lists(json_loads(body).get("data"))
         except Exception as ee:
             message = f"Failed to parse JSON response for filter '{self.filter_name}': {ee}"
             logger.exception(message, exc_info=ee)
             return None
 
-    async def _apply_norm_and_pond(self, asset_dict: dict[str, RecommendAssetList]) -> dict[str, RecommendAssetList]:
+    async def _apply_norm_and_pond(
+        self, asset_dict: dict[str, CandidateList], maxima: dict[str, float] | None = None
+    ) -> dict[str, CandidateList]:
         """Normalize and ponderate
 
         Args:
-            asset_dict (dict[str, list[RecommendAssetList]]): _description_
+            asset_dict (dict[str, CandidateList]): _description_
+            maxima (dict[str, float] | None): normalization max of the fields, the max of each list otherwise
         """
+        maxima = maxima or {}
         for key in asset_dict:
-            normalize_and_ponderate_r_score(key, self.ponderation, asset_dict[key])
+            normalize_and_ponderate_r_score(key, self.ponderation, asset_dict[key], maxima.get(key))
         return asset_dict
@@ -0,0 +1,230 @@
+"""Filters recommending from the interactions of the users instead of the search service.
+
+The CollaborativeFilter answers from an in-process item-item similarity index: the assets most liked or
+downloaded by the users who also liked or downloaded the seed assets. The index is built in background from
+startup, the filter is left out of the requests until it is built. With a ``snapshot`` file, only the worker
+holding its writer lock builds the index: it applies the events to it and writes a new version of the snapshot at
+most every ``snapshot_interval`` seconds, the other workers map the latest version instead of building anything.
+"""
+
+import asyncio
+import math
+import time
+
+from msfwk.context import current_config
+from msfwk.utils.logging import get_logger
+from pydantic import PrivateAttr
+
+from recommendation.filters.abstract_filter import AbstractFilter
+from recommendation.filters.utils import document_matches, scored_candidate_list
+from recommendation.models.exceptions import MissingConfigError
+from recommendation.models.interfaces import CandidateList, EventBatch, SearchQuery
+from recommendation.services.collaborative import (
+    DEFAULT_NEIGHBOURS,
+    ItemItemIndex,
+    load_interactions,
+    write_index_snapshot,
+)
+from recommendation.services.snapshot import Snapshot, SnapshotFile, WriterLock
+
+logger = get_logger(__name__)
+
+# Seconds before building again an index that failed to build, or trying again to take the writer lock
+LOAD_RETRY_INTERVAL = 30.0
+DEFAULT_SNAPSHOT_INTERVAL = 60.0
+
+
+class CollaborativeFilter(AbstractFilter):
+    """Filter on the item-item similarity of the like/download interactions"""
+
+    filter_name: str = "Collaborative Filter"
+    # Name of the candidate list returned by the filter
+    result_name: str = "item_similarity"
+    url: str = ""
+    ponderation: float = 1.0
+    interactions_path: str
+    # Snapshot file of the index shared by the workers, written by the holder of its writer lock
+    snapshot_path: str | None = None
+    # Min seconds between two versions of the snapshot written with the events
+    snapshot_interval: float = DEFAULT_SNAPSHOT_INTERVAL
+    neighbours: int = DEFAULT_NEIGHBOURS
+    event_weights: dict[str, float] | None = None
+    limit: int = 20
+    _index: ItemItemIndex | None = PrivateAttr(default=None)
+    _index_lock: asyncio.Lock = PrivateAttr(default_factory=asyncio.Lock)
+    _loading: asyncio.Task | None = PrivateAttr(default=None)
+    _load_failed_at: float = PrivateAttr(default=-math.inf)
+    # Event batches received while the index is built, applied to it once built
+    _pending: list[EventBatch] = PrivateAttr(default_factory=list)
+    _snapshot_file: SnapshotFile | None = PrivateAttr(default=None)
+    # Latest snapshot mapped and its index
+    _mapped: tuple[Snapshot, ItemItemIndex] | None = PrivateAttr(default=None)
+    _writer_lock: WriterLock | None = PrivateAttr(default=None)
+    _lock_tried_at: float = PrivateAttr(default=-math.inf)
+    _writing: asyncio.Task | None = PrivateAttr(default=None)
+    # Index of the latest snapshot written, and when
+    _written: ItemItemIndex | None = PrivateAttr(default=None)
+    _written_at: float = PrivateAttr(default=-math.inf)
+
+    @classmethod
+    def from_config(cls) -> "CollaborativeFilter | None":
+        """Build object from the ``collaborative`` section of the config, None when it is not enabled"""
+        config = current_config.get().get("collaborative", {})
+        if not config.get("enabled", False):
+            return None
+        if (interactions_path := config.get("interactions")) is None:
+            message = "Missing collaborative interactions path from config"
+            logger.error(message)
+            raise MissingConfigError(message)
+        return cls(
+            interactions_path=interactions_path,
+            snapshot_path=config.get("snapshot"),
+            snapshot_interval=config.get("snapshot_interval", DEFAULT_SNAPSHOT_INTERVAL),
+            neighbours=config.get("neighbours", DEFAULT_NEIGHBOURS),
+            event_weights=config.get("event_weights"),
+            limit=config.get("limit", 20),
+            ponderation=config.get("ponderation", 1.0),
+        )
+
+    def start(self) -> None:
+        """Build the index in background, unless it is built, being built or failed to build lately.
+        With a snapshot, only the holder of its writer lock builds it.
+        """
+        if self._index is not None or self._building or (self.snapshot_path is not None and not self._writer()):
+            return
+        if time.monotonic() - self._load_failed_at >= LOAD_RETRY_INTERVAL:
+            self._loading = asyncio.create_task(self._load())
+
+    def _writer(self) -> bool:
+        """Whether this worker writes the snapshot, the free lock is taken (tried at most every LOAD_RETRY_INTERVAL)"""
+        if self._writer_lock is None:
+            self._writer_lock = WriterLock(self.snapshot_path)
+        if not self._writer_lock.held and time.monotonic() - self._lock_tried_at >= LOAD_RETRY_INTERVAL:
+            self._lock_tried_at = time.monotonic()
+            if self._writer_lock.acquire():
+                logger.info("Filter '%s' writes the snapshot %s", self.filter_name, self.snapshot_path)
+        return self._writer_lock.held
+
+    @property
+    def _building(self) -> bool:
+        return self._loading is not None and not self._loading.done()
+
+    async def _load(self) -> None:
+        try:
+            await self.reload()
+        except (OSError, ValueError, KeyError) as e:
+            self._load_failed_at = time.monotonic()
+            logger.exception("Failed to load the interactions of filter '%s'", self.filter_name, exc_info=e)
+            return
+        if self.snapshot_path is not None:
+            self._schedule_write()
+            await self._writing
+
+    def ready(self) -> bool:
+        """Ready once the index is built or mapped"""
+        return self.get_index() is not None
+
+    def get_index(self) -> ItemItemIndex | None:
+        """The similarity index built by this worker, or the one of the snapshot. None while it is built."""
+        self.start()
+        if self._index is not None:
+            return self._index
+        return self._mapped_index()
+
+    async def loaded(self) -> ItemItemIndex | None:
+        """Wait for the index to be built, None when it failed to build"""
+        self.start()
+        if self._loading is not None:
+            await asyncio.shield(self._loading)
+        return self.get_index()
+
+    async def reload(self) -> None:
+        """(Re)build the similarity index from the interactions, then apply the events received meanwhile"""
+        interactions, documents = await load_interactions(self.interactions_path)
+        index = await asyncio.to_thread(
+            ItemItemIndex.build, interactions, documents, self.neighbours, self.event_weights
+        )
+        async with self._index_lock:
+            while self._pending:
+                batch = self._pending.pop(0)
+                index = await asyncio.to_thread(index.updated, batch.interactions, batch.documents, self.event_weights)
+            self._index = index
+
+    def _mapped_index(self) -> ItemItemIndex | None:
+        """The index of the latest snapshot, None without snapshot or until a worker wrote it. Mapping a snapshot
+        only reads its table of contents.
+        """
+        if self.snapshot_path is None:
+            return None
+        if self._snapshot_file is None:
+            self._snapshot_file = SnapshotFile.from_config(self.snapshot_path, "collaborative")
+        if (snapshot := self._snapshot_file.current()) is None:
+            return None
+        if self._mapped is None or self._mapped[0] is not snapshot:
+            self._mapped = (snapshot, ItemItemIndex.from_snapshot(snapshot))
+        return self._mapped[1]
+
+    def _schedule_write(self) -> None:
+        if self._writing is None or self._writing.done():
+            self._writing = asyncio.create_task(self._write_snapshot())
+
+    async def _write_snapshot(self) -> None:
+        """Write the snapshot of the index until its latest version is written, at most every snapshot_interval"""
+        while self._written is not self._index:
+            await asyncio.sleep(max(self._written_at + self.snapshot_interval - time.monotonic(), 0.0))
+            index = self._index
+            try:
+                await asyncio.to_thread(write_index_snapshot, index, self.snapshot_path)
+            except OSError as e:
+                logger.exception("Failed to write the snapshot %s", self.snapshot_path, exc_info=e)
+                return
+            self._written, self._written_at = index, time.monotonic()
+
+    async def apply_events(self, batch: EventBatch) -> None:
+        """Add the interactions and documents of the batch to the index.
+        A new index is swapped in, the requests in flight keep reading the previous one. With a snapshot, only its
+        writer applies the events, the other workers map the next version of the snapshot.
+        """
+        if self.snapshot_path is not None and not self._writer():
+            return
+        if self._index is None:
+            if self._building:
+                self._pending.append(batch)
+            return
+        async with self._index_lock:
+            self._index = await asyncio.to_thread(
+                self._index.updated, batch.interactions, batch.documents, self.event_weights
+            )
+        if self.snapshot_path is not None:
+            self._schedule_write()
+
+    def rescore(self, name: str, asset_list: CandidateList) -> bool:  # noqa: ARG002
+        """The scores are similarities to the query, they do not derive from the fields of the candidates"""
+        return False
+
+    async def apply(self, query: SearchQuery) -> dict[str, CandidateList] | None:
+        """Recommend the assets similar to the seed assets of the query"""
+        # The whole result is returned with the first window of the candidate pool
+        if query.poolOffset or not query.seedAssets:
+            return {}
+        try:
+            index = self.get_index()
+        except (ValueError, KeyError) as e:
+            logger.exception("Failed to map the snapshot of filter '%s'", self.filter_name, exc_info=e)
+            return None
+        if index is None:
+            logger.warning("The index of filter '%s' is not built yet", self.filter_name)
+            return None
+
+        positions, similarities = index.similar(index.seeds_of(query.seedAssets))
+        documents = []
+        kept_similarities = []
+        for position, similarity in zip(positions.tolist(), similarities.tolist(), strict=True):
+            document = index.documents.get(index.asset_ids[position])
+            if document is None or not document_matches(document, query):
+                continue
+            documents.append(document)
+            kept_similarities.append(similarity)
+            if len(documents) >= self.limit:
+                break
+        return {self.result_name: scored_candidate_list(documents, kept_similarities, self.ponderation)}
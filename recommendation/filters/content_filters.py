@@ -0,0 +1,94 @@
+"""Filters recommending from the content of the assets instead of the search service.
+
+The ContentFilter answers "more like this" from a memory-mapped approximate nearest-neighbour index of the
+name, metadata and category of the assets, built offline (see recommendation.services.content_index).
+"""
+
+import asyncio
+
+from msfwk.context import current_config
+from msfwk.utils.logging import get_logger
+from pydantic import PrivateAttr
+
+from recommendation.filters.abstract_filter import AbstractFilter
+from recommendation.filters.utils import document_matches, scored_candidate_list
+from recommendation.models.exceptions import MissingConfigError
+from recommendation.models.interfaces import CandidateList, SearchQuery
+from recommendation.services.content_index import DEFAULT_NPROBE, ContentIndex
+
+logger = get_logger(__name__)
+
+# Neighbours fetched per returned candidate, to leave room for the ones dropped by the query criteria
+OVERFETCH_FACTOR = 4
+
+
+class ContentFilter(AbstractFilter):
+    """Filter on the content similarity with the seed assets"""
+
+    filter_name: str = "Content Filter"
+    # Name of the candidate list returned by the filter
+    result_name: str = "content_similarity"
+    url: str = ""
+    ponderation: float = 1.0
+    index_path: str
+    nprobe: int = DEFAULT_NPROBE
+    limit: int = 20
+    _index: ContentIndex | None = PrivateAttr(default=None)
+
+    @classmethod
+    def from_config(cls) -> "ContentFilter | None":
+        """Build object from the ``content`` section of the config, None when it is not enabled"""
+        config = current_config.get().get("content", {})
+        if not config.get("enabled", False):
+            return None
+        if (index_path := config.get("index_path")) is None:
+            message = "Missing content index path from config"
+            logger.error(message)
+            raise MissingConfigError(message)
+        return cls(
+            index_path=index_path,
+            nprobe=config.get("nprobe", DEFAULT_NPROBE),
+            limit=config.get("limit", 20),
+            ponderation=config.get("ponderation", 1.0),
+        )
+
+    def get_index(self) -> ContentIndex:
+        """The content index, mapped on first use"""
+        if self._index is None:
+            self._index = ContentIndex(self.index_path)
+        return self._index
+
+    def rescore(self, name: str, asset_list: CandidateList) -> bool:  # noqa: ARG002
+        """The scores are similarities to the query, they do not derive from the fields of the candidates"""
+        return False
+
+    async def apply(self, query: SearchQuery) -> dict[str, CandidateList] | None:
+        """Recommend the assets whose content is similar to the seed assets of the query"""
+        # The whole result is returned with the first window of the candidate pool
+        if query.poolOffset or not query.seedAssets:
+            return {}
+        try:
+            index = self.get_index()
+        except (OSError, ValueError) as e:
+            logger.exception("Failed to open the content index of filter '%s'", self.filter_name, exc_info=e)
+            return None
+
+        if (vector := index.query_vector(query.seedAssets)) is None:
+            return {}
+        positions, similarities = await asyncio.to_thread(
+            index.search, vector, (self.limit + len(query.seedAssets)) * OVERFETCH_FACTOR, self.nprobe
+        )
+        seeds = set(query.seedAssets)
+        documents = []
+        kept_similarities = []
+        for position, similarity in zip(positions.tolist(), similarities.tolist(), strict=True):
+            if index.asset_ids[position] in seeds or similarity <= 0:
+                continue
+            document = index.document(position)
+            if not document_matches(document, query):
+                continue
+            documents.append(document)
+            kept_similarities.append(similarity)
+            if len(documents) >= self.limit:
+                break
+        return {self.result_name: scored_candidate_list(documents, kept_similarities, self.ponderation)}
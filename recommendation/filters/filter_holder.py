@@ -1,61 +1,275 @@
+import asyncio
+import time
+from collections.abc import Awaitable, Callable, Sequence
+from typing import TypeVar
+
+from msfwk.context import current_config
 from msfwk.utils.logging import get_logger
 
 from recommendation.filters.abstract_filter import AbstractFilter
-from recommendation.filters.search_filters import SearchFilter
+from recommendation.models.constants import FILTERS
 from recommendation.models.exceptions import MissingConfigError
-from recommendation.models.interfaces import RecommendableDocument, SearchQuery
-from recommendation.services.utils import merge_asset_dicts
+from recommendation.models.interfaces import Candidate, CandidateList, EventBatch, SearchQuery
+from recommendation.services.cache import get_recommendation_cache
+from recommendation.services.circuit_breaker import circuit_breakers_reset, get_circuit_breaker
+from recommendation.services.concurrency import concurrency_limiters_reset, get_concurrency_limiter
+from recommendation.services.fallback import FALLBACKS, fallback_key, get_fallback_store
+from recommendation.services.fusion import get_score_fusion, score_fusion_reset
+from recommendation.services.hedging import upstream_policies_reset
+from recommendation.services.timing import span
 
 logger = get_logger(__name__)
 
-filter_holder = []
+DEFAULT_REQUEST_TIMEOUT = 3.0
+DEFAULT_FILTER_TIMEOUT = 2.5
 
+T = TypeVar("T")
 
-def filters_regenerate(query: SearchQuery) -> bool:
-    r"""Clean and adds to the filter_holder the wanted filters.
-    /!\ Should be modified when reco not present during a search /!\
-        - Remove query (will no longer be needed)
-        - genereate only once each filter, (in the init container)
+# Filters compiled once from the config, replaced as a whole (never mutated) so concurrent requests
+# iterating over it are not affected by a regeneration
+filter_holder: tuple[AbstractFilter, ...] = ()
 
-    Args:
-        query (SearchQuery): _description_
+
+def filters_regenerate() -> bool:
+    """Build the filters from the config and swap them in the filter_holder.
+    Called at startup and whenever the config is reloaded.
 
     Returns:
-        bool: _description_
+        bool: True if the filters were built, the previous filters are kept otherwise
     """
-    filters_clean()
+    global filter_holder  # noqa: PLW0603
     try:
-        filters = [SearchFilter.from_query(query)]
-        filters_add(filters)
+        filters = tuple(
+            curr_filter for filter_class in FILTERS if (curr_filter := filter_class.from_config()) is not None
+        )
     except MissingConfigError as mce:
         message = "Missing element in config"
         logger.exception(message, exc_info=mce)
         return False
+    filter_holder = filters
+    # Cached recommendations, kept results, breakers, limits, latencies and weights were those of the previous filters
+    get_recommendation_cache().clear()
+    get_fallback_store().clear()
+    circuit_breakers_reset()
+    concurrency_limiters_reset()
+    upstream_policies_reset()
+    score_fusion_reset()
+    logger.info("Filters built: %s", [f.filter_name for f in filters])
     return True
 
 
-def filters_get() -> list[AbstractFilter]:
-    """Return the list of all current filters"""
+def filters_get() -> tuple[AbstractFilter, ...]:
+    """Return the current filters, building them if it was not done at startup"""
+    if not filter_holder:
+        filters_regenerate()
     return filter_holder
 
 
+def filters_ready() -> tuple[AbstractFilter, ...]:
+    """Return the current filters able to answer now, the others are still loading their in-process state"""
+    return tuple(curr_filter for curr_filter in filters_get() if curr_filter.ready())
+
+
 def filters_add(filters: list[AbstractFilter]) -> None:
     """Add new filters in the filter_holder"""
-    filter_holder.extend(filters)
+    global filter_holder  # noqa: PLW0603
+    filter_holder = (*filter_holder, *filters)
 
 
 def filters_clean() -> None:
     """Clean all the element in the filter_holder"""
-    filter_holder.clear()
+    global filter_holder  # noqa: PLW0603
+    filter_holder = ()
+
+
+async def filters_start() -> None:
+    """Startup hook: build the filters and start loading their in-process state"""
+    filters_regenerate()
+    for curr_filter in filters_get():
+        curr_filter.start()
+
+
+async def filters_apply_events(batch: EventBatch) -> None:
+    """Update the in-process state of the filters with a batch of events"""
+    for curr_filter in filters_get():
+        try:
+            await curr_filter.apply_events(batch)
+        except Exception as e:
+            logger.exception("Filter %s failed to apply the events", curr_filter.filter_name, exc_info=e)
+
+
+async def filters_apply(
+    filters: Sequence[AbstractFilter], query: SearchQuery
+) -> tuple[list[Candidate], list[str]]:
+    """Return the list of all potential recommendations, compute based on the recommendation from each filters
 
+    The filters run concurrently, each one under its own timeout and all of them under the request deadline.
+    A filter that fails, is late or has its breaker open is replaced by its last good result for the query, if
+    any, and the merge goes on. Only the filters that answered are listed as contributors. The lists of the filters
+    are merged by the score fusion, keyed by filter and minor filter.
 
-async def filters_apply(filters: list[AbstractFilter]) -> list[RecommendableDocument]:
-    """Return the list of all potential recommendations, compute based on the recommendation from each filters"""
-    asset_dict = {}
+    Args:
+        filters (Sequence[AbstractFilter]): the filters to apply
+        query (SearchQuery): the query of the current request
+
+    Returns:
+        list[Candidate]: merged recommendations
+        list[str]: names of the filters that contributed to the recommendations
+    """
+    filter_results, contributors = await filters_apply_lists(filters, query)
+    return get_score_fusion().fuse(filter_results, query.poolOffset), contributors
+
+
+async def filters_apply_lists(
+    filters: Sequence[AbstractFilter], query: SearchQuery
+) -> tuple[dict[tuple[str, str], CandidateList], list[str]]:
+    """Same as filters_apply, the lists of the filters are returned before their fusion
+
+    Returns:
+        dict[tuple[str, str], CandidateList]: lists of the filters, by filter name and minor filter name
+        list[str]: names of the filters that contributed to the lists
+    """
+    with span("filters_apply"):
+        results = await _run_filters(filters, lambda curr_filter: curr_filter.apply(query))
+    filter_results: dict[tuple[str, str], CandidateList] = {}
+    contributors = []
     for curr_filter in filters:
-        if (filter_result := await curr_filter.apply()) is None:
-            logger.warning("Filter %s returns nothing", curr_filter.filter_name)
+        filter_name = curr_filter.filter_name
+        filter_result, answered = _result_or_fallback(filter_name, query, results.get(filter_name))
+        if filter_result is not None:
+            _add_lists(filter_results, filter_name, filter_result)
+        if answered:
+            contributors.append(filter_name)
+    return filter_results, contributors
+
+
+async def filters_apply_batch(
+    filters: Sequence[AbstractFilter], queries: Sequence[SearchQuery]
+) -> list[tuple[list[Candidate], list[str]]]:
+    """Same as filters_apply for several queries, each filter answers all of them at once (see apply_batch)
+
+    Returns:
+        list[tuple[list[Candidate], list[str]]]: merged recommendations and contributing filters of each query
+    """
+    with span("filters_apply"):
+        results = await _run_filters(filters, lambda curr_filter: curr_filter.apply_batch(queries))
+    fusion = get_score_fusion()
+    merged = []
+    for position, query in enumerate(queries):
+        filter_results: dict[tuple[str, str], CandidateList] = {}
+        contributors = []
+        for curr_filter in filters:
+            batch_results = results.get(curr_filter.filter_name)
+            filter_result, answered = _result_or_fallback(
+                curr_filter.filter_name, query, batch_results[position] if batch_results is not None else None
+            )
+            if filter_result is not None:
+                _add_lists(filter_results, curr_filter.filter_name, filter_result)
+            if answered:
+                contributors.append(curr_filter.filter_name)
+        merged.append((fusion.fuse(filter_results, query.poolOffset), contributors))
+    return merged
+
+
+def _add_lists(
+    filter_results: dict[tuple[str, str], CandidateList], filter_name: str, filter_result: dict[str, CandidateList]
+) -> None:
+    """Key the lists of a filter by its name and the name of their minor filter"""
+    for minor_name, asset_list in filter_result.items():
+        filter_results[filter_name, minor_name] = asset_list
+
+
+def _result_or_fallback(
+    filter_name: str, query: SearchQuery, filter_result: dict[str, CandidateList] | None
+) -> tuple[dict[str, CandidateList] | None, bool]:
+    """Keep the result of a filter in the fallback store, or take its last good result when it gave nothing
+
+    Returns:
+        dict[str, CandidateList] | None: the result to merge
+        bool: whether the filter answered
+    """
+    fallback_store = get_fallback_store()
+    key = fallback_key(filter_name, query)
+    if filter_result is not None:
+        fallback_store.put(key, filter_result)
+        return filter_result, True
+    if (filter_result := fallback_store.get(key)) is not None:
+        FALLBACKS.labels(filter_name, "last_good").inc()
+        logger.warning("Filter %s returns nothing, serving its last good result", filter_name)
+    else:
+        FALLBACKS.labels(filter_name, "none").inc()
+        logger.warning("Filter %s returns nothing", filter_name)
+    return filter_result, False
+
+
+async def _run_filters(
+    filters: Sequence[AbstractFilter], call: Callable[[AbstractFilter], Awaitable[T]]
+) -> dict[str, T | None]:
+    """Run the call of every filter concurrently under the timeouts, the filters with an open breaker are skipped.
+    The outcome and the duration of every call are recorded by the breaker of its filter. A call waits for a slot
+    of the concurrency limiter of its filter, and gives nothing when it is shed.
+
+    Returns:
+        dict[str, T | None]: result of each filter that answered in time, None for the failed or shed ones
+    """
+    config = current_config.get().get("filters", {})
+    request_timeout = config.get("request_timeout", DEFAULT_REQUEST_TIMEOUT)
+    filter_timeout = config.get("filter_timeout", DEFAULT_FILTER_TIMEOUT)
+
+    async def timed_call(curr_filter: AbstractFilter) -> T:
+        with span("filter", curr_filter.filter_name):
+            return await call(curr_filter)
+
+    async def guarded_call(curr_filter: AbstractFilter) -> T | None:
+        if (permit := await get_concurrency_limiter(curr_filter.filter_name).acquire()) is None:
+            logger.warning("Filter %s is overloaded, its call is shed", curr_filter.filter_name)
+            # The breaker let the call through, a trial not made must not hold the breaker half open
+            get_circuit_breaker(curr_filter.filter_name).release()
+            return None
+        with permit:
+            breaker = get_circuit_breaker(curr_filter.filter_name)
+            start = time.monotonic()
+            try:
+                result = await asyncio.wait_for(timed_call(curr_filter), curr_filter.timeout or filter_timeout)
+            except Exception:
+                breaker.record(False, time.monotonic() - start)
+                raise
+            answered = _answered(result)
+            breaker.record(answered, time.monotonic() - start)
+            permit.release(answered)
+            return result
+
+    tasks = {
+        curr_filter.filter_name: asyncio.create_task(guarded_call(curr_filter))
+        for curr_filter in filters
+        if get_circuit_breaker(curr_filter.filter_name).allow()
+    }
+    if tasks:
+        try:
+            await asyncio.wait(tasks.values(), timeout=request_timeout)
+        except asyncio.CancelledError:
+            for task in tasks.values():
+                task.cancel()
+            raise
+
+    results = {}
+    for filter_name, task in tasks.items():
+        if not task.done():
+            task.cancel()
+            get_circuit_breaker(filter_name).record(False, request_timeout)
+            logger.warning("Filter %s missed the request deadline of %ss", filter_name, request_timeout)
+        elif (exception := task.exception()) is not None:
+            if isinstance(exception, TimeoutError):
+                logger.warning("Filter %s timed out", filter_name)
+            else:
+                logger.error("Filter %s failed", filter_name, exc_info=exception)
         else:
-            asset_dict.update(filter_result)
+            results[filter_name] = task.result()
+    return results
+
 
-    return merge_asset_dicts(asset_dict)
+def _answered(result: object) -> bool:
+    """Whether the result of a call holds an answer, for apply_batch whether any query was answered"""
+    if isinstance(result, list):
+        return any(query_result is not None for query_result in result)
+    return result is not None
@@ -6,6 +6,9 @@ This requierement implies some modification on the SearchFilter class:
 - It's norm_and_pond methode is modified so it use the ponderation of each minor_filters
 """
 
+from collections.abc import Sequence
+from typing import Any
+
 from msfwk.context import current_config
 from msfwk.utils.logging import get_logger
 from pydantic import BaseModel
@@ -14,14 +17,17 @@ from recommendation.filters.abstract_filter import AbstractFilter
 from recommendation.filters.utils import normalize_and_ponderate_r_score
 from recommendation.models.exceptions import MissingConfigError
 from recommendation.models.interfaces import (
+    CandidateList,
     MultiSearchQuery,
-    RecommendAssetList,
     SearchQuery,
     SortQuery,
 )
 
 logger = get_logger(__name__)
 
+# Separates the position of the query from the minor filter name in the names of a batched multi-search
+BATCH_SEPARATOR = ":"
+
 
 class MinorSearchFilter(BaseModel):
     """One of the filter to operate on the Search service"""
@@ -54,10 +60,14 @@ class SearchFilter(AbstractFilter):
     ponderation: float = 1.0
     minor_filters: dict[str, MinorSearchFilter]
 
+    # Number of assets requested to the search service for each minor filter
+    limit: int = 20
+
     @classmethod
-    def from_query(cls, query: SearchQuery) -> "SearchFilter":
-        """Build object from query"""
-        search_service_url = current_config.get().get("services", {}).get("search", {}).get("host")
+    def from_config(cls) -> "SearchFilter":
+        """Build object from config"""
+        search_config = current_config.get().get("services", {}).get("search", {})
+        search_service_url = search_config.get("host")
         if search_service_url is None:
             message = "Missing search url from config"
             logger.error(message)
@@ -70,22 +80,60 @@ class SearchFilter(AbstractFilter):
             most_liked_filter.filter_name: most_liked_filter,
         }
 
-        payload = MultiSearchQuery(queries={m.filter_name: (query, m.sorts) for m in minor_filters.values()}, limit=20)
-
         return cls(
             url=search_service_url + "/" + "multi-search",
+            hedge_urls=[host + "/" + "multi-search" for host in search_config.get("hedge_hosts", [])],
             http_method="POST",
-            payload=payload.model_dump(mode="json"),
             minor_filters=minor_filters,
         )
 
-    async def _apply_norm_and_pond(self, asset_dict: dict[str, RecommendAssetList]) -> dict[str, RecommendAssetList]:
+    def build_payload(self, query: SearchQuery) -> dict[str, Any]:
+        """Build the multi-search payload"""
+        return self._payload(query, {name: (query, minor.sorts) for name, minor in self.minor_filters.items()})
+
+    def _payload(self, query: SearchQuery, queries: dict[str, tuple[SearchQuery, list[SortQuery]]]) -> dict[str, Any]:
+        """Dump the multi-search of the queries, for the window of the ranked lists requested by query (see
+        services.pool). The first window is requested without an offset
+        """
+        payload = MultiSearchQuery(queries=queries, limit=query.poolLimit or self.limit, offset=query.poolOffset)
+        return payload.model_dump(mode="json", exclude=None if query.poolOffset else {"offset"})
+
+    async def apply_batch(self, queries: Sequence[SearchQuery]) -> list[dict[str, CandidateList] | None]:
+        """Answer all the queries with a single multi-search, each query is normalized and ponderated on its own"""
+        if len(queries) == 1:
+            return [await self.apply(queries[0])]
+        # The queries of a batch are all first windows of the same size, see recommend_batch
+        payload = self._payload(
+            queries[0],
+            {
+                f"{position}{BATCH_SEPARATOR}{name}": (query, minor.sorts)
+                for position, query in enumerate(queries)
+                for name, minor in self.minor_filters.items()
+            },
+        )
+        if (asset_dict := await self._request(payload)) is None:
+            return [None] * len(queries)
+
+        asset_dicts: list[dict[str, CandidateList]] = [{} for _ in queries]
+        for batch_name, asset_list in asset_dict.items():
+            position, _, name = batch_name.partition(BATCH_SEPARATOR)
+            asset_dicts[int(position)][name] = asset_list
+        return [
+            await self._apply_norm_and_pond(query_asset_dict, query.poolMaxima)
+            for query, query_asset_dict in zip(queries, asset_dicts, strict=True)
+        ]
+
+    async def _apply_norm_and_pond(
+        self, asset_dict: dict[str, CandidateList], maxima: dict[str, float] | None = None
+    ) -> dict[str, CandidateList]:
         """Normalize and ponderate
 
         Args:
-            asset_dict (dict[str, list[RecommendAssetList]]): _description_
+            asset_dict (dict[str, CandidateList]): _description_
+            maxima (dict[str, float] | None): normalization max of the fields, the max of each list otherwise
         """
+        maxima = maxima or {}
         for filter_name in self.minor_filters:
             if (asset_list := asset_dict.get(filter_name)) is not None:
-                normalize_and_ponderate_r_score(filter_name, self.ponderation, asset_list)
+                normalize_and_ponderate_r_score(filter_name, self.ponderation, asset_list, maxima.get(filter_name))
         return asset_dict
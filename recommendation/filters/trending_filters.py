@@ -0,0 +1,102 @@
+"""Filters recommending the assets trending now instead of the all-time most liked/downloaded.
+
+The TrendingFilter answers from the decayed like/download counters of the events (see
+recommendation.services.trending). The decayed counter of a candidate is its ``trending_score`` extracted field,
+normalized and ponderated like the likes_count and downloads_count lists of the SearchFilter. The filter is left
+out of the requests until an interaction was counted, and until the documents of the interaction log are loaded at
+startup.
+"""
+
+import asyncio
+
+from msfwk.context import current_config
+from msfwk.utils.logging import get_logger
+from pydantic import PrivateAttr
+
+from recommendation.filters.abstract_filter import AbstractFilter
+from recommendation.filters.utils import normalize_and_ponderate_r_score
+from recommendation.models.interfaces import Candidate, CandidateList, EventBatch, ExtractedField, SearchQuery
+from recommendation.services.collaborative import load_interactions
+from recommendation.services.trending import get_trending_index
+
+logger = get_logger(__name__)
+
+TRENDING_FIELD = ExtractedField(name="trending_score", ponderation=1.0)
+
+
+class TrendingFilter(AbstractFilter):
+    """Filter on the decayed like/download counters of the assets"""
+
+    filter_name: str = "Trending Filter"
+    # Name of the candidate list returned by the filter, also the name of the normalized field
+    result_name: str = TRENDING_FIELD.name
+    url: str = ""
+    ponderation: float = TRENDING_FIELD.ponderation
+    event_weights: dict[str, float] | None = None
+    # Interaction log whose asset documents are known before their first event (see the collaborative filter)
+    documents_path: str | None = None
+    limit: int = 20
+    _loading: asyncio.Task | None = PrivateAttr(default=None)
+
+    @classmethod
+    def from_config(cls) -> "TrendingFilter | None":
+        """Build object from the ``trending`` section of the config, None when it is not enabled"""
+        config = current_config.get().get("trending", {})
+        if not config.get("enabled", False):
+            return None
+        return cls(
+            event_weights=config.get("event_weights"),
+            documents_path=config.get("documents", current_config.get().get("collaborative", {}).get("interactions")),
+            limit=config.get("limit", 20),
+            ponderation=config.get("ponderation", TRENDING_FIELD.ponderation),
+        )
+
+    def start(self) -> None:
+        """Load the documents of the interaction log in background"""
+        if self._loading is None:
+            self._loading = asyncio.create_task(self._load_documents())
+
+    async def _load_documents(self) -> None:
+        if self.documents_path is None:
+            return
+        try:
+            _, documents = await load_interactions(self.documents_path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.exception("Failed to load the documents of filter '%s'", self.filter_name, exc_info=e)
+            return
+        # The documents received in events since are more recent
+        get_trending_index().add_documents(documents, replace=False)
+
+    def ready(self) -> bool:
+        """Ready once the documents are loaded and an interaction was counted, an empty list is no answer"""
+        self.start()
+        return self._loading.done() and len(get_trending_index().counters) > 0
+
+    async def apply_events(self, batch: EventBatch) -> None:
+        """Count the likes and downloads of the batch, a constant time per asset"""
+        get_trending_index().apply_events(batch, self.event_weights)
+
+    def rescore(self, name: str, asset_list: CandidateList) -> bool:  # noqa: ARG002
+        """Score again the candidates with their current decayed counter, not the one they were returned with"""
+        index = get_trending_index()
+        for candidate in asset_list.assets:
+            # The raw payload is shared with the previous lists, it is replaced instead of updated
+            candidate.raw = {**candidate.raw, TRENDING_FIELD.name: index.counters.value(candidate.id)}
+            candidate.r_score = 0.0
+        normalize_and_ponderate_r_score(TRENDING_FIELD.name, self.ponderation, asset_list)
+        return True
+
+    async def apply(self, query: SearchQuery) -> dict[str, CandidateList] | None:
+        """Recommend the assets liked and downloaded the most lately, among the ones matching the query"""
+        # The whole result is returned with the first window of the candidate pool, and the text of a query
+        # can only be matched by the search service
+        if query.poolOffset or query.text.strip():
+            return {}
+        documents, values = get_trending_index().top(query, self.limit)
+        candidates = CandidateList(
+            [
+                Candidate({**document, TRENDING_FIELD.name: value})
+                for document, value in zip(documents, values, strict=True)
+            ]
+        )
+        return {self.result_name: normalize_and_ponderate_r_score(TRENDING_FIELD.name, self.ponderation, candidates)}
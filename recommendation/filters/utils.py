@@ -1,32 +1,51 @@
+import logging
+from typing import Any
+
+import numpy as np
 from msfwk.utils.logging import get_logger
 
-from recommendation.models.interfaces import RecommendAssetList
+from recommendation.models.interfaces import Candidate, CandidateList, SearchQuery
+from recommendation.services.scoring import extract_field, normalize_and_ponderate
+from recommendation.services.timing import span
 
 logger = get_logger(__name__)
 
 
 def normalize_and_ponderate_r_score(
-    normalize_field: str, ponderation: float, asset_list: RecommendAssetList
-) -> RecommendAssetList:
+    normalize_field: str, ponderation: float, asset_list: CandidateList, max_value: float | None = None
+) -> CandidateList:
     """Normalize and Ponderate the assets based on the field_to_ponderate
-    Modify in place the asset_list
+    Modify in place the asset_list. max_value overrides the max of the list (next windows of a ranked list)
     """
     logger.debug("Start Normalization and Ponderation of recommendable assets")
     if len(asset_list.assets) == 0:
         return asset_list
 
-    # Get the max value of the field_to_ponderate
-    max_value = (
-        max(asset_list.assets, key=lambda asset: asset.to_dict().get(normalize_field, 0))
-        .to_dict()
-        .get(normalize_field, 0)
-    )
-    max_value = max(max_value, 0.01)
-    logger.debug("max_value of %s for normalization: %s", normalize_field, max_value)
-
-    # Normalize and Ponderate the assets
-    for asset in asset_list.assets:
-        asset.r_score += (asset.to_dict().get(normalize_field, 0) / max_value) * ponderation
+    with span("normalize"):
+        r_scores = extract_field(asset_list.assets, "r_score") + normalize_and_ponderate(
+            extract_field(asset_list.assets, normalize_field), ponderation, max_value
+        )
+        for asset, r_score in zip(asset_list.assets, r_scores.tolist(), strict=True):
+            asset.r_score = r_score
 
-    logger.debug("all ponderated r_scores: %s", {asset.id: asset.r_score for asset in asset_list.assets})
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("all ponderated r_scores: %s", {asset.id: asset.r_score for asset in asset_list.assets})
     return asset_list
+
+
+def scored_candidate_list(documents: list[dict[str, Any]], scores: list[float], ponderation: float) -> CandidateList:
+    """Candidates of the documents, scored by their normalized and ponderated score"""
+    candidates = [Candidate(document) for document in documents]
+    r_scores = normalize_and_ponderate(np.asarray(scores, dtype=np.float64), ponderation)
+    for candidate, r_score in zip(candidates, r_scores.tolist(), strict=True):
+        candidate.r_score += r_score
+    return CandidateList(candidates)
+
+
+def document_matches(document: dict[str, Any], query: SearchQuery) -> bool:
+    """Whether an asset document satisfies the type, source and category criteria of the query"""
+    if query.documentType is not None and document.get("documentType") != query.documentType.value:
+        return False
+    if query.documentSource is not None and document.get("source") != query.documentSource.value:
+        return False
+    return not query.documentCategory or document.get("categoryId") in query.documentCategory
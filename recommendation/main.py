@@ -1,8 +1,21 @@
 from msfwk.application import app
 from msfwk.utils.logging import get_logger
 
+from recommendation.filters.filter_holder import filters_start
 from recommendation.routes.recommend import router as recommend_router
+from recommendation.services.events import events_start, events_stop
+from recommendation.services.http_client import http_client_start, http_client_stop
+from recommendation.services.popularity import popularity_start, popularity_stop
+from recommendation.services.shared_cache import shared_cache_stop
 
 logger = get_logger("application")
 
 app.include_router(recommend_router)
+app.add_event_handler("startup", http_client_start)
+app.add_event_handler("startup", filters_start)
+app.add_event_handler("startup", popularity_start)
+app.add_event_handler("startup", events_start)
+app.add_event_handler("shutdown", events_stop)
+app.add_event_handler("shutdown", popularity_stop)
+app.add_event_handler("shutdown", http_client_stop)
+app.add_event_handler("shutdown", shared_cache_stop)
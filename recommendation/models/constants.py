@@ -1,13 +1,18 @@
+from recommendation.filters.collaborative_filters import CollaborativeFilter
+from recommendation.filters.content_filters import ContentFilter
 from recommendation.filters.search_filters import SearchFilter
+from recommendation.filters.trending_filters import TRENDING_FIELD, TrendingFilter
 from recommendation.models.interfaces import ExtractedField
 
 FAILED_TO_RECOMMEND_ASSET = 19001
 MISSING_TYPE_IN_REQUEST = 19002
+RECOMMENDATION_OVERLOADED = 19003
 
 TOP_K_RECOMMENDATIONS = 20
 TOP_K_FIELDS = {
     "likes_count": ExtractedField(name="likes_count", ponderation=3),
     "downloads_count": ExtractedField(name="downloads_count", ponderation=2),
+    TRENDING_FIELD.name: TRENDING_FIELD,
 }
 
-FILTERS = [SearchFilter]
+FILTERS = [SearchFilter, CollaborativeFilter, ContentFilter, TrendingFilter]
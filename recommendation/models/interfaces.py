@@ -1,13 +1,17 @@
 import json
 from datetime import datetime
-from typing import Any
+from typing import Any, Literal
 
 from despsharedlibrary.schemas.collaborative_schema import AssetType, SourceType
 from msfwk.utils.logging import get_logger
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 
 logger = get_logger(__name__)
 ISO_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%f%z"  # +00:00 comes from UTC
+# Contexts accepted in a single batch request
+MAX_BATCH_CONTEXTS = 20
+# Re-ranking of the merged candidates, see services.diversity
+DiversityMode = Literal["none", "mmr", "quota"]
 
 
 class SearchableDocument(BaseModel):
@@ -97,9 +101,118 @@ class RecommendAssetList(BaseModel):
         }
     )
 
-    def __init__(self, assets: list[RecommendableDocument], count: int | None = None) -> "RecommendAssetList":
+    def __init__(
+        self, assets: list[RecommendableDocument], count: int | None = None, **data: Any
+    ) -> "RecommendAssetList":
         """Build the SearchResponse based on the assets list"""
-        super().__init__(assets=assets, count=count if count is not None else len(assets))
+        super().__init__(assets=assets, count=count if count is not None else len(assets), **data)
+
+
+class RecommendResponse(RecommendAssetList):
+    """Hold the recommendations returned to the client"""
+
+    # Names of the filters whose results were merged into the recommendations
+    contributing_filters: list[str] = []
+
+    @staticmethod
+    def dump_data(assets: list[dict[str, Any]], count: int, contributing_filters: list[str]) -> dict[str, Any]:
+        """Same output as model_dump(mode="json"), from assets already dumped (see Candidate.to_document_dict)"""
+        return {"count": count, "assets": assets, "contributing_filters": contributing_filters}
+
+
+class RecommendContext(BaseModel):
+    """One recommendation context of a batch, same criteria as the parameters of GET /recommend"""
+
+    q: str = ""
+    type: AssetType | None = None  # noqa: A003
+    categories: list[str] | None = None
+    source: SourceType | None = None
+    offset: int = 0
+    limit: int = 10
+    assets: list[str] | None = None
+    diversity: DiversityMode | None = None
+
+    def to_query(self) -> "SearchQuery":
+        """The SearchQuery of the context"""
+        return SearchQuery(
+            text=self.q,
+            documentType=self.type,
+            documentSource=self.source,
+            documentCategory=self.categories or None,
+            seedAssets=self.assets or None,
+        )
+
+
+class BatchRecommendRequest(BaseModel):
+    """Body of POST /recommend/batch"""
+
+    contexts: list[RecommendContext] = Field(min_length=1, max_length=MAX_BATCH_CONTEXTS)
+
+
+class BatchRecommendResponse(BaseModel):
+    """The recommendations of each context of a batch, in the order of the request"""
+
+    results: list[RecommendResponse]
+
+    @staticmethod
+    def dump_data(results: list[dict[str, Any]]) -> dict[str, Any]:
+        """Same output as model_dump(mode="json"), from RecommendResponse.dump_data of each context"""
+        return {"results": results}
+
+
+class Candidate:
+    """Compact record of an asset while it is scored: its id, its ranking fields and its raw payload.
+    The RecommendableDocument is only validated for the candidates of the returned page.
+    """
+
+    __slots__ = ("id", "likes_count", "downloads_count", "r_score", "raw", "_document_dict")
+
+    def __init__(self, raw: dict[str, Any]) -> None:
+        self.raw = raw
+        self.id: str = raw["id"]
+        # Same defaults as SearchableDocument
+        self.likes_count: int = raw.get("likes_count", 0)
+        self.downloads_count: int = raw.get("downloads_count", -1)
+        self.r_score: float = raw.get("r_score", 0.0)
+        self._document_dict: dict[str, Any] | None = None
+
+    def __getattr__(self, name: str) -> Any:
+        """The other ranking fields (see TOP_K_FIELDS) are read from the raw payload, 0 when the asset has none"""
+        if name.startswith("_") or name == "raw":
+            raise AttributeError(name)
+        return self.raw.get(name, 0)
+
+    @property
+    def name(self) -> str:
+        """Name of the asset"""
+        return self.raw.get("name", "")
+
+    def to_document(self) -> RecommendableDocument:
+        """Validate the raw payload into a RecommendableDocument carrying the computed r_score"""
+        return RecommendableDocument(**{**self.raw, "r_score": self.r_score})
+
+    def to_document_dict(self) -> dict[str, Any]:
+        """The JSON-ready dump of to_document(), validated once: a cached candidate is served by several pages.
+        The r_score is taken at each call, the candidate may be scored again meanwhile.
+        """
+        if self._document_dict is None:
+            self._document_dict = self.to_document().model_dump(mode="json")
+        return {**self._document_dict, "r_score": self.r_score}
+
+
+class CandidateList:
+    """Candidates returned by a filter, the compact counterpart of RecommendAssetList"""
+
+    __slots__ = ("count", "assets")
+
+    def __init__(self, assets: list[Candidate], count: int | None = None) -> None:
+        self.assets = assets
+        self.count = count if count is not None else len(assets)
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "CandidateList":
+        """Build from a RecommendAssetList payload ({"count": ..., "assets": [...]})"""
+        return cls([Candidate(raw) for raw in data["assets"]], data.get("count"))
 
 
 class SearchQuery(BaseModel):
@@ -110,6 +223,13 @@ class SearchQuery(BaseModel):
     documentCategory: list[str] | None = None  # noqa: N815
     metadatas: dict[str, int | str] | None = None
     text: str
+    # Recommendation context, not part of the search criteria sent to the search service
+    seedAssets: list[str] | None = Field(default=None, exclude=True)  # noqa: N815
+    # Window of each ranked list requested from the filters, see services.pool
+    poolOffset: int = Field(default=0, exclude=True)  # noqa: N815
+    poolLimit: int | None = Field(default=None, exclude=True)  # noqa: N815
+    # Normalization maxima of the fields, from the first window, used for the next windows
+    poolMaxima: dict[str, float] | None = Field(default=None, exclude=True)  # noqa: N815
 
     model_config = ConfigDict(json_encoders={AssetType: lambda at: at.value, SourceType: lambda st: st.value})
 
@@ -129,7 +249,9 @@ class MultiSearchQuery(BaseModel):
     """Hold multiple search criteria with different sort orders"""
 
     queries: dict[str, tuple[SearchQuery, list[SortQuery]]]
+    # Window of each ranked list, see services.pool
     limit: int
+    offset: int = 0
 
     model_config = ConfigDict(
         json_encoders={
@@ -154,6 +276,47 @@ class ToRecommendResponse(BaseModel):
     )
 
 
+def parse_candidate_lists(data: dict[str, Any]) -> dict[str, CandidateList]:
+    """Read the candidates of a multi-search response data ({"results": {name: RecommendAssetList}})"""
+    return {name: CandidateList.from_dict(result) for name, result in data["results"].items()}
+
+
+class AssetEvent(BaseModel):
+    """An asset or interaction event received from the message queue"""
+
+    event: Literal["asset_created", "asset_updated", "liked", "downloaded"]
+    asset_id: str
+    # The user who liked or downloaded the asset
+    user_id: str | None = None
+    # The asset as returned by the search service, for the asset_created and asset_updated events
+    document: dict[str, Any] | None = None
+
+
+class EventBatch:
+    """Events of a micro-batch, aggregated in the form the in-process structures are updated with"""
+
+    __slots__ = ("interactions", "count_deltas", "documents")
+
+    # Counter of the asset incremented by each interaction event
+    COUNTED_FIELDS = {"liked": "likes_count", "downloaded": "downloads_count"}
+
+    def __init__(self, events: list[AssetEvent]) -> None:
+        # (user_id, asset_id, event) of the interactions
+        self.interactions: list[tuple[str, str, str]] = []
+        # asset_id -> field -> increment
+        self.count_deltas: dict[str, dict[str, int]] = {}
+        # asset_id -> latest document
+        self.documents: dict[str, dict[str, Any]] = {}
+        for event in events:
+            if event.document is not None:
+                self.documents[event.asset_id] = {**event.document, "id": event.asset_id}
+            if (field := self.COUNTED_FIELDS.get(event.event)) is not None:
+                deltas = self.count_deltas.setdefault(event.asset_id, {})
+                deltas[field] = deltas.get(field, 0) + 1
+                if event.user_id is not None:
+                    self.interactions.append((event.user_id, event.asset_id, event.event))
+
+
 class ExtractedField(BaseModel):
     """Contains the fields to extract from the search response"""
 
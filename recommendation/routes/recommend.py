@@ -5,14 +5,21 @@ from msfwk.models import BaseDespResponse, DespResponse
 from msfwk.utils.logging import get_logger
 from pydantic import BaseModel
 
-from recommendation.filters.filter_holder import filters_get, filters_regenerate
+from recommendation.filters.filter_holder import filters_ready
 from recommendation.models.constants import (
     FAILED_TO_RECOMMEND_ASSET,
     MISSING_TYPE_IN_REQUEST,
+    RECOMMENDATION_OVERLOADED,
 )
 from recommendation.models.exceptions import RecommendationFailedError
-from recommendation.models.interfaces import RecommendAssetList
-from recommendation.services.filter_methods import recommend
+from recommendation.models.interfaces import (
+    BatchRecommendRequest,
+    BatchRecommendResponse,
+    DiversityMode,
+    RecommendResponse,
+)
+from recommendation.services.concurrency import ROUTE, ROUTE_LIMITER, SHED_REQUESTS, get_concurrency_limiter
+from recommendation.services.filter_methods import recommend, recommend_batch, recommend_shed
 from recommendation.services.utils import build_query
 
 __all__ = ["router"]
@@ -26,10 +33,18 @@ class RequestBody(BaseModel):
     description: str
 
 
+def _overloaded(data: dict) -> DespResponse:
+    """Quick rejection of a request shed by the admission control that could not be answered without the filters"""
+    SHED_REQUESTS.labels("rejected").inc()
+    message = "Too many recommendations in progress, retry later"
+    logger.warning(message)
+    return DespResponse(data=data, error=message, code=RECOMMENDATION_OVERLOADED, http_status=503)
+
+
 @router.get(
     "/recommend",
     summary="recommend from search based on criteria",
-    response_model=BaseDespResponse[RecommendAssetList],
+    response_model=BaseDespResponse[RecommendResponse],
     response_description="The list of assets matching the criteria",
     tags=["search"],
     openapi_extra=openapi_extra(secured=False, roles=[]),
@@ -37,12 +52,19 @@ class RequestBody(BaseModel):
 async def recommend_assets(  # noqa: PLR0913
     q: str = "",
     type: AssetType | None = None,  # noqa: A002
-    categories: str | None = None,  # noqa: ARG001
+    categories: str | None = None,
     source: SourceType | None = None,
-    offset: int = 0,  # noqa: ARG001
-    limit: int = 10,  # noqa: ARG001
-) -> DespResponse[RecommendAssetList]:
-    """Recommend"""
+    offset: int = 0,
+    limit: int = 10,
+    assets: str | None = None,
+    diversity: DiversityMode | None = None,
+) -> DespResponse[RecommendResponse]:
+    """Recommend
+
+    assets (comma separated asset ids) seed the collaborative filter with "more like these"
+    diversity re-ranks the recommendations (mmr or quota, none to disable), the configured mode by default
+    Under load, the request may be answered from the cache or the popularity table, or rejected with a 503
+    """
     logger.info("Recommending assets... with q=%s, type=%s, source=%s", q, type, source)
     if type is None:
         message = "Missing type in the request. Consider using type={dataset/model/paper/application/other}"
@@ -54,25 +76,94 @@ async def recommend_assets(  # noqa: PLR0913
             http_status=400,
         )
     try:
-        query = build_query(q, type, source, categories)
-        if not filters_regenerate(query):
-            logger.error("Failed to build filters for recommendations")
+        query = build_query(q, type, source, categories, assets)
+        if not (filters := filters_ready()):
+            message = "Failed to build filters for recommendations"
+            logger.error(message)
             return DespResponse(
-                data=RecommendAssetList(assets=[]).model_dump(mode="json"),
-                error=str(e),
+                data=RecommendResponse(assets=[]).model_dump(mode="json"),
+                error=message,
                 code=FAILED_TO_RECOMMEND_ASSET,
                 http_status=500,
             )
-        filters = filters_get()
-        recommended_assets, tot_recommended_assets = await recommend(filters, offset, limit)
+        if (permit := await get_concurrency_limiter(ROUTE_LIMITER, ROUTE).acquire()) is None:
+            if (shed := recommend_shed(query, offset, limit, diversity)) is None:
+                return _overloaded(RecommendResponse(assets=[]).model_dump(mode="json"))
+            recommended_assets, tot_recommended_assets, contributors = shed
+        else:
+            with permit:
+                recommended_assets, tot_recommended_assets, contributors = await recommend(
+                    filters, query, offset, limit, diversity
+                )
         logger.debug("Found assets: %s", recommended_assets)
         return DespResponse(
-            data=RecommendAssetList(assets=recommended_assets, count=tot_recommended_assets).model_dump(mode="json")
+            data=RecommendResponse.dump_data(recommended_assets, tot_recommended_assets, contributors)
         )
     except RecommendationFailedError as e:
         logger.exception("Failed to perform recommendation for", exc_info=e)
         return DespResponse(
-            data=RecommendAssetList(assets=[]).model_dump(mode="json"),
+            data=RecommendResponse(assets=[]).model_dump(mode="json"),
+            error=str(e),
+            code=FAILED_TO_RECOMMEND_ASSET,
+            http_status=500,
+        )
+
+
+@router.post(
+    "/recommend/batch",
+    summary="recommend for several contexts at once",
+    response_model=BaseDespResponse[BatchRecommendResponse],
+    response_description="The list of assets matching each context, in the order of the request",
+    tags=["search"],
+    openapi_extra=openapi_extra(secured=False, roles=[]),
+)
+async def recommend_assets_batch(body: BatchRecommendRequest) -> DespResponse[BatchRecommendResponse]:
+    """Recommend for each context of the body, e.g. one carousel per asset type.
+    All the contexts are answered with a single call to the search service.
+    Under load, they may be answered from the cache or the popularity table, or rejected with a 503
+    """
+    logger.info("Recommending assets for %s contexts", len(body.contexts))
+    if any(context.type is None for context in body.contexts):
+        message = "Missing type in a context. Consider using type={dataset/model/paper/application/other}"
+        logger.error(message)
+        return DespResponse(
+            data={},
+            error=message,
+            code=MISSING_TYPE_IN_REQUEST,
+            http_status=400,
+        )
+    try:
+        if not (filters := filters_ready()):
+            message = "Failed to build filters for recommendations"
+            logger.error(message)
+            return DespResponse(
+                data=BatchRecommendResponse(results=[]).model_dump(mode="json"),
+                error=message,
+                code=FAILED_TO_RECOMMEND_ASSET,
+                http_status=500,
+            )
+        requests = [(context.to_query(), context.offset, context.limit, context.diversity) for context in body.contexts]
+        if (permit := await get_concurrency_limiter(ROUTE_LIMITER, ROUTE).acquire()) is None:
+            # The contexts that cannot be answered without the filters are left empty
+            shed = [recommend_shed(*request) for request in requests]
+            if all(result is None for result in shed):
+                return _overloaded(BatchRecommendResponse(results=[]).model_dump(mode="json"))
+            results = [result if result is not None else ([], 0, []) for result in shed]
+        else:
+            with permit:
+                results = await recommend_batch(filters, requests)
+        return DespResponse(
+            data=BatchRecommendResponse.dump_data(
+                [
+                    RecommendResponse.dump_data(recommended_assets, tot_recommended_assets, contributors)
+                    for recommended_assets, tot_recommended_assets, contributors in results
+                ]
+            )
+        )
+    except RecommendationFailedError as e:
+        logger.exception("Failed to perform batch recommendation", exc_info=e)
+        return DespResponse(
+            data=BatchRecommendResponse(results=[]).model_dump(mode="json"),
             error=str(e),
             code=FAILED_TO_RECOMMEND_ASSET,
             http_status=500,
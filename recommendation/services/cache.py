@@ -0,0 +1,238 @@
+"""Result cache of the merged and scored recommendations.
+
+The entries are keyed on the normalized SearchQuery and hold the whole candidate list before pagination, so
+every offset/limit page of a query is served by the same entry. Settings come from the ``cache`` section of
+the config.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable
+from dataclasses import dataclass
+from typing import Any
+
+from msfwk.context import current_config
+from msfwk.utils.logging import get_logger
+from prometheus_client import Counter, Gauge
+
+from recommendation.models.interfaces import SearchQuery
+
+logger = get_logger(__name__)
+
+DEFAULT_TTL = 60.0
+DEFAULT_STALE_TTL = 300.0
+DEFAULT_MAX_CANDIDATES = 50_000
+
+CACHE_REQUESTS = Counter(
+    "recommendation_cache_requests_total",
+    "Lookups in the recommendation cache, by result (hit, stale, miss)",
+    ["result"],
+)
+CACHE_EVICTIONS = Counter("recommendation_cache_evictions_total", "Entries evicted from the recommendation cache")
+CACHE_CANDIDATES = Gauge("recommendation_cache_candidates", "Candidates currently held by the recommendation cache")
+
+
+def query_cache_key(query: SearchQuery) -> tuple[Hashable, ...]:
+    """Normalized key of a query: same criteria in a different order or spacing give the same key. The case is kept,
+    the criteria are matched by the search service as they are
+    """
+    return (
+        " ".join(query.text.split()),
+        query.documentType.value if query.documentType is not None else None,
+        query.documentSource.value if query.documentSource is not None else None,
+        tuple(sorted({category.strip() for category in query.documentCategory or [] if category.strip()})),
+        tuple(sorted((query.metadatas or {}).items())),
+        tuple(sorted(set(query.seedAssets or []))),
+    )
+
+
+@dataclass(slots=True)
+class CacheEntry:
+    """A cached value and what it costs in the cache budget"""
+
+    value: Any
+    size: int
+    created_at: float
+
+
+class RecommendationCache:
+    """LRU cache with a TTL, bounded by the number of candidates it holds.
+
+    An entry younger than ``ttl`` is fresh. Until ``ttl + stale_ttl`` it is stale: it is still served while
+    a single background task refreshes it. Past that it is a miss. A clear starts a new generation: the refreshes
+    in flight are cancelled, and a value computed before the clear is not stored.
+    """
+
+    def __init__(
+        self,
+        ttl: float = DEFAULT_TTL,
+        stale_ttl: float = DEFAULT_STALE_TTL,
+        max_candidates: int = DEFAULT_MAX_CANDIDATES,
+    ) -> None:
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_candidates = max_candidates
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[Hashable, CacheEntry] = OrderedDict()
+        self._candidates = 0
+        self._refreshing: dict[Hashable, asyncio.Task] = {}
+        self._generation = 0
+
+    @classmethod
+    def from_config(cls) -> "RecommendationCache":
+        """Build the cache from the ``cache`` section of the config"""
+        config = current_config.get().get("cache", {})
+        return cls(
+            ttl=config.get("ttl", DEFAULT_TTL),
+            stale_ttl=config.get("stale_ttl", DEFAULT_STALE_TTL),
+            max_candidates=config.get("max_candidates", DEFAULT_MAX_CANDIDATES),
+        )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def generation(self) -> int:
+        """Number of clears so far, to pass to set for a value computed from it"""
+        return self._generation
+
+    @property
+    def candidates(self) -> int:
+        """Number of candidates held by all the entries"""
+        return self._candidates
+
+    def get(self, key: Hashable) -> tuple[Any, bool] | None:
+        """Return the cached value and whether it is stale, None if it is missing or expired"""
+        if (entry := self._entries.get(key)) is None:
+            return None
+        age = time.monotonic() - entry.created_at
+        if age > self.ttl + self.stale_ttl:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry.value, age > self.ttl
+
+    def set(self, key: Hashable, value: Any, size: int = 1, generation: int | None = None) -> None:
+        """Store a value, evicting the least recently used entries to stay in the budget.
+        A value computed in an older generation than the current one (before a clear) is dropped.
+        """
+        if generation is not None and generation != self._generation:
+            logger.debug("Not caching %s: computed before the cache was cleared", key)
+            return
+        if size > self.max_candidates:
+            logger.debug("Not caching %s: %s candidates is over the cache budget", key, size)
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = CacheEntry(value=value, size=size, created_at=time.monotonic())
+        self._candidates += size
+        while self._candidates > self.max_candidates:
+            evicted_key, _ = next(iter(self._entries.items()))
+            self._remove(evicted_key)
+            self.evictions += 1
+            CACHE_EVICTIONS.inc()
+        CACHE_CANDIDATES.set(self._candidates)
+
+    def clear(self) -> None:
+        """Drop all the entries and cancel their refreshes"""
+        self._generation += 1
+        for task in self._refreshing.values():
+            task.cancel()
+        self._refreshing = {}
+        self._entries.clear()
+        self._candidates = 0
+        CACHE_CANDIDATES.set(0)
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key)
+        self._candidates -= entry.size
+        CACHE_CANDIDATES.set(self._candidates)
+
+    def lookup(self, key: Hashable) -> Any | None:
+        """Return the fresh cached value of the key, None on a miss or a stale entry the caller recomputes"""
+        if (cached := self.get(key)) is None:
+            self.misses += 1
+            CACHE_REQUESTS.labels("miss").inc()
+            return None
+        value, stale = cached
+        if stale:
+            self.stale_hits += 1
+            CACHE_REQUESTS.labels("stale").inc()
+            return None
+        self.hits += 1
+        CACHE_REQUESTS.labels("hit").inc()
+        return value
+
+    async def get_or_compute(
+        self,
+        key: Hashable,
+        compute: Callable[[], Awaitable[Any]],
+        size_of: Callable[[Any], int] = lambda _: 1,
+        cacheable: Callable[[Any], bool] = lambda _: True,
+    ) -> Any:
+        """Return the cached value of the key, computing it on a miss and refreshing it in background when stale
+
+        Args:
+            key (Hashable): cache key, see query_cache_key
+            compute (Callable[[], Awaitable[Any]]): builds the value
+            size_of (Callable[[Any], int]): cost of a value in the cache budget
+            cacheable (Callable[[Any], bool]): whether a computed value may be stored (e.g. not a degraded one)
+        """
+        if (cached := self.get(key)) is not None:
+            value, stale = cached
+            if stale:
+                self.stale_hits += 1
+                CACHE_REQUESTS.labels("stale").inc()
+                self._refresh_in_background(key, compute, size_of, cacheable)
+            else:
+                self.hits += 1
+                CACHE_REQUESTS.labels("hit").inc()
+            return value
+
+        self.misses += 1
+        CACHE_REQUESTS.labels("miss").inc()
+        generation = self._generation
+        value = await compute()
+        if cacheable(value):
+            self.set(key, value, size_of(value), generation)
+        return value
+
+    def _refresh_in_background(
+        self,
+        key: Hashable,
+        compute: Callable[[], Awaitable[Any]],
+        size_of: Callable[[Any], int],
+        cacheable: Callable[[Any], bool],
+    ) -> None:
+        if key in self._refreshing:
+            return
+        generation = self._generation
+        refreshing = self._refreshing
+
+        async def refresh() -> None:
+            try:
+                value = await compute()
+                if cacheable(value):
+                    self.set(key, value, size_of(value), generation)
+            except Exception as e:
+                logger.exception("Failed to refresh the cache entry %s", key, exc_info=e)
+            finally:
+                # The refreshes of a cleared cache were dropped with their dict
+                refreshing.pop(key, None)
+
+        refreshing[key] = asyncio.create_task(refresh())
+
+
+_recommendation_cache: RecommendationCache | None = None
+
+
+def get_recommendation_cache() -> RecommendationCache:
+    """Return the process-wide recommendation cache"""
+    global _recommendation_cache  # noqa: PLW0603
+    if _recommendation_cache is None:
+        _recommendation_cache = RecommendationCache.from_config()
+    return _recommendation_cache
@@ -0,0 +1,158 @@
+"""Circuit breakers of the filters.
+
+Each filter has a breaker tracking its last ``window`` calls. A failed call (an error, a timeout or no answer)
+and a call slower than ``slow_call_seconds`` both count as failures. When the share of failures reaches
+``failure_rate`` over at least ``min_calls`` calls, the breaker opens: the filter is not called for
+``open_seconds``, then a single trial call is let through. The breaker closes if the trial succeeds and opens
+again otherwise. Settings come from the ``circuit_breaker`` section of the config.
+"""
+
+import time
+from collections import deque
+
+from msfwk.context import current_config
+from msfwk.utils.logging import get_logger
+from prometheus_client import Counter, Gauge
+
+logger = get_logger(__name__)
+
+DEFAULT_WINDOW = 20
+DEFAULT_MIN_CALLS = 10
+DEFAULT_FAILURE_RATE = 0.5
+DEFAULT_SLOW_CALL_SECONDS = 1.0
+DEFAULT_OPEN_SECONDS = 30.0
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+# Value of each state in the state gauge
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+CIRCUIT_STATE = Gauge(
+    "recommendation_circuit_state",
+    "State of the circuit breaker of each filter (0 closed, 1 half open, 2 open)",
+    ["filter"],
+)
+CIRCUIT_TRANSITIONS = Counter(
+    "recommendation_circuit_transitions_total",
+    "State changes of the circuit breakers, by filter and new state",
+    ["filter", "state"],
+)
+CIRCUIT_REJECTED = Counter(
+    "recommendation_circuit_rejected_total", "Filter calls not made because the breaker is open", ["filter"]
+)
+
+
+class CircuitBreaker:
+    """Breaker of a filter, see the module docstring"""
+
+    def __init__(  # noqa: PLR0913
+        self,
+        name: str,
+        enabled: bool = True,
+        window: int = DEFAULT_WINDOW,
+        min_calls: int = DEFAULT_MIN_CALLS,
+        failure_rate: float = DEFAULT_FAILURE_RATE,
+        slow_call_seconds: float = DEFAULT_SLOW_CALL_SECONDS,
+        open_seconds: float = DEFAULT_OPEN_SECONDS,
+    ) -> None:
+        self.name = name
+        self.enabled = enabled
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        # Outcome of the last calls, True for a failure
+        self._outcomes: deque[bool] = deque(maxlen=window)
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_started_at: float | None = None
+        CIRCUIT_STATE.labels(name).set(STATE_VALUES[CLOSED])
+
+    @classmethod
+    def from_config(cls, name: str) -> "CircuitBreaker":
+        """Build the breaker of a filter from the ``circuit_breaker`` section of the config"""
+        config = current_config.get().get("circuit_breaker", {})
+        return cls(
+            name,
+            enabled=config.get("enabled", True),
+            window=config.get("window", DEFAULT_WINDOW),
+            min_calls=config.get("min_calls", DEFAULT_MIN_CALLS),
+            failure_rate=config.get("failure_rate", DEFAULT_FAILURE_RATE),
+            slow_call_seconds=config.get("slow_call_seconds", DEFAULT_SLOW_CALL_SECONDS),
+            open_seconds=config.get("open_seconds", DEFAULT_OPEN_SECONDS),
+        )
+
+    def allow(self) -> bool:
+        """Whether the filter may be called now, an open breaker lets a single trial call through after the
+        cool-off period
+        """
+        if not self.enabled or self.state == CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == OPEN:
+            if now - self._opened_at < self.open_seconds:
+                CIRCUIT_REJECTED.labels(self.name).inc()
+                return False
+            self._set_state(HALF_OPEN)
+        # A trial that never reported (its request was cancelled) is replaced after a cool-off period
+        if self._trial_started_at is not None and now - self._trial_started_at < self.open_seconds:
+            CIRCUIT_REJECTED.labels(self.name).inc()
+            return False
+        self._trial_started_at = now
+        return True
+
+    def release(self) -> None:
+        """Give back the slot of a call let through but not made, the trial slot of a half open breaker"""
+        if self.state == HALF_OPEN:
+            self._trial_started_at = None
+
+    def record(self, succeeded: bool, seconds: float) -> None:
+        """Record the outcome of a call"""
+        if not self.enabled:
+            return
+        failed = not succeeded or seconds > self.slow_call_seconds
+        if self.state == HALF_OPEN:
+            self._trial_started_at = None
+            if failed:
+                self._open()
+            else:
+                self._outcomes.clear()
+                self._failures = 0
+                self._set_state(CLOSED)
+            return
+        if self.state == OPEN:
+            # A call started before the breaker opened
+            return
+        if len(self._outcomes) == self._outcomes.maxlen:
+            self._failures -= self._outcomes[0]
+        self._outcomes.append(failed)
+        self._failures += failed
+        if len(self._outcomes) >= self.min_calls and self._failures >= self.failure_rate * len(self._outcomes):
+            self._open()
+
+    def _open(self) -> None:
+        self._opened_at = time.monotonic()
+        self._set_state(OPEN)
+        logger.warning("Circuit breaker of filter %s opened for %ss", self.name, self.open_seconds)
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        CIRCUIT_STATE.labels(self.name).set(STATE_VALUES[state])
+        CIRCUIT_TRANSITIONS.labels(self.name, state).inc()
+
+
+_circuit_breakers: dict[str, CircuitBreaker] = {}
+
+
+def get_circuit_breaker(filter_name: str) -> CircuitBreaker:
+    """Return the process-wide breaker of a filter"""
+    if (breaker := _circuit_breakers.get(filter_name)) is None:
+        breaker = _circuit_breakers[filter_name] = CircuitBreaker.from_config(filter_name)
+    return breaker
+
+
+def circuit_breakers_reset() -> None:
+    """Forget the breakers, the next calls build them from the config again"""
+    _circuit_breakers.clear()
@@ -0,0 +1,16 @@
+"""JSON decoding used on the hot path: orjson when it is installed, the standard library otherwise."""
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the installed extras
+    orjson = None
+
+
+def json_loads(body: bytes | str) -> Any:
+    """Decode a JSON document"""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
@@ -0,0 +1,426 @@
+"""Item-item collaborative filtering index.
+
+The like/download interactions are put in a sparse user x item matrix, the cosine similarity between items is
+computed from its co-occurrences and only the top-N neighbours of each item are kept, in dense arrays: a
+lookup for a few seed assets is a few array reads.
+
+The interactions are read from a JSONL file or a SQLite database:
+
+- JSONL: one record per line, either an interaction ``{"user_id": ..., "asset_id": ..., "event": "liked"}``
+  or an asset ``{"document": {...}}`` holding the asset as returned by the search service.
+- SQLite: tables ``interactions(user_id TEXT, asset_id TEXT, event TEXT)`` and ``assets(document TEXT)``.
+
+With several workers, the index can be built once into a snapshot file (see services.snapshot) that all the workers
+map read-only:
+
+    python -m recommendation.services.collaborative <interactions> <snapshot file>
+"""
+
+import argparse
+import asyncio
+import json
+from collections.abc import Iterable, Iterator, Mapping, Sequence
+from pathlib import Path
+from typing import Any
+
+import aiosqlite
+import numpy as np
+from msfwk.utils.logging import get_logger
+from scipy import sparse
+
+from recommendation.services.codec import json_loads
+from recommendation.services.snapshot import PackedStrings, Snapshot, pack_strings, write_snapshot
+
+logger = get_logger(__name__)
+
+DEFAULT_NEIGHBOURS = 50
+DEFAULT_EVENT_WEIGHTS = {"liked": 1.0, "downloaded": 1.0}
+SQLITE_SUFFIXES = {".db", ".sqlite", ".sqlite3"}
+SNAPSHOT_KIND = "item_item"
+
+Interaction = tuple[str, str, str]
+
+
+class ItemItemIndex:
+    """Top-N most similar items of every item"""
+
+    def __init__(  # noqa: PLR0913
+        self,
+        asset_ids: Sequence[str],
+        neighbours: np.ndarray,
+        similarities: np.ndarray,
+        user_items: Mapping[str, np.ndarray],
+        documents: Mapping[str, dict[str, Any]],
+        interactions_matrix: sparse.csr_matrix | None = None,
+        co_occurrences: sparse.csr_matrix | None = None,
+        user_index: dict[str, int] | None = None,
+        asset_index: Mapping[str, int] | None = None,
+    ) -> None:
+        self.asset_ids = asset_ids
+        self.asset_index = (
+            asset_index
+            if asset_index is not None
+            else {asset_id: position for position, asset_id in enumerate(asset_ids)}
+        )
+        # neighbours[i] are the positions of the items most similar to the item i, padded with -1
+        self.neighbours = neighbours
+        self.similarities = similarities
+        self.user_items = user_items
+        self.documents = documents
+        # Kept to apply new interactions incrementally, see updated()
+        self.interactions_matrix = interactions_matrix
+        self.co_occurrences = co_occurrences
+        self.user_index = user_index if user_index is not None else {}
+
+    def __len__(self) -> int:
+        return len(self.asset_ids)
+
+    @classmethod
+    def build(
+        cls,
+        interactions: Iterable[Interaction],
+        documents: dict[str, dict[str, Any]],
+        top_n: int = DEFAULT_NEIGHBOURS,
+        event_weights: dict[str, float] | None = None,
+    ) -> "ItemItemIndex":
+        """Build the index from (user_id, asset_id, event) interactions"""
+        event_weights = event_weights if event_weights is not None else DEFAULT_EVENT_WEIGHTS
+        user_index: dict[str, int] = {}
+        asset_index: dict[str, int] = {}
+        rows, cols, weights = [], [], []
+        for user_id, asset_id, event in interactions:
+            if (weight := event_weights.get(event)) is None:
+                continue
+            rows.append(user_index.setdefault(user_id, len(user_index)))
+            cols.append(asset_index.setdefault(asset_id, len(asset_index)))
+            weights.append(weight)
+
+        n_items = len(asset_index)
+        # Duplicated (user, item) pairs are summed by the conversion to CSR
+        interactions_matrix = sparse.coo_matrix(
+            (np.asarray(weights, dtype=np.float32), (rows, cols)), shape=(len(user_index), n_items)
+        ).tocsr()
+        co_occurrences = (interactions_matrix.T @ interactions_matrix).tocsr()
+        neighbours, similarities = _top_neighbours(co_occurrences, np.arange(n_items), top_n)
+        user_items = {user_id: _row_items(interactions_matrix, position) for user_id, position in user_index.items()}
+        logger.info("Item-item index built: %s users, %s items", len(user_index), n_items)
+        return cls(
+            list(asset_index),
+            neighbours,
+            similarities,
+            user_items,
+            documents,
+            interactions_matrix,
+            co_occurrences,
+            user_index,
+        )
+
+    def updated(
+        self,
+        interactions: Iterable[Interaction],
+        documents: dict[str, dict[str, Any]] | None = None,
+        event_weights: dict[str, float] | None = None,
+    ) -> "ItemItemIndex":
+        """Return a new index with the interactions and the documents added, this one is left untouched.
+
+        The co-occurrences are updated with the new interactions only, (M + D)^T (M + D) = C + D^T M + M^T D + D^T D,
+        and only the neighbours of the items whose similarities changed are recomputed.
+        """
+        if self.interactions_matrix is None or self.co_occurrences is None:
+            message = "The index was not built with its interaction matrix"
+            raise ValueError(message)
+        event_weights = event_weights if event_weights is not None else DEFAULT_EVENT_WEIGHTS
+        all_documents = {**self.documents, **documents} if documents else self.documents
+
+        user_index = dict(self.user_index)
+        asset_ids = list(self.asset_ids)
+        asset_index = dict(self.asset_index)
+        rows, cols, weights = [], [], []
+        for user_id, asset_id, event in interactions:
+            if (weight := event_weights.get(event)) is None:
+                continue
+            rows.append(user_index.setdefault(user_id, len(user_index)))
+            if (col := asset_index.get(asset_id)) is None:
+                col = asset_index[asset_id] = len(asset_ids)
+                asset_ids.append(asset_id)
+            cols.append(col)
+            weights.append(weight)
+        if not rows:
+            return ItemItemIndex(
+                self.asset_ids,
+                self.neighbours,
+                self.similarities,
+                self.user_items,
+                all_documents,
+                self.interactions_matrix,
+                self.co_occurrences,
+                self.user_index,
+            )
+
+        n_users, n_items = len(user_index), len(asset_ids)
+        top_n = self.neighbours.shape[1]
+        previous = self.interactions_matrix.copy()
+        previous.resize((n_users, n_items))
+        co_occurrences = self.co_occurrences.copy()
+        co_occurrences.resize((n_items, n_items))
+        delta = sparse.coo_matrix(
+            (np.asarray(weights, dtype=np.float32), (rows, cols)), shape=(n_users, n_items)
+        ).tocsr()
+        cross = (delta.T @ previous).tocsr()
+        co_occurrences = (co_occurrences + cross + cross.T + delta.T @ delta).tocsr()
+        interactions_matrix = (previous + delta).tocsr()
+
+        # The norm of a touched item changed: its similarity with every item it co-occurs with changed
+        touched = np.unique(np.asarray(cols, dtype=np.intp))
+        affected = np.union1d(touched, co_occurrences[touched].indices)
+        neighbours = np.full((n_items, top_n), -1, dtype=np.int32)
+        neighbours[: len(self.neighbours)] = self.neighbours
+        similarities = np.zeros((n_items, top_n), dtype=np.float32)
+        similarities[: len(self.similarities)] = self.similarities
+        neighbours[affected], similarities[affected] = _top_neighbours(co_occurrences, affected, top_n)
+
+        # The positions of the users follow the insertion order of the user_index
+        user_ids = list(user_index)
+        user_items = dict(self.user_items)
+        for user_position in np.unique(rows).tolist():
+            user_items[user_ids[user_position]] = _row_items(interactions_matrix, user_position)
+        logger.debug("Item-item index updated: %s interactions, %s items recomputed", len(rows), len(affected))
+        return ItemItemIndex(
+            asset_ids,
+            neighbours,
+            similarities,
+            user_items,
+            all_documents,
+            interactions_matrix,
+            co_occurrences,
+            user_index,
+        )
+
+    @classmethod
+    def from_snapshot(cls, snapshot: Snapshot) -> "ItemItemIndex":
+        """Index reading the arrays of a snapshot written by write_index_snapshot, nothing is copied.
+        It has no interaction matrix: it is not updated by the events, a new snapshot replaces it.
+        """
+        if snapshot.metadata.get("kind") != SNAPSHOT_KIND:
+            message = f"{snapshot.path} is not a snapshot of an item-item index"
+            raise ValueError(message)
+        asset_ids = snapshot.strings("asset_ids")
+        return cls(
+            asset_ids,
+            snapshot.array("neighbours"),
+            snapshot.array("similarities"),
+            _MappedUserItems(
+                snapshot.strings("user_ids"), snapshot.array("user_items"), snapshot.array("user_offsets")
+            ),
+            _MappedDocuments(asset_ids, snapshot.strings("documents")),
+            asset_index=_MappedPositions(asset_ids),
+        )
+
+    def snapshot_arrays(self) -> dict[str, np.ndarray]:
+        """The arrays of the index in a snapshot, the documents of the indexed assets only"""
+        user_ids = list(self.user_items)
+        user_offsets = np.zeros(len(user_ids) + 1, dtype=np.int64)
+        np.cumsum([len(self.user_items[user_id]) for user_id in user_ids], out=user_offsets[1:])
+        user_items = [np.asarray(self.user_items[user_id], dtype=np.int32) for user_id in user_ids]
+        documents = [
+            json.dumps(document, separators=(",", ":")) if (document := self.documents.get(asset_id)) else ""
+            for asset_id in self.asset_ids
+        ]
+        return {
+            "neighbours": np.asarray(self.neighbours, dtype=np.int32),
+            "similarities": np.asarray(self.similarities, dtype=np.float32),
+            "user_items": np.concatenate(user_items) if user_items else np.empty(0, dtype=np.int32),
+            "user_offsets": user_offsets,
+            **pack_strings("asset_ids", self.asset_ids),
+            **pack_strings("user_ids", user_ids),
+            **pack_strings("documents", documents),
+        }
+
+    def seeds_of(self, asset_ids: Iterable[str] = (), user_id: str | None = None) -> np.ndarray:
+        """Positions of the seed assets and of the assets the user interacted with"""
+        positions = [self.asset_index[asset_id] for asset_id in asset_ids if asset_id in self.asset_index]
+        if user_id is not None and (items := self.user_items.get(user_id)) is not None:
+            positions.extend(items.tolist())
+        return np.unique(np.asarray(positions, dtype=np.intp))
+
+    def similar(self, seeds: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Items similar to the seeds, excluding the seeds, with the summed similarity to the seeds
+
+        Returns:
+            np.ndarray: positions of the similar items, most similar first
+            np.ndarray: their similarity scores
+        """
+        if seeds.size == 0:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+        neighbours = self.neighbours[seeds].ravel()
+        similarities = self.similarities[seeds].ravel()
+        valid = neighbours >= 0
+        scores = np.bincount(neighbours[valid], weights=similarities[valid], minlength=len(self))
+        scores[seeds] = 0
+        positions = np.flatnonzero(scores > 0)
+        order = np.argsort(-scores[positions], kind="stable")
+        return positions[order], scores[positions[order]]
+
+
+class _MappedPositions(Mapping[str, int]):
+    """Position of each asset id of a snapshot"""
+
+    __slots__ = ("asset_ids",)
+
+    def __init__(self, asset_ids: PackedStrings) -> None:
+        self.asset_ids = asset_ids
+
+    def __getitem__(self, asset_id: str) -> int:
+        if (position := self.asset_ids.position(asset_id)) is None:
+            raise KeyError(asset_id)
+        return position
+
+    def __contains__(self, asset_id: object) -> bool:
+        return asset_id in self.asset_ids
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.asset_ids)
+
+    def __len__(self) -> int:
+        return len(self.asset_ids)
+
+
+class _MappedUserItems(Mapping[str, np.ndarray]):
+    """Positions of the items of each user of a snapshot, user_items[user_offsets[u]:user_offsets[u + 1]]"""
+
+    __slots__ = ("user_ids", "user_items", "user_offsets")
+
+    def __init__(self, user_ids: PackedStrings, user_items: np.ndarray, user_offsets: np.ndarray) -> None:
+        self.user_ids = user_ids
+        self.user_items = user_items
+        self.user_offsets = user_offsets
+
+    def __getitem__(self, user_id: str) -> np.ndarray:
+        if (position := self.user_ids.position(user_id)) is None:
+            raise KeyError(user_id)
+        return self.user_items[self.user_offsets[position] : self.user_offsets[position + 1]]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.user_ids)
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+
+class _MappedDocuments(Mapping[str, dict[str, Any]]):
+    """Documents of the assets of a snapshot, decoded on access"""
+
+    __slots__ = ("asset_ids", "documents")
+
+    def __init__(self, asset_ids: PackedStrings, documents: PackedStrings) -> None:
+        self.asset_ids = asset_ids
+        self.documents = documents
+
+    def __getitem__(self, asset_id: str) -> dict[str, Any]:
+        if (position := self.asset_ids.position(asset_id)) is None or not (raw := self.documents.raw(position)):
+            raise KeyError(asset_id)
+        return json_loads(raw)
+
+    def __iter__(self) -> Iterator[str]:
+        return (
+            asset_id
+            for asset_id, length in zip(self.asset_ids, np.diff(self.documents.offsets).tolist(), strict=True)
+            if length
+        )
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(np.diff(self.documents.offsets)))
+
+
+def write_index_snapshot(index: ItemItemIndex, path: str | Path) -> int:
+    """Write the snapshot of an index, returns its version"""
+    return write_snapshot(path, index.snapshot_arrays(), {"kind": SNAPSHOT_KIND, "items": len(index)})
+
+
+def _row_items(interactions_matrix: sparse.csr_matrix, user_position: int) -> np.ndarray:
+    """Positions of the items of a user"""
+    start, end = interactions_matrix.indptr[user_position], interactions_matrix.indptr[user_position + 1]
+    return interactions_matrix.indices[start:end].copy()
+
+
+def _top_neighbours(
+    co_occurrences: sparse.csr_matrix, items: np.ndarray, top_n: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Cosine similarity of the items with all the others, truncated to the top_n most similar of each item
+
+    Args:
+        co_occurrences (sparse.csr_matrix): item x item co-occurrences, with the squared norms on the diagonal
+        items (np.ndarray): positions of the items to compute
+        top_n (int): neighbours kept per item
+    """
+    norms = np.sqrt(co_occurrences.diagonal())
+    norms[norms == 0] = 1
+    rows = co_occurrences[items].tocsr()
+    # cosine(i, j) = co(i, j) / (|i| |j|), scaled on the CSR data in place
+    row_of_data = np.repeat(np.arange(len(items)), np.diff(rows.indptr))
+    rows.data = rows.data / (norms[items[row_of_data]] * norms[rows.indices])
+    # An item is not its own neighbour
+    rows.data[rows.indices == items[row_of_data]] = 0
+    rows.eliminate_zeros()
+
+    neighbours = np.full((len(items), top_n), -1, dtype=np.int32)
+    similarities = np.zeros((len(items), top_n), dtype=np.float32)
+    for row in range(len(items)):
+        start, end = rows.indptr[row], rows.indptr[row + 1]
+        if start == end:
+            continue
+        row_similarities = rows.data[start:end]
+        row_items = rows.indices[start:end]
+        if end - start > top_n:
+            best = np.argpartition(-row_similarities, top_n - 1)[:top_n]
+            row_similarities, row_items = row_similarities[best], row_items[best]
+        order = np.argsort(-row_similarities, kind="stable")
+        neighbours[row, : len(order)] = row_items[order]
+        similarities[row, : len(order)] = row_similarities[order]
+    return neighbours, similarities
+
+
+async def load_interactions(path: str | Path) -> tuple[list[Interaction], dict[str, dict[str, Any]]]:
+    """Read the interactions and the asset documents from a JSONL file or a SQLite database"""
+    path = Path(path)
+    if path.suffix in SQLITE_SUFFIXES:
+        return await _load_sqlite(path)
+    return await asyncio.to_thread(_load_jsonl, path)
+
+
+def _load_jsonl(path: Path) -> tuple[list[Interaction], dict[str, dict[str, Any]]]:
+    interactions, documents = [], {}
+    with path.open("rb") as lines:
+        for line in lines:
+            if not line.strip():
+                continue
+            record = json_loads(line)
+            if (document := record.get("document")) is not None:
+                documents[document["id"]] = document
+            else:
+                interactions.append((record["user_id"], record["asset_id"], record["event"]))
+    return interactions, documents
+
+
+async def _load_sqlite(path: Path) -> tuple[list[Interaction], dict[str, dict[str, Any]]]:
+    async with aiosqlite.connect(path) as db:
+        async with db.execute("SELECT user_id, asset_id, event FROM interactions") as cursor:
+            interactions = [tuple(row) for row in await cursor.fetchall()]
+        async with db.execute("SELECT document FROM assets") as cursor:
+            documents = {(document := json_loads(row[0]))["id"]: document for row in await cursor.fetchall()}
+    return interactions, documents
+
+
+def main() -> None:
+    """Build the snapshot of an item-item index from an interaction log"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("interactions", type=Path, help="JSONL file or SQLite database of the interactions")
+    parser.add_argument("snapshot", type=Path, help="Snapshot file written, replaced atomically if it exists")
+    parser.add_argument("--neighbours", type=int, default=DEFAULT_NEIGHBOURS)
+    args = parser.parse_args()
+    interactions, documents = asyncio.run(load_interactions(args.interactions))
+    write_index_snapshot(ItemItemIndex.build(interactions, documents, args.neighbours), args.snapshot)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""Adaptive concurrency limits: admission control of the routes and of the filter calls.
+
+A limiter admits at most ``limit`` calls at once, the next ones wait in a FIFO queue. The limit follows the
+observed latency (AIMD): it grows by one per ``limit`` calls admitted near it that were fast, and is multiplied by
+``backoff`` when a call fails or takes more than ``latency_threshold``, at most once per round trip. A call is shed
+rather than queued when the queue is full or when its expected wait is over ``max_wait``, and when it waited
+``max_wait`` without being admitted.
+
+The /recommend routes share the ``recommend`` limiter; each filter has its own, named after it. Settings come from
+the ``route`` and ``filters`` subsections of the ``concurrency`` section of the config.
+"""
+
+import asyncio
+import contextlib
+import math
+import time
+from collections import deque
+from types import TracebackType
+
+from msfwk.context import current_config
+from msfwk.utils.logging import get_logger
+from prometheus_client import Counter, Gauge
+
+logger = get_logger(__name__)
+
+ROUTE = "route"
+FILTERS = "filters"
+ROUTE_LIMITER = "recommend"
+# Default settings of each kind of limiter
+DEFAULTS = {
+    ROUTE: {
+        "initial_limit": 64,
+        "min_limit": 8,
+        "max_limit": 1000,
+        "latency_threshold": 1.5,
+        "max_wait": 0.5,
+        "max_queue": 256,
+    },
+    FILTERS: {
+        "initial_limit": 32,
+        "min_limit": 2,
+        "max_limit": 500,
+        "latency_threshold": 1.0,
+        "max_wait": 0.25,
+        "max_queue": 128,
+    },
+}
+DEFAULT_BACKOFF = 0.9
+# Weight of the last call in the moving average of the latency, which estimates the wait in the queue
+LATENCY_SMOOTHING = 0.1
+
+CONCURRENCY_LIMIT = Gauge("recommendation_concurrency_limit", "Current limit of each limiter", ["limiter"])
+CONCURRENCY_IN_FLIGHT = Gauge("recommendation_concurrency_in_flight", "Calls admitted by each limiter", ["limiter"])
+CONCURRENCY_QUEUED = Gauge("recommendation_concurrency_queued", "Calls waiting in each limiter", ["limiter"])
+CONCURRENCY_SHED = Counter(
+    "recommendation_concurrency_shed_total",
+    "Calls shed, by limiter and reason (queue_full, expected_wait, wait_timeout)",
+    ["limiter", "reason"],
+)
+SHED_REQUESTS = Counter(
+    "recommendation_shed_requests_total",
+    "Requests shed by the admission control of the routes, by answer (popularity, cache, fallback, rejected)",
+    ["source"],
+)
+
+
+class Permit:
+    """Slot of an admitted call, released when the call ends: ``with permit: ...`` or release()"""
+
+    __slots__ = ("limiter", "start")
+
+    def __init__(self, limiter: "ConcurrencyLimiter | None", start: float) -> None:
+        self.limiter = limiter
+        self.start = start
+
+    def release(self, succeeded: bool = True) -> None:
+        """Free the slot and report the outcome of the call, only the first release counts"""
+        if self.limiter is not None:
+            self.limiter._release(self.start, succeeded)  # noqa: SLF001
+            self.limiter = None
+
+    def __enter__(self) -> "Permit":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.release(exc_type is None)
+
+
+class ConcurrencyLimiter:
+    """AIMD concurrency limit with a bounded waiting queue, see the module docstring"""
+
+    def __init__(  # noqa: PLR0913
+        self,
+        name: str,
+        enabled: bool = True,
+        initial_limit: int = DEFAULTS[ROUTE]["initial_limit"],
+        min_limit: int = DEFAULTS[ROUTE]["min_limit"],
+        max_limit: int = DEFAULTS[ROUTE]["max_limit"],
+        latency_threshold: float = DEFAULTS[ROUTE]["latency_threshold"],
+        max_wait: float = DEFAULTS[ROUTE]["max_wait"],
+        max_queue: int = DEFAULTS[ROUTE]["max_queue"],
+        backoff: float = DEFAULT_BACKOFF,
+    ) -> None:
+        self.name = name
+        self.enabled = enabled
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.latency_threshold = latency_threshold
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.backoff = backoff
+        self.in_flight = 0
+        # Moving average of the latency of the admitted calls
+        self.latency = 0.0
+        self._waiters: deque[asyncio.Future[None]] = deque()
+        # The calls started before the last decrease do not decrease the limit again
+        self._decreased_at = -math.inf
+        CONCURRENCY_LIMIT.labels(name).set_function(lambda: self.limit)
+        CONCURRENCY_IN_FLIGHT.labels(name).set_function(lambda: self.in_flight)
+        CONCURRENCY_QUEUED.labels(name).set_function(lambda: len(self._waiters))
+
+    @classmethod
+    def from_config(cls, name: str, kind: str) -> "ConcurrencyLimiter":
+        """Build a limiter from the ``concurrency`` section of the config, kind is ROUTE or FILTERS"""
+        config = current_config.get().get("concurrency", {})
+        settings = {**DEFAULTS[kind], **config.get(kind, {})}
+        return cls(
+            name,
+            enabled=config.get("enabled", False),
+            initial_limit=settings["initial_limit"],
+            min_limit=settings["min_limit"],
+            max_limit=settings["max_limit"],
+            latency_threshold=settings["latency_threshold"],
+            max_wait=settings["max_wait"],
+            max_queue=settings["max_queue"],
+            backoff=config.get("backoff", DEFAULT_BACKOFF),
+        )
+
+    async def acquire(self) -> Permit | None:
+        """Wait for a slot, None when the call is shed"""
+        if not self.enabled:
+            return Permit(None, 0.0)
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return Permit(self, time.monotonic())
+        if len(self._waiters) >= self.max_queue:
+            return self._shed("queue_full")
+        # The calls before this one in the queue are admitted at the pace of the releases
+        if (len(self._waiters) + 1) * self.latency / self.limit > self.max_wait:
+            return self._shed("expected_wait")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.max_wait)
+        except TimeoutError:
+            self._leave(waiter)
+            return self._shed("wait_timeout")
+        except asyncio.CancelledError:
+            self._leave(waiter)
+            raise
+        return Permit(self, time.monotonic())
+
+    def _shed(self, reason: str) -> None:
+        CONCURRENCY_SHED.labels(self.name, reason).inc()
+        logger.debug("Limiter %s sheds a call (%s), limit %.1f", self.name, reason, self.limit)
+
+    def _leave(self, waiter: asyncio.Future[None]) -> None:
+        """A waiter gives up, passing on the slot handed over to it as its wait ended"""
+        if waiter.done() and not waiter.cancelled():
+            self._free_slot()
+        else:
+            with contextlib.suppress(ValueError):
+                self._waiters.remove(waiter)
+
+    def _release(self, start: float, succeeded: bool) -> None:
+        now = time.monotonic()
+        latency = now - start
+        self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+        if not succeeded or latency > self.latency_threshold:
+            if start >= self._decreased_at:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._decreased_at = now
+                logger.debug("Limiter %s decreased to %.1f", self.name, self.limit)
+        elif 2 * self.in_flight >= self.limit:
+            # Only the calls admitted near the limit show that it can grow
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._free_slot()
+
+    def _free_slot(self) -> None:
+        """Hand the slot of an ended call over to the first waiter, or free it when the limit went down"""
+        while self._waiters and self.in_flight - 1 < self.limit:
+            if not (waiter := self._waiters.popleft()).done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+
+_limiters: dict[str, ConcurrencyLimiter] = {}
+
+
+def get_concurrency_limiter(name: str, kind: str = FILTERS) -> ConcurrencyLimiter:
+    """Return the process-wide limiter of a name, built with the settings of its kind"""
+    if (limiter := _limiters.get(name)) is None:
+        limiter = _limiters[name] = ConcurrencyLimiter.from_config(name, kind)
+    return limiter
+
+
+def concurrency_limiters_reset() -> None:
+    """Forget the limiters, the next calls build them from the config again"""
+    _limiters.clear()
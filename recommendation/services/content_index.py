@@ -0,0 +1,186 @@
+"""Content-similarity index: "more like this" on the name, metadata and category of the assets.
+
+Each asset is embedded as a TF-IDF weighted bag of tokens, hashed with random signs into a small dense vector
+(the hashing trick, i.e. a random projection of the sparse TF-IDF vector), then L2-normalized. An IVF index
+(k-means coarse centroids, assets stored contiguously per centroid) answers the approximate nearest neighbours
+by scanning only the lists of the closest centroids.
+
+The index is a directory of flat files, memory-mapped read-only: workers share the pages and a restart does
+not rebuild anything. It is built offline with:
+
+    python -m recommendation.services.content_index <assets.jsonl> <index directory>
+
+where assets.jsonl holds one asset document per line, as returned by the search service.
+"""
+
+import argparse
+import json
+import math
+import mmap
+import re
+import zlib
+from collections import Counter
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from msfwk.utils.logging import get_logger
+
+from recommendation.services.codec import json_loads
+
+logger = get_logger(__name__)
+
+DEFAULT_DIMENSIONS = 256
+DEFAULT_NPROBE = 8
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 20_000
+
+VECTORS_FILE = "vectors.npy"
+CENTROIDS_FILE = "centroids.npy"
+LIST_OFFSETS_FILE = "list_offsets.npy"
+IDS_FILE = "ids.json"
+DOCUMENTS_FILE = "documents.jsonl"
+DOCUMENT_OFFSETS_FILE = "document_offsets.npy"
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(document: dict[str, Any]) -> list[str]:
+    """Tokens describing an asset: words of its name and metadata, and its category"""
+    metadata = document.get("metadata") or {}
+    text = " ".join([document.get("name", ""), *(str(value) for value in metadata.values())])
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    if (category := document.get("categoryId")) is not None:
+        tokens.append(f"category:{category}")
+    return tokens
+
+
+def embed(token_counts: list[Counter], dimensions: int) -> np.ndarray:
+    """TF-IDF vectors of the documents hashed into `dimensions` signed buckets, L2-normalized"""
+    document_frequency = Counter(token for counts in token_counts for token in counts)
+    n_documents = len(token_counts)
+    idf = {token: math.log((1 + n_documents) / (1 + frequency)) + 1 for token, frequency in document_frequency.items()}
+    # A stable hash (not hash()) so the buckets do not depend on the process
+    hashes = {token: zlib.crc32(token.encode()) for token in document_frequency}
+
+    vectors = np.zeros((n_documents, dimensions), dtype=np.float32)
+    for row, counts in enumerate(token_counts):
+        for token, count in counts.items():
+            token_hash = hashes[token]
+            sign = 1.0 if token_hash & 0x80000000 else -1.0
+            vectors[row, token_hash % dimensions] += sign * count * idf[token]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def kmeans(vectors: np.ndarray, n_clusters: int, seed: int = 0) -> np.ndarray:
+    """Spherical k-means centroids of a sample of the vectors"""
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), size=min(len(vectors), KMEANS_SAMPLE), replace=False)]
+    centroids = sample[rng.choice(len(sample), size=n_clusters, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        for cluster in range(n_clusters):
+            if (members := sample[assignments == cluster]).size:
+                centroid = members.sum(axis=0)
+                centroids[cluster] = centroid / max(float(np.linalg.norm(centroid)), 1e-12)
+    return centroids
+
+
+def build_content_index(
+    documents: Iterable[dict[str, Any]], directory: str | Path, dimensions: int = DEFAULT_DIMENSIONS
+) -> None:
+    """Write the index files of the documents in the directory"""
+    documents = list(documents)
+    if not documents:
+        message = "Cannot build a content index without documents"
+        raise ValueError(message)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    vectors = embed([Counter(tokenize(document)) for document in documents], dimensions)
+    centroids = kmeans(vectors, n_clusters=max(1, int(math.sqrt(len(documents)))))
+    assignments = np.argmax(vectors @ centroids.T, axis=1)
+    # Stored list by list, so scanning a list is reading a contiguous slice
+    order = np.argsort(assignments, kind="stable")
+    list_offsets = np.searchsorted(assignments[order], np.arange(len(centroids) + 1))
+
+    np.save(directory / VECTORS_FILE, vectors[order])
+    np.save(directory / CENTROIDS_FILE, centroids)
+    np.save(directory / LIST_OFFSETS_FILE, list_offsets.astype(np.int64))
+    (directory / IDS_FILE).write_text(json.dumps([documents[position]["id"] for position in order.tolist()]))
+    document_offsets = [0]
+    with (directory / DOCUMENTS_FILE).open("wb") as documents_file:
+        for position in order.tolist():
+            written = documents_file.write(json.dumps(documents[position]).encode())
+            document_offsets.append(document_offsets[-1] + written)
+    np.save(directory / DOCUMENT_OFFSETS_FILE, np.asarray(document_offsets, dtype=np.int64))
+    logger.info("Content index built in %s: %s assets, %s lists", directory, len(documents), len(centroids))
+
+
+class ContentIndex:
+    """Memory-mapped IVF index of the asset vectors"""
+
+    def __init__(self, directory: str | Path) -> None:
+        directory = Path(directory)
+        self.vectors = np.load(directory / VECTORS_FILE, mmap_mode="r")
+        self.centroids = np.load(directory / CENTROIDS_FILE)
+        self.list_offsets = np.load(directory / LIST_OFFSETS_FILE)
+        self.document_offsets = np.load(directory / DOCUMENT_OFFSETS_FILE, mmap_mode="r")
+        self.asset_ids: list[str] = json.loads((directory / IDS_FILE).read_text())
+        self.asset_index = {asset_id: position for position, asset_id in enumerate(self.asset_ids)}
+        with (directory / DOCUMENTS_FILE).open("rb") as documents_file:
+            self._documents = mmap.mmap(documents_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        return len(self.asset_ids)
+
+    def document(self, position: int) -> dict[str, Any]:
+        """The asset document stored at a position"""
+        return json_loads(self._documents[self.document_offsets[position] : self.document_offsets[position + 1]])
+
+    def query_vector(self, asset_ids: Iterable[str]) -> np.ndarray | None:
+        """Normalized mean vector of the assets, None when none of them is indexed"""
+        positions = [self.asset_index[asset_id] for asset_id in asset_ids if asset_id in self.asset_index]
+        if not positions:
+            return None
+        vector = self.vectors[np.sort(positions)].mean(axis=0)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def search(self, vector: np.ndarray, k: int, nprobe: int = DEFAULT_NPROBE) -> tuple[np.ndarray, np.ndarray]:
+        """Approximate k nearest assets of the vector, by cosine similarity
+
+        Returns:
+            np.ndarray: positions of the assets, most similar first
+            np.ndarray: their similarities
+        """
+        nprobe = min(nprobe, len(self.centroids))
+        probed = np.argpartition(-(self.centroids @ vector), nprobe - 1)[:nprobe]
+        positions = np.concatenate(
+            [np.arange(self.list_offsets[lst], self.list_offsets[lst + 1]) for lst in probed.tolist()]
+        )
+        similarities = np.concatenate(
+            [self.vectors[self.list_offsets[lst] : self.list_offsets[lst + 1]] @ vector for lst in probed.tolist()]
+        )
+        if len(positions) > k:
+            best = np.argpartition(-similarities, k - 1)[:k]
+            positions, similarities = positions[best], similarities[best]
+        order = np.argsort(-similarities, kind="stable")
+        return positions[order], similarities[order]
+
+
+def main() -> None:
+    """Build a content index from a JSONL file of asset documents"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("assets", type=Path, help="JSONL file, one asset document per line")
+    parser.add_argument("directory", type=Path, help="Directory where the index files are written")
+    parser.add_argument("--dimensions", type=int, default=DEFAULT_DIMENSIONS)
+    args = parser.parse_args()
+    with args.assets.open("rb") as lines:
+        build_content_index((json_loads(line) for line in lines if line.strip()), args.directory, args.dimensions)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""Diversity re-ranking of the merged candidates, between the scoring and the pagination.
+
+Both minor filters reward the same popular assets, so the merged ranking is often dominated by a category or
+a source. Two modes re-rank it:
+
+- mmr: maximal marginal relevance, the next asset maximizes lambda * relevance - (1 - lambda) * similarity to
+  the assets ranked before it. The relevance is the r_score over the best one, two assets of the same category
+  have a similarity of 1, of the same source ``source_similarity``, and 0 otherwise.
+- quota: the rank order, with at most ``max_per_category`` assets of a category and ``max_per_source`` of a
+  source in each window of ``window`` ranks. A window the quotas leave short is filled in rank order.
+
+With these similarities only the best remaining asset of each (category, source) bucket can come next: the
+candidates are split in buckets once and the bucket heads are kept in a heap, O(n log b) for n candidates in b
+buckets instead of the O(k * n) of the pairwise MMR. The similarity to the ranked assets only grows, so a head
+whose score dropped is pushed back with its new score when it is popped. Settings come from the ``diversity``
+section of the config, the mode can be chosen per request.
+"""
+
+import heapq
+from collections import deque
+from collections.abc import Hashable, Sequence
+from dataclasses import dataclass, field
+from typing import get_args
+
+import numpy as np
+from msfwk.context import current_config
+from msfwk.utils.logging import get_logger
+
+from recommendation.models.interfaces import Candidate, DiversityMode
+from recommendation.services.scoring import MIN_NORMALIZATION_VALUE, extract_field
+from recommendation.services.selection import Ranking
+
+logger = get_logger(__name__)
+
+NO_DIVERSITY = "none"
+DIVERSITY_MODES = get_args(DiversityMode)
+DEFAULT_MMR_LAMBDA = 0.7
+DEFAULT_SOURCE_SIMILARITY = 0.5
+DEFAULT_MAX_PER_CATEGORY = 3
+DEFAULT_MAX_PER_SOURCE = 5
+DEFAULT_WINDOW = 10
+
+BucketKey = tuple[Hashable, Hashable]
+
+
+@dataclass(frozen=True, slots=True)
+class DiversitySettings:
+    """How a ranking is re-ranked, hashable so the re-ranked orders can be cached by settings"""
+
+    mode: DiversityMode = NO_DIVERSITY
+    mmr_lambda: float = DEFAULT_MMR_LAMBDA
+    source_similarity: float = DEFAULT_SOURCE_SIMILARITY
+    # 0 for no quota
+    max_per_category: int = DEFAULT_MAX_PER_CATEGORY
+    max_per_source: int = DEFAULT_MAX_PER_SOURCE
+    window: int = DEFAULT_WINDOW
+
+    @classmethod
+    def from_config(cls, mode: DiversityMode | None = None) -> "DiversitySettings":
+        """Build the settings from the ``diversity`` section of the config, mode overrides the configured one"""
+        config = current_config.get().get("diversity", {})
+        if (mode := mode or config.get("mode", NO_DIVERSITY)) not in DIVERSITY_MODES:
+            logger.warning("Unknown diversity mode %s, the ranking is not re-ranked", mode)
+            mode = NO_DIVERSITY
+        return cls(
+            mode=mode,
+            mmr_lambda=config.get("mmr_lambda", DEFAULT_MMR_LAMBDA),
+            source_similarity=config.get("source_similarity", DEFAULT_SOURCE_SIMILARITY),
+            max_per_category=config.get("max_per_category", DEFAULT_MAX_PER_CATEGORY),
+            max_per_source=config.get("max_per_source", DEFAULT_MAX_PER_SOURCE),
+            window=config.get("window", DEFAULT_WINDOW),
+        )
+
+
+@dataclass(slots=True)
+class DiversityState:
+    """What the re-ranking of the next candidates depends on, to re-rank the candidates of a ranking in parts"""
+
+    # Relevance scale of the mmr mode
+    max_score: float = MIN_NORMALIZATION_VALUE
+    categories: set[Hashable] = field(default_factory=set)
+    sources: set[Hashable] = field(default_factory=set)
+    # Assets of each category and source in the current window of the quota mode, and its ranks filled
+    category_counts: dict[Hashable, int] = field(default_factory=dict)
+    source_counts: dict[Hashable, int] = field(default_factory=dict)
+    window_filled: int = 0
+
+    def copy(self) -> "DiversityState":
+        """A copy the re-ranking of the next candidates can change"""
+        return DiversityState(
+            self.max_score,
+            set(self.categories),
+            set(self.sources),
+            dict(self.category_counts),
+            dict(self.source_counts),
+            self.window_filled,
+        )
+
+
+def diversify(
+    candidates: Sequence[Candidate], settings: DiversitySettings, state: DiversityState | None = None
+) -> tuple[list[Candidate], DiversityState]:
+    """Re-rank candidates given in rank order
+
+    Args:
+        candidates (Sequence[Candidate]): the candidates, best first
+        settings (DiversitySettings): the mode and its parameters
+        state (DiversityState | None): state after the candidates ranked before these ones, if any
+
+    Returns:
+        list[Candidate]: the re-ranked candidates
+        DiversityState: the state after them, to re-rank the candidates ranked after
+    """
+    scores = extract_field(candidates, "r_score")
+    if state is None:
+        state = DiversityState(max_score=max(float(scores.max(initial=0.0)), MIN_NORMALIZATION_VALUE))
+    else:
+        state = state.copy()
+    if settings.mode == NO_DIVERSITY or not candidates:
+        return list(candidates), state
+
+    # Ranks of the candidates of each (category, source) bucket, in rank order. Nested by category while they
+    # are collected, so no key is built per candidate
+    nested_buckets: dict[Hashable, dict[Hashable, deque[int]]] = {}
+    for rank, candidate in enumerate(candidates):
+        raw = candidate.raw
+        if (sources := nested_buckets.get(category := raw.get("categoryId"))) is None:
+            sources = nested_buckets[category] = {}
+        if (bucket := sources.get(source := raw.get("source"))) is None:
+            bucket = sources[source] = deque()
+        bucket.append(rank)
+    buckets = {
+        (category, source): bucket
+        for category, sources in nested_buckets.items()
+        for source, bucket in sources.items()
+    }
+    if settings.mode == "mmr":
+        ranks = _mmr(buckets, scores, settings, state)
+    else:
+        ranks = _quota(buckets, settings, state)
+    return [candidates[rank] for rank in ranks], state
+
+
+def diversify_ranking(ranking: Ranking[Candidate], settings: DiversitySettings) -> Ranking[Candidate]:
+    """The whole ranking re-ranked, for the rankings not held by a candidate pool"""
+    if settings.mode == NO_DIVERSITY:
+        return ranking
+    ranked, _ = diversify(ranking.page(0, len(ranking)), settings)
+    return Ranking.ordered(ranked)
+
+
+def _mmr(
+    buckets: dict[BucketKey, deque[int]], scores: np.ndarray, settings: DiversitySettings, state: DiversityState
+) -> list[int]:
+    relevances = (settings.mmr_lambda / state.max_score * scores).tolist()
+    penalty = 1 - settings.mmr_lambda
+
+    def score(key: BucketKey, rank: int) -> float:
+        category, source = key
+        if category in state.categories:
+            return relevances[rank] - penalty
+        if source in state.sources:
+            return relevances[rank] - penalty * settings.source_similarity
+        return relevances[rank]
+
+    # (-score, rank, key) of the head of every bucket, ties go to the best ranked
+    heap = [(-score(key, bucket[0]), bucket[0], key) for key, bucket in buckets.items()]
+    heapq.heapify(heap)
+    # Categories not ranked yet: once there is none, every candidate has a similarity of 1 and the rest is
+    # ranked by relevance alone
+    unseen = {category for category, _ in buckets} - state.categories
+    ranked = []
+    while heap:
+        if not unseen:
+            rest = np.fromiter((rank for bucket in buckets.values() for rank in bucket), dtype=np.intp)
+            ranked.extend(rest[np.lexsort((rest, -scores[rest]))].tolist())
+            break
+        negated_score, rank, key = heapq.heappop(heap)
+        if (current := score(key, rank)) < -negated_score:
+            # The similarity grew since the head was pushed
+            heapq.heappush(heap, (-current, rank, key))
+            continue
+        bucket = buckets[key]
+        ranked.append(bucket.popleft())
+        state.categories.add(key[0])
+        state.sources.add(key[1])
+        unseen.discard(key[0])
+        if bucket:
+            heapq.heappush(heap, (-score(key, bucket[0]), bucket[0], key))
+    return ranked
+
+
+def _quota(buckets: dict[BucketKey, deque[int]], settings: DiversitySettings, state: DiversityState) -> list[int]:
+    def admits(key: BucketKey) -> bool:
+        category, source = key
+        return (
+            settings.max_per_category <= 0 or state.category_counts.get(category, 0) < settings.max_per_category
+        ) and (settings.max_per_source <= 0 or state.source_counts.get(source, 0) < settings.max_per_source)
+
+    # (rank, key) of the heads of the buckets, and of the ones over their quota in the current window
+    heap = [(bucket[0], key) for key, bucket in buckets.items()]
+    heapq.heapify(heap)
+    blocked: list[tuple[int, BucketKey]] = []
+    # Every remaining bucket is over its quota: the rest of the window is filled in rank order
+    filling = False
+    ranked = []
+    while heap or blocked:
+        if state.window_filled >= settings.window:
+            state.category_counts.clear()
+            state.source_counts.clear()
+            state.window_filled = 0
+            for head in blocked:
+                heapq.heappush(heap, head)
+            blocked.clear()
+            filling = False
+        if not heap:
+            heap, blocked = blocked, []
+            heapq.heapify(heap)
+            filling = True
+        rank, key = heapq.heappop(heap)
+        if not filling and not admits(key):
+            blocked.append((rank, key))
+            continue
+        bucket = buckets[key]
+        ranked.append(bucket.popleft())
+        state.category_counts[key[0]] = state.category_counts.get(key[0], 0) + 1
+        state.source_counts[key[1]] = state.source_counts.get(key[1], 0) + 1
+        state.window_filled += 1
+        if bucket:
+            heapq.heappush(heap, (bucket[0], key))
+    return ranked
@@ -0,0 +1,295 @@
+"""Incremental updates from the asset and interaction events of the message queue.
+
+The asset_created, asset_updated, liked and downloaded events are queued by on_message, then applied in
+micro-batches: at most ``batch_size`` events, or what arrived within ``max_delay`` of the first one. Each batch
+builds new copies of the popularity table and of the in-process filter indexes and swaps them in, so the
+requests never wait on an update. Settings come from the ``events`` section of the config.
+
+The events are consumed from the RabbitMQ exchange ``exchange`` at ``url``: every worker binds a queue of its own
+to it, since each one keeps its own copy of the indexes. The InMemoryBroker stands in for RabbitMQ in the tests.
+"""
+
+import asyncio
+import time
+from collections import defaultdict
+from collections.abc import Awaitable, Callable, Sequence
+from typing import Protocol
+
+import aio_pika
+from aio_pika.abc import AbstractIncomingMessage, AbstractQueue, AbstractRobustConnection
+from msfwk.context import current_config
+from msfwk.utils.logging import get_logger
+from prometheus_client import Counter, Histogram
+from pydantic import ValidationError
+
+from recommendation.filters.filter_holder import filters_apply_events
+from recommendation.models.interfaces import AssetEvent, EventBatch
+from recommendation.services.codec import json_loads
+from recommendation.services.popularity import popularity_apply_events
+
+logger = get_logger(__name__)
+
+DEFAULT_EXCHANGE = "recommendation.events"
+DEFAULT_EXCHANGE_TYPE = "fanout"
+DEFAULT_ROUTING_KEY = "#"
+DEFAULT_PREFETCH = 1000
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_MAX_DELAY = 1.0
+DEFAULT_QUEUE_SIZE = 10_000
+
+EVENTS_RECEIVED = Counter("recommendation_events_total", "Events received, by event type", ["event"])
+EVENTS_REJECTED = Counter(
+    "recommendation_events_rejected_total", "Events not applied, by reason (invalid, overflow)", ["reason"]
+)
+EVENT_BATCH_SIZE = Histogram(
+    "recommendation_event_batch_size", "Events per applied batch", buckets=(1, 10, 50, 100, 250, 500, 1000, 5000)
+)
+EVENT_BATCH_SECONDS = Histogram("recommendation_event_batch_seconds", "Time to apply a batch of events")
+
+EventHandler = Callable[[EventBatch], Awaitable[None]]
+MessageCallback = Callable[[bytes], Awaitable[None]]
+
+
+class Broker(Protocol):
+    """Delivers the messages of an exchange to a callback"""
+
+    async def subscribe(self, exchange: str, callback: MessageCallback) -> None:
+        """Deliver the messages of the exchange to the callback"""
+
+    async def close(self) -> None:
+        """Stop delivering the messages"""
+
+
+class AmqpBroker:
+    """RabbitMQ: the messages of the exchange are delivered through a queue of this process, deleted with its
+    connection. The connection is restored after a failure.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        exchange_type: str = DEFAULT_EXCHANGE_TYPE,
+        routing_key: str = DEFAULT_ROUTING_KEY,
+        prefetch: int = DEFAULT_PREFETCH,
+    ) -> None:
+        self.url = url
+        self.exchange_type = aio_pika.ExchangeType(exchange_type)
+        self.routing_key = routing_key
+        self.prefetch = prefetch
+        self._connection: AbstractRobustConnection | None = None
+        self._queue: AbstractQueue | None = None
+
+    @classmethod
+    def from_config(cls, url: str) -> "AmqpBroker":
+        """Build the broker from the ``events`` section of the config"""
+        config = current_config.get().get("events", {})
+        return cls(
+            url,
+            exchange_type=config.get("exchange_type", DEFAULT_EXCHANGE_TYPE),
+            routing_key=config.get("routing_key", DEFAULT_ROUTING_KEY),
+            prefetch=config.get("prefetch", DEFAULT_PREFETCH),
+        )
+
+    async def subscribe(self, exchange: str, callback: MessageCallback) -> None:
+        """Bind a queue of this process to the exchange and consume it"""
+        self._connection = await aio_pika.connect_robust(self.url)
+        channel = await self._connection.channel()
+        await channel.set_qos(prefetch_count=self.prefetch)
+        events_exchange = await channel.declare_exchange(exchange, self.exchange_type, durable=True)
+        self._queue = await channel.declare_queue(exclusive=True)
+        await self._queue.bind(events_exchange, routing_key=self.routing_key)
+
+        async def on_message(message: AbstractIncomingMessage) -> None:
+            # Acknowledged once queued: an event that cannot be applied is dropped, not redelivered
+            async with message.process(requeue=False):
+                await callback(message.body)
+
+        await self._queue.consume(on_message)
+        logger.info("Consuming the events of exchange %s", exchange)
+
+    async def close(self) -> None:
+        """Close the connection, the queue of this process is deleted with it"""
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+            self._queue = None
+
+
+class InMemoryBroker:
+    """Stand-in for RabbitMQ in the tests: publish() hands the message to the subscribers of the exchange"""
+
+    def __init__(self) -> None:
+        self._subscribers: dict[str, list[MessageCallback]] = defaultdict(list)
+
+    async def subscribe(self, exchange: str, callback: MessageCallback) -> None:
+        """Deliver the messages of the exchange to the callback"""
+        self._subscribers[exchange].append(callback)
+
+    async def close(self) -> None:
+        """Stop delivering the messages"""
+        self._subscribers.clear()
+
+    async def publish(self, exchange: str, body: bytes) -> None:
+        """Deliver a message to the subscribers of the exchange"""
+        for callback in list(self._subscribers[exchange]):
+            await callback(body)
+
+
+class EventConsumer:
+    """Queue the events and apply them in micro-batches to the handlers"""
+
+    def __init__(
+        self,
+        handlers: Sequence[EventHandler],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_delay: float = DEFAULT_MAX_DELAY,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+    ) -> None:
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.applied = 0
+        self._queue: asyncio.Queue[AssetEvent] = asyncio.Queue(maxsize=queue_size)
+        self._task: asyncio.Task | None = None
+        # Set by stop, the background task ends after the batch it is applying
+        self._stopping = asyncio.Event()
+
+    @classmethod
+    def from_config(cls, handlers: Sequence[EventHandler]) -> "EventConsumer":
+        """Build the consumer from the ``events`` section of the config"""
+        config = current_config.get().get("events", {})
+        return cls(
+            handlers,
+            batch_size=config.get("batch_size", DEFAULT_BATCH_SIZE),
+            max_delay=config.get("max_delay", DEFAULT_MAX_DELAY),
+            queue_size=config.get("queue_size", DEFAULT_QUEUE_SIZE),
+        )
+
+    def submit(self, event: AssetEvent) -> bool:
+        """Queue an event, False when the queue is full and the event is dropped"""
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            EVENTS_REJECTED.labels("overflow").inc()
+            logger.warning("Event queue full, %s event on %s dropped", event.event, event.asset_id)
+            return False
+        EVENTS_RECEIVED.labels(event.event).inc()
+        return True
+
+    async def on_message(self, body: bytes) -> None:
+        """Broker callback: queue the event of a message"""
+        try:
+            event = AssetEvent.model_validate(json_loads(body))
+        except (ValueError, ValidationError) as e:
+            EVENTS_REJECTED.labels("invalid").inc()
+            logger.warning("Invalid event message: %s", e)
+            return
+        self.submit(event)
+
+    def start(self) -> None:
+        """Start applying the queued events in background"""
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background task once its current batch is applied, then apply the events still queued"""
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Apply all the queued events now"""
+        while not self._queue.empty():
+            await self._apply(self._drain(self.batch_size))
+
+    async def _run(self) -> None:
+        while (event := await self._get()) is not None:
+            events = [event]
+            deadline = time.monotonic() + self.max_delay
+            while len(events) < self.batch_size and (remaining := deadline - time.monotonic()) > 0:
+                if (event := await self._get(remaining)) is None:
+                    break
+                events.append(event)
+                events.extend(self._drain(self.batch_size - len(events)))
+            await self._apply(events)
+
+    async def _get(self, timeout: float | None = None) -> AssetEvent | None:
+        """The next queued event, None after timeout or once the consumer is stopping"""
+        if self._stopping.is_set():
+            return None
+        if not self._queue.empty():
+            return self._queue.get_nowait()
+        get = asyncio.ensure_future(self._queue.get())
+        stopping = asyncio.ensure_future(self._stopping.wait())
+        try:
+            await asyncio.wait((get, stopping), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stopping.cancel()
+            get.cancel()
+        # A cancelled get leaves its event in the queue
+        return get.result() if get.done() and not get.cancelled() else None
+
+    def _drain(self, count: int) -> list[AssetEvent]:
+        events = []
+        while len(events) < count and not self._queue.empty():
+            events.append(self._queue.get_nowait())
+        return events
+
+    async def _apply(self, events: list[AssetEvent]) -> None:
+        batch = EventBatch(events)
+        with EVENT_BATCH_SECONDS.time():
+            for handler in self.handlers:
+                try:
+                    await handler(batch)
+                except Exception as e:
+                    logger.exception("Failed to apply a batch of %s events", len(events), exc_info=e)
+        self.applied += len(events)
+        EVENT_BATCH_SIZE.observe(len(events))
+
+
+_broker: Broker | None = None
+_event_consumer: EventConsumer | None = None
+
+
+def get_event_consumer() -> EventConsumer:
+    """Return the process-wide event consumer, applying the events to the popularity table and the filters"""
+    global _event_consumer  # noqa: PLW0603
+    if _event_consumer is None:
+        _event_consumer = EventConsumer.from_config([popularity_apply_events, filters_apply_events])
+    return _event_consumer
+
+
+async def events_start(broker: Broker | None = None) -> None:
+    """Startup hook: consume the events if they are enabled, from RabbitMQ unless a broker is given"""
+    global _broker  # noqa: PLW0603
+    config = current_config.get().get("events", {})
+    if not config.get("enabled", False):
+        return
+    if broker is None:
+        if (url := config.get("url")) is None:
+            logger.error("Missing events url from config, the events are not consumed")
+            return
+        broker = AmqpBroker.from_config(url)
+    consumer = get_event_consumer()
+    consumer.start()
+    try:
+        await broker.subscribe(config.get("exchange", DEFAULT_EXCHANGE), consumer.on_message)
+    except (OSError, aio_pika.exceptions.AMQPError) as e:
+        logger.exception("Failed to consume the events", exc_info=e)
+        await consumer.stop()
+        return
+    _broker = broker
+
+
+async def events_stop() -> None:
+    """Shutdown hook: stop consuming and apply the events already received"""
+    global _broker, _event_consumer  # noqa: PLW0603
+    if _broker is not None:
+        await _broker.close()
+        _broker = None
+    if _event_consumer is not None:
+        await _event_consumer.stop()
+        _event_consumer = None
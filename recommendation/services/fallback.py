@@ -0,0 +1,100 @@
+"""Fallback store: the last good result of each filter.
+
+A filter that gives nothing (failed, late, or short-circuited by its breaker) is replaced by the last result
+it returned for the same query and window. The results are kept with the scores they had when they were read,
+in an LRU bounded by the number of candidates it holds. Settings come from the ``fallback`` section of the
+config.
+"""
+
+from collections import OrderedDict
+from collections.abc import Hashable
+from typing import Any
+
+from msfwk.context import current_config
+from prometheus_client import Counter
+
+from recommendation.models.interfaces import Candidate, CandidateList, SearchQuery
+from recommendation.services.cache import query_cache_key
+
+DEFAULT_MAX_CANDIDATES = 50_000
+
+FALLBACKS = Counter(
+    "recommendation_fallbacks_total",
+    "Results missing from a filter, by filter and what replaced them (last_good, popularity, none)",
+    ["filter", "source"],
+)
+
+# Candidate lists of a result, each candidate as its raw payload and its score
+FrozenResult = dict[str, tuple[int, list[tuple[dict[str, Any], float]]]]
+
+
+def fallback_key(filter_name: str, query: SearchQuery) -> Hashable:
+    """Key of the result of a filter for a query and a window of its ranked lists"""
+    return (filter_name, query_cache_key(query), query.poolOffset or 0)
+
+
+class FallbackStore:
+    """LRU of the last good result of the filters, bounded by the candidates it holds"""
+
+    def __init__(self, max_candidates: int = DEFAULT_MAX_CANDIDATES) -> None:
+        self.max_candidates = max_candidates
+        self._entries: OrderedDict[Hashable, tuple[FrozenResult, int]] = OrderedDict()
+        self._candidates = 0
+
+    @classmethod
+    def from_config(cls) -> "FallbackStore":
+        """Build the store from the ``fallback`` section of the config"""
+        config = current_config.get().get("fallback", {})
+        return cls(max_candidates=config.get("max_candidates", DEFAULT_MAX_CANDIDATES))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def put(self, key: Hashable, result: dict[str, CandidateList]) -> None:
+        """Keep a result, with the scores its candidates have now: the merge changes them afterwards"""
+        frozen = {
+            name: (asset_list.count, [(candidate.raw, candidate.r_score) for candidate in asset_list.assets])
+            for name, asset_list in result.items()
+        }
+        size = sum(len(candidates) for _, candidates in frozen.values())
+        # Nothing to fall back on in an empty result, and an empty entry would never be evicted
+        if size == 0 or size > self.max_candidates:
+            return
+        if (previous := self._entries.pop(key, None)) is not None:
+            self._candidates -= previous[1]
+        self._entries[key] = (frozen, size)
+        self._candidates += size
+        while self._candidates > self.max_candidates:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._candidates -= evicted_size
+
+    def get(self, key: Hashable) -> dict[str, CandidateList] | None:
+        """Return new candidates built from the kept result, None when there is none"""
+        if (entry := self._entries.get(key)) is None:
+            return None
+        self._entries.move_to_end(key)
+        result = {}
+        for name, (count, frozen_candidates) in entry[0].items():
+            candidates = []
+            for raw, r_score in frozen_candidates:
+                candidate = Candidate(raw)
+                candidate.r_score = r_score
+                candidates.append(candidate)
+            result[name] = CandidateList(candidates, count)
+        return result
+
+    def clear(self) -> None:
+        """Drop all the results"""
+        self._entries.clear()
+        self._candidates = 0
+
+
+_fallback_store: FallbackStore | None = None
+
+
+def get_fallback_store() -> FallbackStore:
+    """Return the process-wide fallback store"""
+    global _fallback_store  # noqa: PLW0603
+    if _fallback_store is None:
+        _fallback_store = FallbackStore.from_config()
+    return _fallback_store
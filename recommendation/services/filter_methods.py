@@ -1,30 +1,246 @@
+from collections.abc import Hashable, Sequence
+from typing import Any
+
 from msfwk.utils.logging import get_logger
+from pydantic import ValidationError
 
-from recommendation.filters.filter_holder import filters_apply
-from recommendation.filters.search_filters import SearchFilter
+from recommendation.filters.abstract_filter import AbstractFilter
 from recommendation.models.interfaces import (
-    RecommendableDocument,
+    Candidate,
+    DiversityMode,
+    SearchQuery,
 )
+from recommendation.services.cache import get_recommendation_cache, query_cache_key
+from recommendation.services.concurrency import SHED_REQUESTS
+from recommendation.services.diversity import DiversitySettings
+from recommendation.services.fallback import FALLBACKS
+from recommendation.services.pool import CandidatePool, extend_pool, fetch_pool, fetch_pools
+from recommendation.services.popularity import popularity_fallback, popularity_lookup
+from recommendation.services.selection import Ranking
+from recommendation.services.shared_cache import get_shared_cache
+from recommendation.services.single_flight import get_recommendation_flight
+from recommendation.services.timing import sample_request, span
 from recommendation.services.utils import get_k_best_r_score
 
 logger = get_logger("application")
 
 
 async def recommend(
-    filters: list[SearchFilter],
+    filters: Sequence[AbstractFilter],
+    query: SearchQuery,
     offset: int = 0,
     limit: int = 8,
-) -> tuple[list[RecommendableDocument], int]:
-    """Get content-based recommendations for a given query
+    diversity: DiversityMode | None = None,
+) -> tuple[list[dict[str, Any]], int, list[str]]:
+    """Get content-based recommendations for a given query.
+    Popularity queries are served by the materialized popularity table when there is a fresh one, and so is
+    any query for which the filters gave nothing (see _served_ranking).
+    The merged recommendations of a query are cached in a candidate pool, so all its pages are served by a single
+    filters_apply, read deep enough for the page and extended by the next window when a later page needs it.
+    The pools missing from the in-process cache are looked up in the cache shared by the replicas, if enabled.
+    The ranking is re-ranked for diversity before the pagination, see services.diversity.
 
     Args:
-        filters (list[SearchFilter]): all the filters to apply
+        filters (Sequence[AbstractFilter]): all the filters to apply
+        query (SearchQuery): the query of the request
         offset (int, optional): Number of results to skip. Defaults to 0.
         limit (int, optional): Number of results to return. Defaults to 8.
+        diversity (DiversityMode | None, optional): re-ranking mode, the configured one when None.
 
     Returns:
-        list[RecommendableDocument]: List of recommended assets
+        list[dict[str, Any]]: List of recommended assets, as RecommendableDocument JSON dumps
         int: nb of recommended assets
+        list[str]: names of the filters that contributed
+    """
+    sample_request()
+    with span("recommend"):
+        end = offset + limit
+        settings = DiversitySettings.from_config(diversity)
+        # The popularity rankings are read at a fixed depth, deeper pages are computed live
+        if (materialized := popularity_lookup(query, settings)) is not None and len(materialized[0]) >= end:
+            ranking, contributors = materialized
+        else:
+            # Concurrent requests of the same query share a single filters_apply.
+            # Only complete results are cached, a degraded one would be served long after the failing filter recovered
+            key = query_cache_key(query)
+            pool = await get_recommendation_cache().get_or_compute(
+                key,
+                lambda: get_recommendation_flight().do(key, lambda: _fetch_shared_pool(filters, query, key, end)),
+                size_of=len,
+                cacheable=lambda result: len(result.contributors) == len(filters),
+            )
+            pool = await _covering_pool(filters, query, key, pool, end)
+            ranking, contributors = _served_ranking(filters, query, pool, end, settings)
+        return _to_documents(get_k_best_r_score(ranking, offset, limit)), len(ranking), contributors
+
+
+def recommend_shed(
+    query: SearchQuery, offset: int = 0, limit: int = 8, diversity: DiversityMode | None = None
+) -> tuple[list[dict[str, Any]], int, list[str]] | None:
+    """Answer a request shed by the admission control without calling the filters: from the popularity table, the
+    cached pool of the query, even stale, or the popularity fallback. None when none of them has the ranks of the
+    page.
+
+    Returns:
+        tuple[list[dict[str, Any]], int, list[str]] | None: the result of recommend, or None
+    """
+    end = offset + limit
+    settings = DiversitySettings.from_config(diversity)
+    if (materialized := popularity_lookup(query, settings)) is not None and len(materialized[0]) >= end:
+        source, ranking, contributors = "popularity", *materialized
+    elif (cached := get_recommendation_cache().get(query_cache_key(query))) is not None and cached[0].covers(end):
+        pool = cached[0]
+        source, ranking, contributors = "cache", pool.serve(end, settings), pool.contributors
+    elif (fallback := popularity_fallback(query, settings)) is not None and len(fallback[0]) >= end:
+        source, ranking, contributors = "fallback", *fallback
+    else:
+        return None
+    SHED_REQUESTS.labels(source).inc()
+    return _to_documents(get_k_best_r_score(ranking, offset, limit)), len(ranking), contributors
+
+
+async def recommend_batch(
+    filters: Sequence[AbstractFilter],
+    requests: Sequence[tuple[SearchQuery, int, int, DiversityMode | None]],
+) -> list[tuple[list[dict[str, Any]], int, list[str]]]:
+    """Same as recommend for several (query, offset, limit, diversity), answered together.
+    The queries missing from the popularity table and the cache are sent to each filter at once, so the
+    SearchFilter answers all of them with a single multi-search.
+
+    Returns:
+        list[tuple[list[dict[str, Any]], int, list[str]]]: the result of recommend of each request, in order
+    """
+    sample_request()
+    with span("recommend_batch"):
+        cache = get_recommendation_cache()
+        generation = cache.generation
+        rankings: dict[tuple[Hashable, DiversitySettings], tuple[Ranking, list[str]]] = {}
+        pools: dict[Hashable, CandidatePool] = {}
+        missing: dict[Hashable, SearchQuery] = {}
+        keys = []
+        all_settings = []
+        for query, offset, limit, diversity in requests:
+            key = query_cache_key(query)
+            settings = DiversitySettings.from_config(diversity)
+            keys.append(key)
+            all_settings.append(settings)
+            if (key, settings) in rankings or key in pools or key in missing:
+                continue
+            materialized = popularity_lookup(query, settings)
+            if materialized is not None and len(materialized[0]) >= offset + limit:
+                rankings[key, settings] = materialized
+            elif (cached := cache.lookup(key)) is not None:
+                pools[key] = cached
+            else:
+                missing[key] = query
+
+        shared_cache = get_shared_cache()
+        if missing and shared_cache is not None:
+            shared_pools = await shared_cache.get_many([_shared_key(filters, key) for key in missing])
+            for key, pool in zip(list(missing), shared_pools, strict=True):
+                if pool is not None:
+                    pools[key] = pool
+                    cache.set(key, pool, len(pool), generation)
+                    del missing[key]
+
+        if missing:
+            ends = [
+                offset + limit for key, (_, offset, limit, _) in zip(keys, requests, strict=True) if key in missing
+            ]
+            new_pools = await fetch_pools(filters, list(missing.values()), max(ends))
+            complete: dict[Hashable, CandidatePool] = {}
+            for key, pool in zip(missing, new_pools, strict=True):
+                pools[key] = pool
+                # Same rule as recommend: only complete results are cached
+                if len(pool.contributors) == len(filters):
+                    cache.set(key, pool, len(pool), generation)
+                    complete[_shared_key(filters, key)] = pool
+            if complete and shared_cache is not None:
+                await shared_cache.set_many(complete)
+
+        responses = []
+        for key, settings, (query, offset, limit, _) in zip(keys, all_settings, requests, strict=True):
+            if (key, settings) in rankings:
+                ranking, contributors = rankings[key, settings]
+            else:
+                pools[key] = await _covering_pool(filters, query, key, pools[key], offset + limit)
+                ranking, contributors = _served_ranking(filters, query, pools[key], offset + limit, settings)
+            responses.append((_to_documents(get_k_best_r_score(ranking, offset, limit)), len(ranking), contributors))
+        return responses
+
+
+async def _covering_pool(
+    filters: Sequence[AbstractFilter], query: SearchQuery, key: Hashable, pool: CandidatePool, end: int
+) -> CandidatePool:
+    """Extend the pool until it holds the ranks up to end, the requests extending the same pool share the reads"""
+    while not pool.covers(end):
+        extended = await get_recommendation_flight().do(
+            (key, pool.depth), lambda pool=pool: _extend_and_cache(filters, query, key, pool, end)
+        )
+        if extended is pool:
+            break
+        pool = extended
+    return pool
+
+
+async def _extend_and_cache(
+    filters: Sequence[AbstractFilter], query: SearchQuery, key: Hashable, pool: CandidatePool, end: int
+) -> CandidatePool:
+    cache = get_recommendation_cache()
+    generation = cache.generation
+    extended = await extend_pool(filters, query, pool, end)
+    if extended is not pool and len(extended.contributors) == len(filters):
+        cache.set(key, extended, len(extended), generation)
+        if (shared_cache := get_shared_cache()) is not None:
+            await shared_cache.set(_shared_key(filters, key), extended)
+    return extended
+
+
+async def _fetch_shared_pool(
+    filters: Sequence[AbstractFilter], query: SearchQuery, key: Hashable, end: int
+) -> CandidatePool:
+    """fetch_pool behind the cache shared by the replicas, when it is enabled"""
+    if (shared_cache := get_shared_cache()) is None:
+        return await fetch_pool(filters, query, end)
+    return await shared_cache.get_or_refill(
+        _shared_key(filters, key),
+        lambda: fetch_pool(filters, query, end),
+        cacheable=lambda pool: len(pool.contributors) == len(filters),
+    )
+
+
+def _shared_key(filters: Sequence[AbstractFilter], key: Hashable) -> Hashable:
+    """Key of a query in the shared cache: the replicas may run with different filters during a deployment, and the
+    filters rebuilt from a new config no longer read the entries of the previous one
     """
-    assets = await filters_apply(filters)
-    return get_k_best_r_score(assets, offset, limit), len(assets)
+    return (tuple((curr_filter.filter_name, curr_filter.fingerprint) for curr_filter in filters), key)
+
+
+def _served_ranking(
+    filters: Sequence[AbstractFilter],
+    query: SearchQuery,
+    pool: CandidatePool,
+    end: int,
+    settings: DiversitySettings,
+) -> tuple[Ranking, list[str]]:
+    """The ranking of the pool serving the ranks up to end, or the popularity ranking of the type of the query when
+    the filters failed and left the pool empty, re-ranked with the diversity settings
+    """
+    if len(pool) == 0 and len(pool.contributors) < len(filters):
+        if (fallback := popularity_fallback(query, settings)) is not None:
+            FALLBACKS.labels("", "popularity").inc()
+            logger.warning("No filter answered, serving the most popular assets of type %s", query.documentType)
+            return fallback
+    return pool.serve(end, settings), pool.contributors
+
+
+def _to_documents(candidates: list[Candidate]) -> list[dict[str, Any]]:
+    """Validate and dump the candidates of the returned page, an invalid one is dropped"""
+    documents = []
+    with span("validate"):
+        for candidate in candidates:
+            try:
+                documents.append(candidate.to_document_dict())
+            except ValidationError as ve:
+                logger.warning("Dropping invalid recommended asset %s: %s", candidate.id, ve)
+    return documents
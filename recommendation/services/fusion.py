@@ -0,0 +1,135 @@
+"""Fusion of the lists returned by the filters into the scored candidates of a query.
+
+Every list is keyed by its filter and its minor filter (``("Global Search Filter", "likes_count")``), so two filters
+returning a list of the same name are both merged. The lists are read once: each asset gets the slot of its id,
+its score of the list is written in an array aligned with the slots, and the scores of the same slot are combined
+with a vectorized reduction. The candidate of the first occurrence of an id is kept and carries the fused score.
+
+Strategies, ``strategy`` in the ``fusion`` section of the config:
+
+- weighted_sum: sum of the r_scores of the lists, each multiplied by the weight of its list
+- rrf: reciprocal rank fusion, sum of weight / (``rrf_k`` + rank) over the lists, the rank of an asset in its list
+  being by decreasing r_score from 1 (from the offset of the window when a candidate pool is extended)
+- max: best weighted r_score of the lists
+
+A weight is set per filter, or per minor filter of a filter, in ``weights``, and is 1 otherwise.
+"""
+
+from collections.abc import Mapping
+from typing import Literal, get_args
+
+import numpy as np
+from msfwk.context import current_config
+from msfwk.utils.logging import get_logger
+
+from recommendation.models.interfaces import Candidate, CandidateList
+from recommendation.services.scoring import extract_field
+from recommendation.services.timing import span
+
+logger = get_logger(__name__)
+
+FusionStrategy = Literal["weighted_sum", "rrf", "max"]
+FUSION_STRATEGIES = get_args(FusionStrategy)
+DEFAULT_STRATEGY = "weighted_sum"
+DEFAULT_RRF_K = 60.0
+DEFAULT_WEIGHT = 1.0
+
+# Lists of a query, by filter name and minor filter name
+FilterResults = Mapping[tuple[str, str], CandidateList]
+
+
+class ScoreFusion:
+    """Merge of the lists of the filters by a fusion strategy, see the module docstring"""
+
+    def __init__(
+        self,
+        strategy: FusionStrategy = DEFAULT_STRATEGY,
+        rrf_k: float = DEFAULT_RRF_K,
+        weights: Mapping[str, float | Mapping[str, float]] | None = None,
+    ) -> None:
+        self.strategy = strategy
+        self.rrf_k = rrf_k
+        self.weights = weights or {}
+
+    @classmethod
+    def from_config(cls) -> "ScoreFusion":
+        """Build from the ``fusion`` section of the config"""
+        config = current_config.get().get("fusion", {})
+        if (strategy := config.get("strategy", DEFAULT_STRATEGY)) not in FUSION_STRATEGIES:
+            logger.warning("Unknown fusion strategy %s, using %s", strategy, DEFAULT_STRATEGY)
+            strategy = DEFAULT_STRATEGY
+        return cls(strategy, rrf_k=config.get("rrf_k", DEFAULT_RRF_K), weights=config.get("weights", {}))
+
+    def weight(self, filter_name: str, minor_name: str) -> float:
+        """Weight of a list: the one of its minor filter, else the one of its filter, else 1"""
+        weight = self.weights.get(filter_name, DEFAULT_WEIGHT)
+        if isinstance(weight, Mapping):
+            return float(weight.get(minor_name, DEFAULT_WEIGHT))
+        return float(weight)
+
+    def fuse(self, results: FilterResults, rank_offset: int = 0) -> list[Candidate]:
+        """Merge the lists into one candidate per asset, in order of first appearance
+
+        Args:
+            results (FilterResults): lists of the filters, by filter name and minor filter name
+            rank_offset (int): rank of the first asset of each list minus one, the offset of a window of the lists
+
+        Returns:
+            list[Candidate]: the candidate of the first occurrence of each asset, carrying its fused r_score
+        """
+        with span("merge"):
+            total = sum(len(asset_list.assets) for asset_list in results.values())
+            slots = np.empty(total, dtype=np.intp)
+            scores = np.empty(total, dtype=np.float64)
+            index: dict[str, int] = {}
+            merged: list[Candidate] = []
+            start = 0
+            for (filter_name, minor_name), asset_list in results.items():
+                assets = asset_list.assets
+                for position, asset in enumerate(assets, start):
+                    if (slot := index.get(asset.id)) is None:
+                        slot = index[asset.id] = len(merged)
+                        merged.append(asset)
+                    slots[position] = slot
+                end = start + len(assets)
+                scores[start:end] = self._list_scores(assets, rank_offset) * self.weight(filter_name, minor_name)
+                start = end
+
+            if self.strategy == "max":
+                fused = np.full(len(merged), -np.inf)
+                np.maximum.at(fused, slots, scores)
+            else:
+                fused = np.bincount(slots, weights=scores, minlength=len(merged))
+            for candidate, r_score in zip(merged, fused.tolist(), strict=True):
+                candidate.r_score = r_score
+        return merged
+
+    def combine(self, score: float, other: float) -> float:
+        """Fused score of an asset from its fused scores in two windows of the lists, as a single fuse would give"""
+        return max(score, other) if self.strategy == "max" else score + other
+
+    def _list_scores(self, assets: list[Candidate], rank_offset: int) -> np.ndarray:
+        """Score of each asset of a list before weighting"""
+        r_scores = extract_field(assets, "r_score")
+        if self.strategy != "rrf":
+            return r_scores
+        ranks = np.empty(len(assets), dtype=np.float64)
+        ranks[np.argsort(-r_scores, kind="stable")] = np.arange(rank_offset + 1, rank_offset + len(assets) + 1)
+        return 1.0 / (self.rrf_k + ranks)
+
+
+_score_fusion: ScoreFusion | None = None
+
+
+def get_score_fusion() -> ScoreFusion:
+    """Return the process-wide score fusion"""
+    global _score_fusion  # noqa: PLW0603
+    if _score_fusion is None:
+        _score_fusion = ScoreFusion.from_config()
+    return _score_fusion
+
+
+def score_fusion_reset() -> None:
+    """Forget the score fusion, the next merge builds it from the config again"""
+    global _score_fusion  # noqa: PLW0603
+    _score_fusion = None
@@ -0,0 +1,273 @@
+"""Hedged and retried calls to the upstream services.
+
+When a call has no response after the ``percentile`` of the latencies recently observed for its filter (at least
+``min_delay``), a duplicate request is sent, to the next host of the filter when it has several. The first
+response is used and the other request is cancelled. A call failing with a transient error (connection error,
+timeout, status 500, 502, 503 or 504) is retried at most ``max_retries`` times after a jittered exponential
+backoff: the requests of the filters are searches, idempotent.
+
+The hedges and the retries are paid from a retry budget: each call deposits ``budget_ratio`` token, each extra
+request withdraws one, and the balance is capped at ``budget_max_tokens``. Over time the extra requests are at
+most ``budget_ratio`` of the calls, so they cannot amplify the load of a struggling upstream.
+
+Settings come from the ``hedging`` section of the config, overridden per filter in its ``filters`` subsection.
+The policy is opt-in: disabled, a call is a single request.
+"""
+
+import asyncio
+import random
+import time
+from collections.abc import Awaitable, Callable, Sequence
+from typing import TypeVar
+
+import aiohttp
+import numpy as np
+from msfwk.context import current_config
+from msfwk.utils.logging import get_logger
+from prometheus_client import Counter, Gauge
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+DEFAULT_PERCENTILE = 95.0
+DEFAULT_MIN_DELAY = 0.05
+DEFAULT_MAX_HEDGES = 1
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_RETRY_BACKOFF = 0.05
+DEFAULT_MAX_RETRY_BACKOFF = 0.5
+DEFAULT_BUDGET_RATIO = 0.1
+DEFAULT_BUDGET_MAX_TOKENS = 10.0
+DEFAULT_WINDOW = 200
+DEFAULT_MIN_SAMPLES = 20
+# Observations between two computations of the hedge delay
+RECOMPUTE_EVERY = 16
+RETRYABLE_STATUSES = frozenset({500, 502, 503, 504})
+
+FIRST = "first"
+HEDGE = "hedge"
+RETRY = "retry"
+
+UPSTREAM_REQUESTS = Counter(
+    "recommendation_upstream_requests_total",
+    "Requests sent to the upstream services, by filter and kind (first, hedge, retry)",
+    ["filter", "kind"],
+)
+UPSTREAM_WINS = Counter(
+    "recommendation_upstream_wins_total",
+    "Calls answered, by filter and kind of the request that answered first (first, hedge, retry)",
+    ["filter", "kind"],
+)
+UPSTREAM_BUDGET_EXHAUSTED = Counter(
+    "recommendation_upstream_budget_exhausted_total",
+    "Hedges and retries not sent for lack of retry budget, by filter and kind",
+    ["filter", "kind"],
+)
+HEDGE_DELAY = Gauge("recommendation_hedge_delay_seconds", "Current hedge delay of each filter", ["filter"])
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether a failed request may be sent again: a transient error of the connection or of the service"""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in RETRYABLE_STATUSES
+    return isinstance(error, aiohttp.ClientConnectionError | TimeoutError)
+
+
+class LatencyTracker:
+    """Percentile of the last ``window`` latencies"""
+
+    def __init__(
+        self, percentile: float, window: int = DEFAULT_WINDOW, min_samples: int = DEFAULT_MIN_SAMPLES
+    ) -> None:
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self._latencies = np.zeros(window, dtype=np.float64)
+        self._count = 0
+        self._value: float | None = None
+
+    def observe(self, seconds: float) -> None:
+        """Record a latency"""
+        self._latencies[self._count % len(self._latencies)] = seconds
+        self._count += 1
+        if self._count >= self.min_samples and (self._value is None or self._count % RECOMPUTE_EVERY == 0):
+            self._value = float(np.percentile(self._latencies[: self._count], self.percentile))
+
+    @property
+    def value(self) -> float | None:
+        """The percentile, None until min_samples latencies were observed"""
+        return self._value
+
+
+class RetryBudget:
+    """Tokens paying for the extra requests, see the module docstring"""
+
+    def __init__(self, ratio: float = DEFAULT_BUDGET_RATIO, max_tokens: float = DEFAULT_BUDGET_MAX_TOKENS) -> None:
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def deposit(self) -> None:
+        """Record a call"""
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        """Pay for an extra request, False when the budget is exhausted"""
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class UpstreamPolicy:
+    """Hedges and retries of the calls of a filter, see the module docstring"""
+
+    def __init__(  # noqa: PLR0913
+        self,
+        name: str,
+        enabled: bool = False,
+        percentile: float = DEFAULT_PERCENTILE,
+        min_delay: float = DEFAULT_MIN_DELAY,
+        max_hedges: int = DEFAULT_MAX_HEDGES,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        retry_backoff: float = DEFAULT_RETRY_BACKOFF,
+        max_retry_backoff: float = DEFAULT_MAX_RETRY_BACKOFF,
+        budget: RetryBudget | None = None,
+        latencies: LatencyTracker | None = None,
+    ) -> None:
+        self.name = name
+        self.enabled = enabled
+        self.min_delay = min_delay
+        self.max_hedges = max_hedges
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self.budget = budget if budget is not None else RetryBudget()
+        self.latencies = latencies if latencies is not None else LatencyTracker(percentile)
+        HEDGE_DELAY.labels(name).set_function(lambda: self.hedge_delay or 0.0)
+
+    @classmethod
+    def from_config(cls, name: str) -> "UpstreamPolicy":
+        """Build the policy of a filter from the ``hedging`` section of the config"""
+        section = current_config.get().get("hedging", {})
+        config = {**section, **section.get("filters", {}).get(name, {})}
+        return cls(
+            name,
+            enabled=config.get("enabled", False),
+            min_delay=config.get("min_delay", DEFAULT_MIN_DELAY),
+            max_hedges=config.get("max_hedges", DEFAULT_MAX_HEDGES),
+            max_retries=config.get("max_retries", DEFAULT_MAX_RETRIES),
+            retry_backoff=config.get("retry_backoff", DEFAULT_RETRY_BACKOFF),
+            max_retry_backoff=config.get("max_retry_backoff", DEFAULT_MAX_RETRY_BACKOFF),
+            budget=RetryBudget(
+                config.get("budget_ratio", DEFAULT_BUDGET_RATIO),
+                config.get("budget_max_tokens", DEFAULT_BUDGET_MAX_TOKENS),
+            ),
+            latencies=LatencyTracker(
+                config.get("percentile", DEFAULT_PERCENTILE),
+                config.get("window", DEFAULT_WINDOW),
+                config.get("min_samples", DEFAULT_MIN_SAMPLES),
+            ),
+        )
+
+    @property
+    def hedge_delay(self) -> float | None:
+        """Delay after which a call without response is hedged, None until enough latencies were observed"""
+        if (percentile := self.latencies.value) is None:
+            return None
+        return max(percentile, self.min_delay)
+
+    def retry_delay(self, retry: int) -> float:
+        """Backoff before a retry: uniform up to an exponential bound (full jitter)"""
+        return random.uniform(0, min(self.max_retry_backoff, self.retry_backoff * 2 ** (retry - 1)))  # noqa: S311
+
+    async def call(self, urls: Sequence[str], send: Callable[[str], Awaitable[T]]) -> T:
+        """Send a request with send(url), hedged and retried over the urls
+
+        Args:
+            urls (Sequence[str]): hosts of the request, the first one first, the next ones for the extra requests
+            send (Callable[[str], Awaitable[T]]): sends the request to a url, raises on failure
+
+        Returns:
+            T: the first response, the error of the last request is raised when none succeeded
+        """
+        if not self.enabled:
+            return await send(urls[0])
+        self.budget.deposit()
+        pending: dict[asyncio.Task[T], tuple[str, float]] = {}
+        sent = 0
+        hedges = 0
+        retries = 0
+        # Start of the request that answered, None until one did
+        won_started_at: float | None = None
+
+        def send_next(kind: str) -> None:
+            nonlocal sent
+            UPSTREAM_REQUESTS.labels(self.name, kind).inc()
+            pending[asyncio.create_task(send(urls[sent % len(urls)]))] = (kind, time.monotonic())
+            sent += 1
+
+        send_next(FIRST)
+        try:
+            while True:
+                hedge_delay = self.hedge_delay if hedges < self.max_hedges else None
+                done, _ = await asyncio.wait(pending, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedges += 1
+                    if self.budget.withdraw():
+                        send_next(HEDGE)
+                    else:
+                        UPSTREAM_BUDGET_EXHAUSTED.labels(self.name, HEDGE).inc()
+                    continue
+
+                error: BaseException | None = None
+                won: tuple[asyncio.Task[T], str, float] | None = None
+                # The error of every done task is read, asyncio logs the ones never retrieved
+                for task in done:
+                    kind, started_at = pending.pop(task)
+                    if (task_error := task.exception()) is not None:
+                        error = task_error
+                    elif won is None:
+                        won = (task, kind, started_at)
+                if won is not None:
+                    task, kind, won_started_at = won
+                    self.latencies.observe(time.monotonic() - won_started_at)
+                    UPSTREAM_WINS.labels(self.name, kind).inc()
+                    return task.result()
+                if pending:
+                    continue
+                if not is_retryable(error) or retries >= self.max_retries:
+                    raise error
+                if not self.budget.withdraw():
+                    UPSTREAM_BUDGET_EXHAUSTED.labels(self.name, RETRY).inc()
+                    raise error
+                retries += 1
+                logger.debug("Retrying the request of filter %s after %r", self.name, error)
+                await asyncio.sleep(self.retry_delay(retries))
+                send_next(RETRY)
+        finally:
+            now = time.monotonic()
+            for task in pending:
+                task.cancel()
+            # The elapsed time of a cancelled request is a lower bound of its latency, it keeps the slow requests in
+            # the percentile. Only the ones sent before the request that answered (the oldest one when none did) are
+            # observed: a hedge cancelled by the answer of the first request is younger than the hedge delay, it would
+            # pull the percentile, then the hedge delay, down
+            started = sorted(started_at for _, started_at in pending.values())
+            lost = started[:1] if won_started_at is None else [at for at in started if at < won_started_at]
+            for started_at in lost:
+                self.latencies.observe(now - started_at)
+
+
+_upstream_policies: dict[str, UpstreamPolicy] = {}
+
+
+def get_upstream_policy(filter_name: str) -> UpstreamPolicy:
+    """Return the process-wide hedging policy of a filter"""
+    if (policy := _upstream_policies.get(filter_name)) is None:
+        policy = _upstream_policies[filter_name] = UpstreamPolicy.from_config(filter_name)
+    return policy
+
+
+def upstream_policies_reset() -> None:
+    """Forget the policies, the next calls build them from the config again"""
+    _upstream_policies.clear()
@@ -0,0 +1,158 @@
+"""Application-lifetime HTTP client shared by all the filters.
+
+One aiohttp session (so one connector) is opened at startup and closed at shutdown: the filters reuse its
+keep-alive connections, DNS cache and timeouts instead of opening a new connector on every request.
+Settings come from the ``http_client`` section of the config.
+"""
+
+import time
+from types import SimpleNamespace
+
+import aiohttp
+from msfwk.context import current_config
+from msfwk.utils.logging import get_logger
+from prometheus_client import Gauge, Histogram
+
+logger = get_logger(__name__)
+
+DEFAULT_POOL_SIZE = 100
+DEFAULT_POOL_SIZE_PER_HOST = 20
+DEFAULT_DNS_CACHE_TTL = 300
+DEFAULT_KEEPALIVE_TIMEOUT = 30.0
+DEFAULT_CONNECT_TIMEOUT = 2.0
+DEFAULT_READ_TIMEOUT = 5.0
+
+POOL_CONNECTIONS = Gauge(
+    "recommendation_http_pool_connections",
+    "Connections of the shared HTTP pool, by state",
+    ["state"],
+)
+POOL_QUEUE_WAIT = Histogram(
+    "recommendation_http_pool_queue_wait_seconds",
+    "Time spent waiting for a free connection of the shared HTTP pool",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+
+class HttpClient:
+    """Keep-alive connection pool towards the upstream services"""
+
+    def __init__(  # noqa: PLR0913
+        self,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        pool_size_per_host: int = DEFAULT_POOL_SIZE_PER_HOST,
+        dns_cache_ttl: int = DEFAULT_DNS_CACHE_TTL,
+        keepalive_timeout: float = DEFAULT_KEEPALIVE_TIMEOUT,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float = DEFAULT_READ_TIMEOUT,
+    ) -> None:
+        self.pool_size = pool_size
+        self.pool_size_per_host = pool_size_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout)
+        self._session: aiohttp.ClientSession | None = None
+
+    @classmethod
+    def from_config(cls) -> "HttpClient":
+        """Build the client from the ``http_client`` section of the config"""
+        config = current_config.get().get("http_client", {})
+        return cls(
+            pool_size=config.get("pool_size", DEFAULT_POOL_SIZE),
+            pool_size_per_host=config.get("pool_size_per_host", DEFAULT_POOL_SIZE_PER_HOST),
+            dns_cache_ttl=config.get("dns_cache_ttl", DEFAULT_DNS_CACHE_TTL),
+            keepalive_timeout=config.get("keepalive_timeout", DEFAULT_KEEPALIVE_TIMEOUT),
+            connect_timeout=config.get("connect_timeout", DEFAULT_CONNECT_TIMEOUT),
+            read_timeout=config.get("read_timeout", DEFAULT_READ_TIMEOUT),
+        )
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """The shared session, (re)opened on first use so it is bound to the running event loop"""
+        if self._session is None or self._session.closed:
+            self._session = self._create_session()
+        return self._session
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        logger.info(
+            "Opening HTTP pool (size=%s, per host=%s, dns ttl=%ss)",
+            self.pool_size,
+            self.pool_size_per_host,
+            self.dns_cache_ttl,
+        )
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_size,
+            limit_per_host=self.pool_size_per_host,
+            use_dns_cache=True,
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        return aiohttp.ClientSession(connector=connector, timeout=self.timeout, trace_configs=[_queue_trace_config()])
+
+    async def close(self) -> None:
+        """Close the session and all the pooled connections"""
+        if self._session is not None and not self._session.closed:
+            logger.info("Closing HTTP pool")
+            await self._session.close()
+        self._session = None
+
+    @property
+    def connections_in_use(self) -> int:
+        """Number of connections currently handling a request"""
+        if self._session is None or self._session.closed:
+            return 0
+        # aiohttp does not expose the pool state publicly
+        return len(self._session.connector._acquired)  # noqa: SLF001
+
+    @property
+    def connections_idle(self) -> int:
+        """Number of open connections waiting to be reused"""
+        if self._session is None or self._session.closed:
+            return 0
+        return sum(len(conns) for conns in self._session.connector._conns.values())  # noqa: SLF001
+
+
+def _queue_trace_config() -> aiohttp.TraceConfig:
+    """Measure how long requests wait for a free connection when the pool is exhausted"""
+
+    async def on_queued_start(
+        _session: aiohttp.ClientSession, ctx: SimpleNamespace, _params: aiohttp.TraceConnectionQueuedStartParams
+    ) -> None:
+        ctx.queued_at = time.perf_counter()
+
+    async def on_queued_end(
+        _session: aiohttp.ClientSession, ctx: SimpleNamespace, _params: aiohttp.TraceConnectionQueuedEndParams
+    ) -> None:
+        POOL_QUEUE_WAIT.observe(time.perf_counter() - ctx.queued_at)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_queued_start.append(on_queued_start)
+    trace_config.on_connection_queued_end.append(on_queued_end)
+    return trace_config
+
+
+_http_client: HttpClient | None = None
+
+POOL_CONNECTIONS.labels("in_use").set_function(lambda: _http_client.connections_in_use if _http_client else 0)
+POOL_CONNECTIONS.labels("idle").set_function(lambda: _http_client.connections_idle if _http_client else 0)
+
+
+def get_http_client() -> HttpClient:
+    """Return the shared HTTP client, creating it if the startup hook did not run"""
+    global _http_client  # noqa: PLW0603
+    if _http_client is None:
+        _http_client = HttpClient.from_config()
+    return _http_client
+
+
+async def http_client_start() -> None:
+    """Startup hook: create the shared HTTP client"""
+    get_http_client()
+
+
+async def http_client_stop() -> None:
+    """Shutdown hook: close the shared HTTP client"""
+    global _http_client  # noqa: PLW0603
+    if _http_client is not None:
+        await _http_client.close()
+        _http_client = None
@@ -0,0 +1,230 @@
+"""Candidate pool of a query: the ranked candidates read so far from the filters.
+
+The filters are asked for the first ``depth`` assets of each of their ranked lists. The depth is sized from
+the end of the requested page (at least ``min_size`` candidates) and from the overlap of the lists observed so
+far: lists returning the same assets yield fewer distinct candidates per level of depth. When a later page
+goes past the pool, only the next window of each list is fetched and merged in: the ranks of the pool already served
+are kept, the others are ranked again with the window. Settings come from the ``pool`` section of the config.
+"""
+
+import math
+from collections.abc import Sequence
+
+from msfwk.context import current_config
+from msfwk.utils.logging import get_logger
+from prometheus_client import Counter, Histogram
+
+from recommendation.filters.abstract_filter import AbstractFilter
+from recommendation.filters.filter_holder import filters_apply, filters_apply_batch
+from recommendation.models.constants import TOP_K_FIELDS, TOP_K_RECOMMENDATIONS
+from recommendation.models.interfaces import Candidate, SearchQuery
+from recommendation.services.diversity import NO_DIVERSITY, DiversitySettings, DiversityState, diversify
+from recommendation.services.fusion import get_score_fusion
+from recommendation.services.selection import Ranking
+
+logger = get_logger(__name__)
+
+DEFAULT_MIN_SIZE = TOP_K_RECOMMENDATIONS
+DEFAULT_MAX_DEPTH = 500
+# Weight of the last observation in the moving average of the yield
+YIELD_SMOOTHING = 0.2
+
+POOL_FETCHES = Counter(
+    "recommendation_pool_fetches_total", "Reads of the filters, by kind (initial, extension)", ["kind"]
+)
+POOL_DEPTH = Histogram(
+    "recommendation_pool_depth",
+    "Depth of the ranked lists requested from the filters",
+    buckets=(5, 10, 20, 50, 100, 200, 500, 1000),
+)
+
+
+class CandidatePool:
+    """Ranked candidates of a query, read down to ``depth`` in each ranked list of the filters"""
+
+    __slots__ = (
+        "ranking",
+        "contributors",
+        "depth",
+        "exhausted",
+        "maxima",
+        "diversified",
+        "extended_diversified",
+        "served",
+    )
+
+    def __init__(  # noqa: PLR0913
+        self,
+        ranking: Ranking[Candidate],
+        contributors: list[str],
+        depth: int,
+        exhausted: bool,
+        maxima: dict[str, float] | None = None,
+        extended_diversified: dict[DiversitySettings, tuple[Ranking[Candidate], DiversityState]] | None = None,
+        served: int = 0,
+    ) -> None:
+        self.ranking = ranking
+        self.contributors = contributors
+        self.depth = depth
+        # Nothing more to read: the lists are shorter than the depth, or the depth is at its bound
+        self.exhausted = exhausted
+        # Normalization maxima of the first window, the next windows are scored against them
+        self.maxima = maxima if maxima is not None else _maxima(ranking.candidates)
+        # Re-ranked orders computed so far by settings, and those of the pool this one extends
+        self.diversified: dict[DiversitySettings, tuple[Ranking[Candidate], DiversityState]] = {}
+        self.extended_diversified = extended_diversified or {}
+        # Ranks of the pool that may have been served, frozen for its extensions
+        self.served = served
+
+    def __len__(self) -> int:
+        return len(self.ranking)
+
+    def covers(self, end: int) -> bool:
+        """Whether the ranks up to end are in the pool, or will never be"""
+        return self.exhausted or len(self) >= end
+
+    def diversified_ranking(self, settings: DiversitySettings) -> Ranking[Candidate]:
+        """The ranking re-ranked for diversity (see services.diversity), computed once per settings.
+        The candidates added by an extension are re-ranked after the ones of the extended pool, so the pages
+        served from it do not change.
+        """
+        if settings.mode == NO_DIVERSITY:
+            return self.ranking
+        if (entry := self.diversified.get(settings)) is None:
+            ranked_before, state = self.extended_diversified.get(settings, (Ranking.ordered([]), None))
+            ranked, state = diversify(self.ranking.page(len(ranked_before), len(self)), settings, state)
+            entry = self.diversified[settings] = (Ranking.ordered([*ranked_before.candidates, *ranked]), state)
+        return entry[0]
+
+    def serve(self, end: int, settings: DiversitySettings) -> Ranking[Candidate]:
+        """The ranking serving the ranks up to end, which are frozen for the extensions of the pool"""
+        ranking = self.diversified_ranking(settings)
+        # A re-ranked page may hold candidates of any rank of the pool
+        self.served = max(self.served, min(end, len(self)) if ranking is self.ranking else len(self))
+        return ranking
+
+
+class PoolSizer:
+    """Depth to read in each ranked list to get a number of distinct candidates.
+
+    The yield (distinct candidates per level of depth) is between 1 when the lists return the same assets and
+    the number of lists when they do not overlap. It starts at 1, the safe side, and follows the observations.
+    """
+
+    def __init__(self, min_size: int = DEFAULT_MIN_SIZE, max_depth: int = DEFAULT_MAX_DEPTH) -> None:
+        self.min_size = min_size
+        self.max_depth = max_depth
+        self.yield_ratio = 1.0
+
+    @classmethod
+    def from_config(cls) -> "PoolSizer":
+        """Build the sizer from the ``pool`` section of the config"""
+        config = current_config.get().get("pool", {})
+        return cls(
+            min_size=config.get("min_size", DEFAULT_MIN_SIZE),
+            max_depth=config.get("max_depth", DEFAULT_MAX_DEPTH),
+        )
+
+    def depth_for(self, end: int) -> int:
+        """Depth giving at least max(end, min_size) distinct candidates, bounded by max_depth"""
+        return min(max(math.ceil(max(end, self.min_size) / self.yield_ratio), 1), self.max_depth)
+
+    def observe(self, depth: int, distinct: int) -> None:
+        """Record the distinct candidates given by a full read at this depth"""
+        if depth <= 0:
+            return
+        self.yield_ratio += YIELD_SMOOTHING * (max(distinct / depth, 1.0) - self.yield_ratio)
+
+
+async def fetch_pool(filters: Sequence[AbstractFilter], query: SearchQuery, end: int) -> CandidatePool:
+    """Read the first window of the filters, deep enough for the ranks up to end"""
+    depth = get_pool_sizer().depth_for(end)
+    POOL_FETCHES.labels("initial").inc()
+    POOL_DEPTH.observe(depth)
+    candidates, contributors = await filters_apply(filters, query.model_copy(update={"poolLimit": depth}))
+    return _first_pool(candidates, contributors, depth)
+
+
+async def fetch_pools(
+    filters: Sequence[AbstractFilter], queries: Sequence[SearchQuery], end: int
+) -> list[CandidatePool]:
+    """Same as fetch_pool for several queries at once (see filters_apply_batch), with the same depth"""
+    depth = get_pool_sizer().depth_for(end)
+    POOL_FETCHES.labels("initial").inc(len(queries))
+    POOL_DEPTH.observe(depth)
+    results = await filters_apply_batch(
+        filters, [query.model_copy(update={"poolLimit": depth}) for query in queries]
+    )
+    return [_first_pool(candidates, contributors, depth) for candidates, contributors in results]
+
+
+def _first_pool(candidates: list[Candidate], contributors: list[str], depth: int) -> CandidatePool:
+    sizer = get_pool_sizer()
+    # The lists of a query hold the same matching assets: a list full at this depth gives depth distinct assets
+    exhausted = len(candidates) < depth
+    if not exhausted:
+        sizer.observe(depth, len(candidates))
+    return CandidatePool(Ranking(candidates), contributors, depth, exhausted or depth >= sizer.max_depth)
+
+
+async def extend_pool(
+    filters: Sequence[AbstractFilter], query: SearchQuery, pool: CandidatePool, end: int
+) -> CandidatePool:
+    """Read the next window of the filters and merge it in a new pool, the given pool is left untouched.
+    The pool is returned as is when a filter failed to read its window.
+    """
+    sizer = get_pool_sizer()
+    depth = min(max(sizer.depth_for(end), 2 * pool.depth), sizer.max_depth)
+    window = depth - pool.depth
+    POOL_FETCHES.labels("extension").inc()
+    POOL_DEPTH.observe(depth)
+    window_candidates, contributors = await filters_apply(
+        filters,
+        query.model_copy(update={"poolOffset": pool.depth, "poolLimit": window, "poolMaxima": pool.maxima}),
+    )
+    if len(contributors) < len(pool.contributors):
+        logger.warning("Failed to extend the candidate pool to %s, serving %s candidates", depth, len(pool))
+        return pool
+
+    # The ranks that may have been served keep their order and their score, so consecutive pages never overlap nor
+    # skip a candidate. The other candidates of the pool are ranked again with the window, the scores of an asset
+    # found in both combined, as a first read at the new depth would rank them. A re-ranked order of the pool is
+    # extended as is, so all of its ranks are kept then.
+    frozen = len(pool) if pool.diversified else pool.served
+    served = pool.ranking.page(0, frozen)
+    served_ids = {candidate.id for candidate in served}
+    window_by_id = {candidate.id: candidate for candidate in window_candidates if candidate.id not in served_ids}
+    fusion = get_score_fusion()
+    unserved = []
+    for candidate in pool.ranking.page(frozen, len(pool)):
+        # The candidates of the pool are shared with the requests reading it, the one of the window carries the score
+        if (fresh := window_by_id.pop(candidate.id, None)) is not None:
+            fresh.r_score = fusion.combine(candidate.r_score, fresh.r_score)
+            candidate = fresh
+        unserved.append(candidate)
+    unserved.extend(window_by_id.values())
+    ranked = served + Ranking(unserved).page(0, len(unserved))
+    exhausted = len(window_candidates) < window or depth >= sizer.max_depth
+    logger.debug("Candidate pool extended from %s to %s: %s candidates", pool.depth, depth, len(ranked))
+    return CandidatePool(
+        Ranking.ordered(ranked), pool.contributors, depth, exhausted, pool.maxima, dict(pool.diversified), frozen
+    )
+
+
+def _maxima(candidates: Sequence[Candidate]) -> dict[str, float]:
+    """Max of the ranked fields over the candidates"""
+    return {
+        field: max((float(getattr(candidate, field)) for candidate in candidates), default=0.0)
+        for field in TOP_K_FIELDS
+    }
+
+
+_pool_sizer: PoolSizer | None = None
+
+
+def get_pool_sizer() -> PoolSizer:
+    """Return the process-wide pool sizer"""
+    global _pool_sizer  # noqa: PLW0603
+    if _pool_sizer is None:
+        _pool_sizer = PoolSizer.from_config()
+    return _pool_sizer
@@ -0,0 +1,550 @@
+"""Materialized popularity tables.
+
+With an empty text, the recommendations only depend on (type, source, category) and are the same for every
+user. A background job periodically ranks the contexts with the configured filters (the
+MostDownloadedFilter/MostLikedFilter weighting of the SearchFilter) and swaps the new table in at once, so
+those requests are answered without calling the search service. Only the contexts seen in the traffic since the
+previous build are ranked, at most ``max_contexts`` of them. Settings come from the ``popularity`` section of the
+config.
+
+With a ``snapshot`` file, a single worker of the host (the holder of its writer lock) builds the table and writes
+it in the snapshot, the other workers load each new version of the snapshot instead of calling the search service.
+The writer alone applies the events, it writes the updated table at most every ``snapshot_interval`` seconds.
+The other workers write the contexts they looked up next to the snapshot, the writer ranks the contexts requested
+from all of them.
+"""
+
+import asyncio
+import contextlib
+import json
+import math
+import os
+import time
+from collections.abc import Iterator, Mapping, Sequence
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from despsharedlibrary.schemas.collaborative_schema import AssetType, SourceType
+from msfwk.context import current_config
+from msfwk.utils.logging import get_logger
+from prometheus_client import Counter, Gauge
+
+from recommendation.filters.abstract_filter import AbstractFilter
+from recommendation.filters.filter_holder import filters_apply_lists, filters_get, filters_ready
+from recommendation.filters.utils import document_matches
+from recommendation.models.interfaces import Candidate, CandidateList, EventBatch, SearchQuery
+from recommendation.services.codec import json_loads
+from recommendation.services.diversity import NO_DIVERSITY, DiversitySettings, diversify_ranking
+from recommendation.services.fusion import get_score_fusion
+from recommendation.services.scoring import extract_field
+from recommendation.services.selection import Ranking
+from recommendation.services.snapshot import (
+    PackedStrings,
+    Snapshot,
+    SnapshotFile,
+    WriterLock,
+    pack_strings,
+    write_snapshot,
+)
+
+logger = get_logger(__name__)
+
+DEFAULT_REFRESH_INTERVAL = 300.0
+DEFAULT_MAX_AGE = 900.0
+DEFAULT_MAX_CONTEXTS = 100
+# Distinct contexts counted between two builds, the next ones are not counted
+MAX_SEEN_CONTEXTS = 10_000
+DEFAULT_CONCURRENCY = 4
+DEFAULT_SNAPSHOT_INTERVAL = 60.0
+SNAPSHOT_KIND = "popularity"
+
+POPULARITY_TABLE_AGE = Gauge(
+    "recommendation_popularity_table_age_seconds", "Age of the popularity table in use, -1 when there is none"
+)
+POPULARITY_TABLE_ENTRIES = Gauge("recommendation_popularity_table_entries", "Contexts in the popularity table")
+POPULARITY_LOOKUPS = Counter(
+    "recommendation_popularity_lookups_total", "Lookups in the popularity table, by result (hit, miss)", ["result"]
+)
+
+PopularityKey = tuple[str, str | None, str | None]
+# Lists of the filters a context is fused from, by filter name and minor filter name: their documents and the score
+# of each one in the list
+FilterLists = dict[tuple[str, str], tuple[list[dict[str, Any]], np.ndarray]]
+
+
+def popularity_key(query: SearchQuery) -> PopularityKey | None:
+    """Key of the query in the popularity table, None if the query is not a popularity one"""
+    categories = {category.strip() for category in query.documentCategory or [] if category.strip()}
+    if (
+        query.text.strip()
+        or query.metadatas
+        or query.seedAssets
+        or query.documentType is None
+        or len(categories) > 1
+    ):
+        return None
+    return (
+        query.documentType.value,
+        query.documentSource.value if query.documentSource is not None else None,
+        next(iter(categories), None),
+    )
+
+
+class PopularityTable:
+    """Ranked recommendations of every popularity context, immutable once built.
+    The rankings re-ranked for diversity are kept with the table, each context is re-ranked once per settings.
+    """
+
+    __slots__ = ("entries", "lists", "built_at", "diversified")
+
+    def __init__(
+        self,
+        entries: dict[PopularityKey, tuple[Ranking, list[str]]],
+        built_at: float,
+        lists: dict[PopularityKey, FilterLists] | None = None,
+    ) -> None:
+        self.entries = entries
+        # The lists of each context, to apply the events
+        self.lists = lists or {}
+        self.built_at = built_at
+        self.diversified: dict[tuple[PopularityKey, DiversitySettings], Ranking] = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def age(self) -> float:
+        """Seconds since the table was built"""
+        return time.monotonic() - self.built_at
+
+    def get(self, key: PopularityKey, settings: DiversitySettings | None = None) -> tuple[Ranking, list[str]] | None:
+        """Return the ranking of a context and the filters that built it, re-ranked with the diversity settings
+        when given
+        """
+        if (entry := self.entries.get(key)) is None or settings is None or settings.mode == NO_DIVERSITY:
+            return entry
+        if (ranking := self.diversified.get((key, settings))) is None:
+            ranking = self.diversified[key, settings] = diversify_ranking(entry[0], settings)
+        return ranking, entry[1]
+
+    def updated(self, batch: EventBatch, filters: Mapping[str, AbstractFilter]) -> "PopularityTable":
+        """Return a new table with the counters and documents of the batch applied, this one is left untouched.
+
+        The lists of a changed context are scored again by their filter (by name), with its ponderation, and fused
+        again: the changed context ranks as the filters would rank the same lists. The assets entering or leaving
+        the lists of the search service are only found by the next full refresh.
+        """
+        touched = batch.count_deltas.keys() | batch.documents.keys()
+        entries = dict(self.entries)
+        lists = dict(self.lists)
+        for key, filter_lists in self.lists.items():
+            if (updated_lists := _updated_lists(key, filter_lists, batch, touched, filters)) is not None:
+                entries[key] = (_fused(updated_lists), self.entries[key][1])
+                lists[key] = updated_lists
+        table = PopularityTable(entries, self.built_at, lists)
+        # The contexts left untouched keep their re-ranked rankings
+        table.diversified = {
+            (key, settings): ranking
+            for (key, settings), ranking in self.diversified.items()
+            if entries[key] is self.entries[key]
+        }
+        return table
+
+
+def _key_query(key: PopularityKey) -> SearchQuery:
+    asset_type, source, category = key
+    return SearchQuery(
+        text="",
+        documentType=AssetType(asset_type),
+        documentSource=SourceType(source) if source is not None else None,
+        documentCategory=[category] if category is not None else None,
+    )
+
+
+def _kept_list(asset_list: CandidateList) -> tuple[list[dict[str, Any]], np.ndarray]:
+    """The documents and scores of a list, read before the fusion changes the scores of the candidates"""
+    return [candidate.raw for candidate in asset_list.assets], extract_field(asset_list.assets, "r_score")
+
+
+def _fused(filter_lists: FilterLists) -> Ranking:
+    """Ranking of the fusion of the lists"""
+    filter_results = {}
+    for list_key, (documents, scores) in filter_lists.items():
+        candidates = [Candidate(document) for document in documents]
+        for candidate, score in zip(candidates, scores.tolist(), strict=True):
+            candidate.r_score = score
+        filter_results[list_key] = CandidateList(candidates)
+    return Ranking(get_score_fusion().fuse(filter_results))
+
+
+def _updated_document(document: dict[str, Any], batch: EventBatch) -> dict[str, Any]:
+    document = {**document, **batch.documents.get(document["id"], {})}
+    for field, delta in batch.count_deltas.get(document["id"], {}).items():
+        document[field] = document.get(field, 0) + delta
+    return document
+
+
+def _updated_lists(
+    key: PopularityKey,
+    filter_lists: FilterLists,
+    batch: EventBatch,
+    touched: set[str],
+    filters: Mapping[str, AbstractFilter],
+) -> FilterLists | None:
+    """The lists of a context with the batch applied, None when the batch does not change them.
+    The new assets matching the context are added to the lists their filter scores from the fields.
+    """
+    query = _key_query(key)
+    present = {document["id"] for documents, _ in filter_lists.values() for document in documents}
+    new_documents = [
+        _updated_document(document, batch)
+        for asset_id, document in batch.documents.items()
+        if asset_id not in present and document_matches(document, query)
+    ]
+    if not new_documents and present.isdisjoint(touched):
+        return None
+
+    updated = {}
+    for (filter_name, name), (documents, scores) in filter_lists.items():
+        kept_documents = []
+        kept_scores = []
+        for document, score in zip(documents, scores.tolist(), strict=True):
+            if document["id"] in touched:
+                document = _updated_document(document, batch)  # noqa: PLW2901
+                if not document_matches(document, query):
+                    continue
+            kept_documents.append(document)
+            kept_scores.append(score)
+        asset_list = CandidateList([Candidate(document) for document in [*kept_documents, *new_documents]])
+        if (curr_filter := filters.get(filter_name)) is not None and curr_filter.rescore(name, asset_list):
+            updated[filter_name, name] = _kept_list(asset_list)
+        else:
+            updated[filter_name, name] = (kept_documents, np.asarray(kept_scores, dtype=np.float64))
+    return updated
+
+
+async def build_popularity_table(
+    filters: Sequence[AbstractFilter],
+    contexts: Sequence[PopularityKey] = (),
+    categories: Sequence[str] = (),
+    max_contexts: int = DEFAULT_MAX_CONTEXTS,
+    concurrency: int = DEFAULT_CONCURRENCY,
+) -> PopularityTable:
+    """Rank the (type, any source, any category) context of every type, the popularity fallback, then the
+    configured categories of every type and the given contexts (the most requested first), up to max_contexts
+    contexts in all.
+
+    Contexts where a filter failed are left out, so the request path computes them live.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    entries: dict[PopularityKey, tuple[Ranking, list[str]]] = {}
+    lists: dict[PopularityKey, FilterLists] = {}
+
+    async def rank(key: PopularityKey) -> None:
+        async with semaphore:
+            filter_results, contributors = await filters_apply_lists(filters, _key_query(key))
+        if len(contributors) == len(filters):
+            lists[key] = {list_key: _kept_list(asset_list) for list_key, asset_list in filter_results.items()}
+            entries[key] = (Ranking(get_score_fusion().fuse(filter_results)), contributors)
+        else:
+            logger.warning("Popularity context %s is incomplete, it will be computed live", key)
+
+    keys = dict.fromkeys((asset_type.value, None, None) for asset_type in AssetType)
+    keys.update(
+        dict.fromkeys((asset_type.value, None, category) for category in categories for asset_type in AssetType)
+    )
+    keys.update(dict.fromkeys(contexts))
+    await asyncio.gather(*(rank(key) for key in list(keys)[: max(max_contexts, len(AssetType))]))
+    logger.info("Popularity table built: %s contexts of %s requested", len(entries), len(keys))
+    return PopularityTable(entries, time.monotonic(), lists)
+
+
+def write_popularity_snapshot(table: PopularityTable, path: str | Path) -> int:
+    """Write a popularity table in a snapshot, returns its version. The documents of the assets found in several
+    contexts are stored once.
+    """
+    keys, contributors = [], []
+    documents: list[str] = []
+    document_positions: dict[str, int] = {}
+    positions: list[int] = []
+    scores: list[float] = []
+    entry_offsets = [0]
+    for key, (ranking, entry_contributors) in table.entries.items():
+        keys.append(key)
+        contributors.append(entry_contributors)
+        for candidate in ranking.candidates:
+            if (position := document_positions.get(candidate.id)) is None:
+                position = document_positions[candidate.id] = len(documents)
+                documents.append(json.dumps(candidate.raw, separators=(",", ":")))
+            positions.append(position)
+            scores.append(candidate.r_score)
+        entry_offsets.append(len(positions))
+    arrays = {
+        "positions": np.asarray(positions, dtype=np.int64),
+        "scores": np.asarray(scores, dtype=np.float64),
+        "entry_offsets": np.asarray(entry_offsets, dtype=np.int64),
+        **pack_strings("documents", documents),
+    }
+    # The age of the table is carried over to the workers loading it
+    built_at = time.time() - table.age
+    metadata = {"kind": SNAPSHOT_KIND, "keys": keys, "contributors": contributors, "built_at": built_at}
+    return write_snapshot(path, arrays, metadata)
+
+
+class _MappedCandidates(Sequence[Candidate]):
+    """Candidates of a context of a snapshot, decoded on access: only the returned pages are decoded"""
+
+    __slots__ = ("documents", "positions", "scores")
+
+    def __init__(self, documents: PackedStrings, positions: np.ndarray, scores: np.ndarray) -> None:
+        self.documents = documents
+        # Position of the document of each candidate in documents, and its r_score
+        self.positions = positions
+        self.scores = scores
+
+    def __getitem__(self, position: int) -> Candidate:  # type: ignore[override]
+        candidate = Candidate(json_loads(self.documents.raw(int(self.positions[position]))))
+        candidate.r_score = float(self.scores[position])
+        return candidate
+
+    def __iter__(self) -> Iterator[Candidate]:
+        return (self[position] for position in range(len(self)))
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+
+def popularity_table_from_snapshot(snapshot: Snapshot) -> PopularityTable:
+    """The popularity table of a snapshot written by write_popularity_snapshot. The rankings are views of the
+    arrays of the snapshot, nothing is decoded before a page is returned.
+    """
+    if snapshot.metadata.get("kind") != SNAPSHOT_KIND:
+        message = f"{snapshot.path} is not a snapshot of a popularity table"
+        raise ValueError(message)
+    documents = snapshot.strings("documents")
+    positions = snapshot.array("positions")
+    scores = snapshot.array("scores")
+    entry_offsets = snapshot.array("entry_offsets").tolist()
+    entries = {}
+    for entry, (key, contributors) in enumerate(
+        zip(snapshot.metadata["keys"], snapshot.metadata["contributors"], strict=True)
+    ):
+        start, end = entry_offsets[entry], entry_offsets[entry + 1]
+        candidates = _MappedCandidates(documents, positions[start:end], scores[start:end])
+        entries[tuple(key)] = (Ranking(candidates, scores[start:end]), contributors)
+    age = max(time.time() - snapshot.metadata["built_at"], 0.0)
+    return PopularityTable(entries, time.monotonic() - age)
+
+
+_popularity_table: PopularityTable | None = None
+_refresh_task: asyncio.Task | None = None
+# Snapshot settings: the lock of the worker writing the table, the snapshot read by the others
+_writer_lock: WriterLock | None = None
+_snapshot_file: SnapshotFile | None = None
+_loaded_version: int | None = None
+# Writing of the snapshot by the writer: the task, the table of the latest version written and when
+_writing: asyncio.Task | None = None
+_written_table: PopularityTable | None = None
+_written_at = -math.inf
+# Lookups of each context since the previous build, or on a reader since the version of the snapshot it loaded
+_seen_contexts: dict[PopularityKey, int] = {}
+_seen_changed = False
+
+POPULARITY_TABLE_AGE.set_function(lambda: _popularity_table.age if _popularity_table is not None else -1)
+POPULARITY_TABLE_ENTRIES.set_function(lambda: len(_popularity_table) if _popularity_table is not None else 0)
+
+
+def popularity_lookup(
+    query: SearchQuery, settings: DiversitySettings | None = None
+) -> tuple[Ranking, list[str]] | None:
+    """Return the materialized ranking of the query, re-ranked with the diversity settings when given. None when
+    the query is not in a fresh table.
+    """
+    global _seen_changed  # noqa: PLW0603
+    if _popularity_table is None or (key := popularity_key(query)) is None:
+        return None
+    if key in _seen_contexts or len(_seen_contexts) < MAX_SEEN_CONTEXTS:
+        _seen_contexts[key] = _seen_contexts.get(key, 0) + 1
+        _seen_changed = True
+    max_age = current_config.get().get("popularity", {}).get("max_age", DEFAULT_MAX_AGE)
+    if _popularity_table.age > max_age or (entry := _popularity_table.get(key, settings)) is None:
+        POPULARITY_LOOKUPS.labels("miss").inc()
+        return None
+    POPULARITY_LOOKUPS.labels("hit").inc()
+    return entry
+
+
+def popularity_fallback(
+    query: SearchQuery, settings: DiversitySettings | None = None
+) -> tuple[Ranking, list[str]] | None:
+    """Return the ranking of all the assets of the type of the query, whatever the age of the table, re-ranked
+    with the diversity settings when given. The last resort when no filter gave anything for the query.
+    """
+    if _popularity_table is None or query.documentType is None:
+        return None
+    return _popularity_table.get((query.documentType.value, None, None), settings)
+
+
+async def popularity_refresh() -> None:
+    """Build a new popularity table and swap it in.
+    With a snapshot, only the writer builds the table, the other workers load the latest version of the snapshot.
+    """
+    global _popularity_table, _writer_lock, _seen_contexts  # noqa: PLW0603
+    config = current_config.get().get("popularity", {})
+    if (snapshot_path := config.get("snapshot")) is not None:
+        if _writer_lock is None:
+            _writer_lock = WriterLock(snapshot_path)
+        if not _writer_lock.acquire():
+            _load_snapshot(snapshot_path)
+            _share_seen_contexts(snapshot_path)
+            return
+    if not (filters := filters_ready()):
+        logger.error("No filters to build the popularity table")
+        return
+    # The contexts looked up during the build are counted for the next one
+    seen, _seen_contexts = _seen_contexts, {}
+    if snapshot_path is not None:
+        seen = _collect_seen_contexts(snapshot_path, seen, config.get("max_age", DEFAULT_MAX_AGE))
+    _popularity_table = await build_popularity_table(
+        filters,
+        contexts=sorted(seen, key=seen.__getitem__, reverse=True),
+        categories=config.get("categories", []),
+        max_contexts=config.get("max_contexts", DEFAULT_MAX_CONTEXTS),
+        concurrency=config.get("concurrency", DEFAULT_CONCURRENCY),
+    )
+    if snapshot_path is not None:
+        await _schedule_write(snapshot_path, config.get("snapshot_interval", DEFAULT_SNAPSHOT_INTERVAL))
+
+
+def _seen_contexts_path(snapshot_path: str | Path, pid: int) -> Path:
+    return Path(f"{snapshot_path}.seen.{pid}")
+
+
+def _share_seen_contexts(snapshot_path: str) -> None:
+    """Write the contexts looked up by this reader since the snapshot it loaded, for the writer to rank them"""
+    global _seen_changed  # noqa: PLW0603
+    if not _seen_changed:
+        return
+    path = _seen_contexts_path(snapshot_path, os.getpid())
+    temporary = path.with_name(f".{path.name}.tmp")
+    try:
+        temporary.write_text(json.dumps([[*key, count] for key, count in _seen_contexts.items()]))
+        temporary.replace(path)
+    except OSError as e:
+        logger.warning("Failed to share the popularity contexts in %s: %s", path, e)
+        return
+    _seen_changed = False
+
+
+def _collect_seen_contexts(
+    snapshot_path: str, seen: dict[PopularityKey, int], max_age: float
+) -> dict[PopularityKey, int]:
+    """Add the contexts looked up by the readers to the ones of the writer. The files older than max_age are left
+    by workers that exited, they are deleted.
+    """
+    seen = dict(seen)
+    own = _seen_contexts_path(snapshot_path, os.getpid())
+    for path in own.parent.glob(f"{Path(snapshot_path).name}.seen.*"):
+        try:
+            if time.time() - path.stat().st_mtime > max_age:
+                path.unlink()
+                continue
+            # The counts of this worker when it was a reader are in its own ones
+            records = [] if path == own else json.loads(path.read_bytes())
+        except (OSError, ValueError) as e:
+            logger.warning("Failed to read the popularity contexts of %s: %s", path, e)
+            continue
+        for asset_type, source, category, count in records:
+            key = (asset_type, source, category)
+            seen[key] = seen.get(key, 0) + count
+    return seen
+
+
+def _schedule_write(path: str, interval: float) -> asyncio.Task:
+    """Write the table in the snapshot in background, unless a writing is running: it writes the latest table"""
+    global _writing  # noqa: PLW0603
+    if _writing is None or _writing.done():
+        _writing = asyncio.create_task(_write_snapshot(path, interval))
+    return _writing
+
+
+async def _write_snapshot(path: str, interval: float) -> None:
+    """Write the snapshot until the latest table is written, at most every interval"""
+    global _written_table, _written_at  # noqa: PLW0603
+    while _popularity_table is not _written_table:
+        await asyncio.sleep(max(_written_at + interval - time.monotonic(), 0.0))
+        table = _popularity_table
+        try:
+            await asyncio.to_thread(write_popularity_snapshot, table, path)
+        except OSError as e:
+            logger.exception("Failed to write the popularity snapshot %s", path, exc_info=e)
+            return
+        _written_table, _written_at = table, time.monotonic()
+
+
+def _load_snapshot(path: str) -> None:
+    """Swap in the table of the snapshot if it is a new version, the contexts of the previous one are counted again"""
+    global _popularity_table, _snapshot_file, _loaded_version, _seen_changed  # noqa: PLW0603
+    if _snapshot_file is None:
+        _snapshot_file = SnapshotFile.from_config(path, "popularity")
+    if (snapshot := _snapshot_file.current()) is None or snapshot.version == _loaded_version:
+        return
+    try:
+        _popularity_table = popularity_table_from_snapshot(snapshot)
+    except (KeyError, ValueError) as e:
+        logger.exception("Failed to load the popularity table of %s", path, exc_info=e)
+        return
+    _loaded_version = snapshot.version
+    # The writer read the contexts looked up before this version
+    _seen_contexts.clear()
+    _seen_changed = False
+    _seen_contexts_path(path, os.getpid()).unlink(missing_ok=True)
+    logger.info("Popularity table loaded from %s: %s contexts", path, len(_popularity_table))
+
+
+async def popularity_apply_events(batch: EventBatch) -> None:
+    """Swap in a popularity table with the batch of events applied, the requests in flight keep the table they hold.
+    With a snapshot, only the writer applies the events and writes the updated table, the other workers load it.
+    """
+    global _popularity_table  # noqa: PLW0603
+    if _popularity_table is None or (_writer_lock is not None and not _writer_lock.held):
+        return
+    filters = {curr_filter.filter_name: curr_filter for curr_filter in filters_get()}
+    _popularity_table = _popularity_table.updated(batch, filters)
+    config = current_config.get().get("popularity", {})
+    if _writer_lock is not None and (snapshot_path := config.get("snapshot")) is not None:
+        _schedule_write(snapshot_path, config.get("snapshot_interval", DEFAULT_SNAPSHOT_INTERVAL))
+
+
+async def _refresh_loop(interval: float) -> None:
+    while True:
+        try:
+            await popularity_refresh()
+        except Exception as e:
+            logger.exception("Failed to refresh the popularity table", exc_info=e)
+        # The workers reading the snapshot look for a new version (or a writer to replace) more often
+        reading = _writer_lock is not None and not _writer_lock.held and _snapshot_file is not None
+        await asyncio.sleep(_snapshot_file.check_interval if reading else interval)
+
+
+async def popularity_start() -> None:
+    """Startup hook: start the background refresh of the popularity table if it is enabled"""
+    global _refresh_task  # noqa: PLW0603
+    config = current_config.get().get("popularity", {})
+    if not config.get("enabled", False):
+        return
+    _refresh_task = asyncio.create_task(_refresh_loop(config.get("refresh_interval", DEFAULT_REFRESH_INTERVAL)))
+
+
+async def popularity_stop() -> None:
+    """Shutdown hook: stop the background refresh, another worker becomes the writer of the snapshot"""
+    global _refresh_task, _writing  # noqa: PLW0603
+    for task in (_refresh_task, _writing):
+        if task is not None:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+    _refresh_task = _writing = None
+    if _writer_lock is not None:
+        _writer_lock.release()
@@ -0,0 +1,74 @@
+"""Selection of a page of the best candidates.
+
+Candidates are ordered by decreasing r_score, ties keep their merge order, so the order is deterministic and
+consecutive pages never overlap nor skip a candidate. Shallow pages use a partial selection, the full order is
+only sorted (once) when a page goes deep in the list.
+"""
+
+from collections.abc import Sequence
+from typing import Generic, TypeVar
+
+import numpy as np
+from msfwk.utils.logging import get_logger
+
+from recommendation.services.scoring import extract_field
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+# Above this share of the candidates, a page is served from the full sort rather than a partial selection
+FULL_SORT_THRESHOLD = 0.25
+
+
+class Ranking(Generic[T]):
+    """Candidates ordered by decreasing r_score, sorted lazily"""
+
+    __slots__ = ("candidates", "scores", "_order")
+
+    def __init__(self, candidates: Sequence[T], scores: np.ndarray | None = None) -> None:
+        self.candidates = candidates
+        self.scores = scores if scores is not None else extract_field(candidates, "r_score")
+        self._order: np.ndarray | None = None
+
+    @classmethod
+    def ordered(cls, candidates: Sequence[T]) -> "Ranking[T]":
+        """Ranking of candidates already in rank order, whatever their r_score"""
+        ranking = cls(candidates, np.arange(len(candidates), 0, -1, dtype=np.float64))
+        ranking._order = np.arange(len(candidates), dtype=np.intp)
+        return ranking
+
+    def __len__(self) -> int:
+        return len(self.candidates)
+
+    def page(self, offset: int, limit: int) -> list[T]:
+        """Return the candidates of ranks [offset, offset + limit)"""
+        return [self.candidates[position] for position in self.page_positions(offset, limit).tolist()]
+
+    def page_positions(self, offset: int, limit: int) -> np.ndarray:
+        """Return the positions in candidates of ranks [offset, offset + limit)"""
+        offset = max(offset, 0)
+        end = min(offset + max(limit, 0), len(self))
+        if offset >= end:
+            return np.empty(0, dtype=np.intp)
+        if self._order is None and end <= FULL_SORT_THRESHOLD * len(self):
+            return self._top(end)[offset:end]
+        return self.order[offset:end]
+
+    @property
+    def order(self) -> np.ndarray:
+        """Positions of all the candidates, best first"""
+        if self._order is None:
+            self._order = np.argsort(-self.scores, kind="stable")
+        return self._order
+
+    def _top(self, k: int) -> np.ndarray:
+        """Positions of the k best candidates, best first, in O(n + k log k)"""
+        negated = -self.scores
+        # Every candidate strictly better than the k-th is in the top, candidates tied with the k-th
+        # are taken in merge order to fill it
+        kth_value = negated[np.argpartition(negated, k - 1)[k - 1]]
+        better = np.flatnonzero(negated < kth_value)
+        tied = np.flatnonzero(negated == kth_value)[: k - len(better)]
+        top = np.concatenate((better, tied))
+        return top[np.lexsort((top, negated[top]))]
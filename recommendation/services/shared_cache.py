@@ -0,0 +1,364 @@
+"""Second cache tier, shared by the replicas: the candidate pools in Redis.
+
+On a miss of the in-process cache (services.cache), the candidate pool of the query is read from Redis before the
+filters are called, and a complete pool computed by the filters is written back, so the replicas share their
+work on the popular contexts. The pools are stored in a compact binary form (see encode_pool) under a key made
+of the format version, the version counter of the cache and a digest of the normalized query and the filters.
+The filters rebuilt from a new config have new keys (see AbstractFilter.fingerprint), and incrementing the
+``<prefix>:version`` key invalidates every entry: ``python -m recommendation.services.shared_cache <url>``.
+At most ``max_refills`` replicas refill a missing key at once, the others wait up to ``refill_wait`` for the entry
+to appear. A Redis error is a miss, requests never fail on it. Settings come from the ``shared_cache`` section of
+the config, ``url: memory://`` uses the InMemoryRedis stand-in (tests and local runs).
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import struct
+import time
+import zlib
+from collections.abc import Awaitable, Callable, Hashable, Mapping, Sequence
+from typing import Any
+
+import numpy as np
+from msfwk.context import current_config
+from msfwk.utils.logging import get_logger
+from prometheus_client import Counter, Histogram
+from redis import asyncio as redis_asyncio
+from redis.exceptions import RedisError
+
+from recommendation.models.interfaces import Candidate
+from recommendation.services.codec import json_loads
+from recommendation.services.pool import CandidatePool
+from recommendation.services.scoring import extract_field
+from recommendation.services.selection import Ranking
+
+logger = get_logger(__name__)
+
+MEMORY_URL = "memory://"
+DEFAULT_PREFIX = "recommendation:pools"
+DEFAULT_TTL = 60.0
+DEFAULT_MAX_REFILLS = 1
+DEFAULT_REFILL_WAIT = 1.0
+DEFAULT_VERSION_REFRESH = 5.0
+DEFAULT_TIMEOUT = 0.2
+# Delay between two reads of a key other replicas are refilling
+REFILL_POLL_INTERVAL = 0.05
+# Seconds after which the refill slot of a replica that never released it is free again
+REFILL_SLOT_TTL = 10.0
+
+# Layout of an encoded pool: magic, format version, depth, exhausted, candidates, length of the metadata, then
+# the zlib-compressed metadata JSON, r_scores (float64) and documents JSON
+MAGIC = b"RCPL"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sBIBII")
+COMPRESSION_LEVEL = 1
+
+SHARED_CACHE_REQUESTS = Counter(
+    "recommendation_shared_cache_requests_total",
+    "Lookups in the shared cache, by result (hit, miss, error)",
+    ["result"],
+)
+SHARED_CACHE_REFILLS = Counter(
+    "recommendation_shared_cache_refills_total",
+    "Misses of the shared cache, by outcome (refilled, waited, wait_timeout)",
+    ["result"],
+)
+SHARED_CACHE_ENTRY_BYTES = Histogram(
+    "recommendation_shared_cache_entry_bytes",
+    "Size of the encoded candidate pools written to the shared cache",
+    buckets=(1_000, 5_000, 20_000, 50_000, 100_000, 250_000, 500_000, 1_000_000),
+)
+
+
+def encode_pool(pool: CandidatePool) -> bytes:
+    """Encode a candidate pool, its candidates in rank order with their r_score"""
+    candidates = pool.ranking.page(0, len(pool))
+    metadata = json.dumps({"contributors": pool.contributors, "maxima": pool.maxima}).encode()
+    documents = json.dumps([candidate.raw for candidate in candidates], separators=(",", ":")).encode()
+    scores = extract_field(candidates, "r_score").tobytes()
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, pool.depth, pool.exhausted, len(candidates), len(metadata))
+    return header + zlib.compress(metadata + scores + documents, COMPRESSION_LEVEL)
+
+
+def decode_pool(data: bytes) -> CandidatePool:
+    """Decode a candidate pool encoded by encode_pool, raises ValueError on another format"""
+    if len(data) < HEADER.size:
+        message = "Truncated candidate pool"
+        raise ValueError(message)
+    magic, version, depth, exhausted, count, metadata_length = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        message = f"Unknown candidate pool format {magic!r} {version}"
+        raise ValueError(message)
+    try:
+        body = zlib.decompress(data[HEADER.size :])
+    except zlib.error as e:
+        message = f"Corrupted candidate pool: {e}"
+        raise ValueError(message) from e
+    scores_end = metadata_length + 8 * count
+    metadata = json_loads(body[:metadata_length])
+    scores = np.frombuffer(body[metadata_length:scores_end], dtype=np.float64).tolist()
+    candidates = []
+    for raw, r_score in zip(json_loads(body[scores_end:]), scores, strict=True):
+        candidate = Candidate(raw)
+        candidate.r_score = r_score
+        candidates.append(candidate)
+    # Any rank may have been served by another replica, all of them are frozen for the extensions
+    return CandidatePool(
+        Ranking.ordered(candidates),
+        metadata["contributors"],
+        depth,
+        bool(exhausted),
+        metadata["maxima"],
+        served=len(candidates),
+    )
+
+
+class InMemoryRedis:
+    """Stand-in for the Redis client: the subset of its API used by the shared cache, with expiry"""
+
+    def __init__(self) -> None:
+        self._values: dict[str, tuple[bytes, float | None]] = {}
+
+    def _get(self, key: str) -> bytes | None:
+        if (entry := self._values.get(key)) is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and time.monotonic() >= expires_at:
+            del self._values[key]
+            return None
+        return value
+
+    async def get(self, key: str) -> bytes | None:
+        """Value of a key, None when it is missing or expired"""
+        return self._get(key)
+
+    async def mget(self, keys: Sequence[str]) -> list[bytes | None]:
+        """Values of several keys"""
+        return [self._get(key) for key in keys]
+
+    async def set(self, key: str, value: bytes | str | int, px: int | None = None, nx: bool = False) -> bool | None:
+        """Set a key, expiring after px milliseconds. With nx, only if it is missing: None when it is not"""
+        if nx and self._get(key) is not None:
+            return None
+        encoded = value if isinstance(value, bytes) else str(value).encode()
+        self._values[key] = (encoded, time.monotonic() + px / 1000 if px is not None else None)
+        return True
+
+    async def delete(self, *keys: str) -> int:
+        """Delete keys, returns the number of keys deleted"""
+        return sum(self._values.pop(key, None) is not None for key in keys)
+
+    async def incr(self, key: str) -> int:
+        """Increment the integer value of a key"""
+        value = int(self._get(key) or 0) + 1
+        await self.set(key, value)
+        return value
+
+    async def aclose(self) -> None:
+        """Nothing to close"""
+
+
+class SharedCache:
+    """Candidate pools shared by the replicas, see the module docstring"""
+
+    def __init__(  # noqa: PLR0913
+        self,
+        client: Any,
+        prefix: str = DEFAULT_PREFIX,
+        ttl: float = DEFAULT_TTL,
+        max_refills: int = DEFAULT_MAX_REFILLS,
+        refill_wait: float = DEFAULT_REFILL_WAIT,
+        version_refresh: float = DEFAULT_VERSION_REFRESH,
+        timeout: float = DEFAULT_TIMEOUT,
+    ) -> None:
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.max_refills = max_refills
+        self.refill_wait = refill_wait
+        self.version_refresh = version_refresh
+        self.timeout = timeout
+        # Version counter of the cache, read again every version_refresh seconds
+        self._version = 0
+        self._version_read_at: float | None = None
+
+    @classmethod
+    def from_config(cls) -> "SharedCache":
+        """Build the shared cache from the ``shared_cache`` section of the config"""
+        config = current_config.get().get("shared_cache", {})
+        url = config.get("url", MEMORY_URL)
+        client = InMemoryRedis() if url == MEMORY_URL else redis_asyncio.from_url(url)
+        return cls(
+            client,
+            prefix=config.get("prefix", DEFAULT_PREFIX),
+            ttl=config.get("ttl", DEFAULT_TTL),
+            max_refills=config.get("max_refills", DEFAULT_MAX_REFILLS),
+            refill_wait=config.get("refill_wait", DEFAULT_REFILL_WAIT),
+            version_refresh=config.get("version_refresh", DEFAULT_VERSION_REFRESH),
+            timeout=config.get("timeout", DEFAULT_TIMEOUT),
+        )
+
+    async def get(self, key: Hashable) -> CandidatePool | None:
+        """Return the pool of a key, None on a miss"""
+        return (await self.get_many([key]))[0]
+
+    async def get_many(self, keys: Sequence[Hashable]) -> list[CandidatePool | None]:
+        """Return the pools of several keys in one round trip, None for the missing ones"""
+        try:
+            version = await self._current_version()
+            values = await self._call(self.client.mget([self._redis_key(version, key) for key in keys]))
+        except (RedisError, OSError, TimeoutError) as e:
+            logger.warning("Failed to read the shared cache: %s", e)
+            SHARED_CACHE_REQUESTS.labels("error").inc(len(keys))
+            return [None] * len(keys)
+        pools = []
+        for value in values:
+            pool = None
+            if value is not None:
+                try:
+                    pool = decode_pool(value)
+                except ValueError as e:
+                    logger.warning("Ignoring an invalid shared cache entry: %s", e)
+            SHARED_CACHE_REQUESTS.labels("miss" if pool is None else "hit").inc()
+            pools.append(pool)
+        return pools
+
+    async def set(self, key: Hashable, pool: CandidatePool) -> None:
+        """Store the pool of a key for ttl seconds"""
+        await self.set_many({key: pool})
+
+    async def set_many(self, pools: Mapping[Hashable, CandidatePool]) -> None:
+        """Store the pools of several keys for ttl seconds, the writes are sent concurrently"""
+        encoded = {key: encode_pool(pool) for key, pool in pools.items()}
+        for data in encoded.values():
+            SHARED_CACHE_ENTRY_BYTES.observe(len(data))
+        try:
+            version = await self._current_version()
+            await self._call(
+                asyncio.gather(
+                    *(
+                        self.client.set(self._redis_key(version, key), data, px=int(self.ttl * 1000))
+                        for key, data in encoded.items()
+                    )
+                )
+            )
+        except (RedisError, OSError, TimeoutError) as e:
+            logger.warning("Failed to write the shared cache: %s", e)
+
+    async def get_or_refill(
+        self,
+        key: Hashable,
+        compute: Callable[[], Awaitable[CandidatePool]],
+        cacheable: Callable[[CandidatePool], bool] = lambda _: True,
+    ) -> CandidatePool:
+        """Return the pool of a key, computing and storing it on a miss if fewer than max_refills replicas are
+        already doing it, waiting for their entry otherwise
+        """
+        if (pool := await self.get(key)) is not None:
+            return pool
+        if (slot := await self._acquire_refill(key)) is None:
+            deadline = time.monotonic() + self.refill_wait
+            while time.monotonic() < deadline:
+                await asyncio.sleep(REFILL_POLL_INTERVAL)
+                if (pool := await self.get(key)) is not None:
+                    SHARED_CACHE_REFILLS.labels("waited").inc()
+                    return pool
+            SHARED_CACHE_REFILLS.labels("wait_timeout").inc()
+        else:
+            SHARED_CACHE_REFILLS.labels("refilled").inc()
+        try:
+            pool = await compute()
+            if cacheable(pool):
+                await self.set(key, pool)
+            return pool
+        finally:
+            if slot is not None:
+                await self._release_refill(slot)
+
+    async def invalidate(self) -> int:
+        """Invalidate every entry of every replica, returns the new version"""
+        self._version = await self._call(self.client.incr(f"{self.prefix}:version"))
+        self._version_read_at = time.monotonic()
+        return self._version
+
+    async def close(self) -> None:
+        """Close the connections to Redis"""
+        await self.client.aclose()
+
+    async def _current_version(self) -> int:
+        now = time.monotonic()
+        if self._version_read_at is None or now - self._version_read_at > self.version_refresh:
+            self._version = int(await self._call(self.client.get(f"{self.prefix}:version")) or 0)
+            self._version_read_at = now
+        return self._version
+
+    def _redis_key(self, version: int, key: Hashable) -> str:
+        digest = hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+        return f"{self.prefix}:{FORMAT_VERSION}:{version}:{digest}"
+
+    async def _acquire_refill(self, key: Hashable) -> str | None:
+        """Take one of the max_refills refill slots of a key, None when they are all taken.
+        Without Redis, the key is refilled without a slot.
+        """
+        refill_key = f"{self._redis_key(self._version, key)}:refill"
+        try:
+            for position in range(self.max_refills):
+                slot = f"{refill_key}:{position}"
+                if await self._call(self.client.set(slot, 1, px=int(REFILL_SLOT_TTL * 1000), nx=True)):
+                    return slot
+        except (RedisError, OSError, TimeoutError) as e:
+            logger.warning("Failed to take a refill slot of the shared cache: %s", e)
+            return f"{refill_key}:0"
+        return None
+
+    async def _release_refill(self, slot: str) -> None:
+        try:
+            await self._call(self.client.delete(slot))
+        except (RedisError, OSError, TimeoutError) as e:
+            logger.warning("Failed to release a refill slot of the shared cache: %s", e)
+
+    async def _call(self, awaitable: Awaitable[Any]) -> Any:
+        return await asyncio.wait_for(awaitable, self.timeout)
+
+
+_shared_cache: SharedCache | None = None
+
+
+def get_shared_cache() -> SharedCache | None:
+    """Return the process-wide shared cache, None when it is not enabled"""
+    global _shared_cache  # noqa: PLW0603
+    if _shared_cache is None and current_config.get().get("shared_cache", {}).get("enabled", False):
+        _shared_cache = SharedCache.from_config()
+    return _shared_cache
+
+
+async def shared_cache_stop() -> None:
+    """Shutdown hook: close the connections to Redis"""
+    global _shared_cache  # noqa: PLW0603
+    if _shared_cache is not None:
+        await _shared_cache.close()
+        _shared_cache = None
+
+
+async def _invalidate(url: str, prefix: str) -> int:
+    shared_cache = SharedCache(redis_asyncio.from_url(url), prefix=prefix)
+    try:
+        return await shared_cache.invalidate()
+    finally:
+        await shared_cache.close()
+
+
+def main() -> None:
+    """Invalidate every entry of the shared cache, for all the replicas"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("url", help="URL of the Redis server, as the url of the shared_cache config")
+    parser.add_argument("--prefix", default=DEFAULT_PREFIX)
+    args = parser.parse_args()
+    version = asyncio.run(_invalidate(args.url, args.prefix))
+    logger.info("Shared cache invalidated: version %s", version)
+
+
+if __name__ == "__main__":
+    main()
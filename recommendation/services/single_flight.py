@@ -0,0 +1,60 @@
+"""Request coalescing: concurrent calls with the same key share a single execution."""
+
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any
+
+from msfwk.utils.logging import get_logger
+from prometheus_client import Counter
+
+logger = get_logger(__name__)
+
+SINGLE_FLIGHT_CALLS = Counter(
+    "recommendation_single_flight_calls_total",
+    "Calls going through the single-flight, by role (leader runs the call, follower reuses its result)",
+    ["role"],
+)
+
+
+class SingleFlight:
+    """Run at most one call per key at a time, concurrent callers of the same key await the running one"""
+
+    def __init__(self) -> None:
+        self.leaders = 0
+        self.followers = 0
+        self._in_flight: dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+    @property
+    def coalescing_rate(self) -> float:
+        """Share of the calls that reused the result of another one"""
+        total = self.leaders + self.followers
+        return self.followers / total if total else 0.0
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the result of call(), shared with every concurrent caller of the same key"""
+        if (task := self._in_flight.get(key)) is not None:
+            self.followers += 1
+            SINGLE_FLIGHT_CALLS.labels("follower").inc()
+        else:
+            self.leaders += 1
+            SINGLE_FLIGHT_CALLS.labels("leader").inc()
+            task = asyncio.create_task(call())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        # Shielded so a caller going away (e.g. client disconnect) does not cancel the call of the others
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+
+
+_recommendation_flight = SingleFlight()
+
+
+def get_recommendation_flight() -> SingleFlight:
+    """Return the single-flight shared by the recommendation requests"""
+    return _recommendation_flight
@@ -0,0 +1,311 @@
+"""Read-only snapshots of precomputed structures, shared by the worker processes of a host.
+
+A snapshot is one flat binary file: a header (magic, format version, length of the table of contents), the table
+of contents in JSON (the version and metadata of the snapshot, the dtype, shape and offset of each array), then
+the arrays, each aligned on 64 bytes. It is written once, to a temporary file renamed over the previous version,
+and every worker maps it read-only: the arrays are NumPy views of the mapping, so the workers share its pages
+through the page cache and opening a snapshot only reads the table of contents.
+
+A SnapshotFile checks the file every ``check_interval`` seconds (``snapshot`` section of the config) and maps the
+new version once the file was replaced. The mapping of the previous version is released with its last view.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import math
+import mmap
+import os
+import struct
+import tempfile
+import time
+from collections.abc import Iterable, Iterator, Mapping, Sequence
+from pathlib import Path
+from typing import IO, Any
+
+import numpy as np
+from msfwk.context import current_config
+from msfwk.utils.logging import get_logger
+from prometheus_client import Counter, Gauge
+
+logger = get_logger(__name__)
+
+DEFAULT_CHECK_INTERVAL = 5.0
+
+# Layout of a snapshot: magic, format version, length of the table of contents, then the table of contents JSON
+# and the arrays, at offsets (relative to the end of the table of contents, rounded up to ALIGNMENT) it lists
+MAGIC = b"RSNP"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sBI")
+ALIGNMENT = 64
+
+SNAPSHOT_LOADS = Counter(
+    "recommendation_snapshot_loads_total",
+    "Snapshot files mapped, by snapshot and result (loaded, failed)",
+    ["snapshot", "result"],
+)
+SNAPSHOT_VERSION = Gauge("recommendation_snapshot_version", "Version of the snapshot in use", ["snapshot"])
+SNAPSHOT_BYTES = Gauge("recommendation_snapshot_bytes", "Size of the snapshot file in use", ["snapshot"])
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_snapshot(
+    path: str | Path, arrays: Mapping[str, np.ndarray], metadata: dict[str, Any] | None = None, version: int = 0
+) -> int:
+    """Write the arrays in a new version of the snapshot file, atomically replacing the previous one
+
+    Args:
+        path (str | Path): the snapshot file
+        arrays (Mapping[str, np.ndarray]): arrays of the snapshot by name, of a fixed-size dtype
+        metadata (dict[str, Any] | None): JSON-serializable data read back with the snapshot
+        version (int): version of the snapshot, the time of the writing in nanoseconds when 0
+
+    Returns:
+        int: the version written
+    """
+    path = Path(path)
+    version = version or time.time_ns()
+    entries = {}
+    offset = 0
+    for name, array in arrays.items():
+        if array.dtype.hasobject:
+            message = f"Array {name} of a snapshot cannot hold Python objects"
+            raise ValueError(message)
+        entries[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset = _aligned(offset + array.nbytes)
+    toc = json.dumps({"version": version, "metadata": metadata or {}, "arrays": entries}).encode()
+    data_start = _aligned(HEADER.size + len(toc))
+
+    file = tempfile.NamedTemporaryFile(dir=path.parent, prefix=f".{path.name}.", delete=False)  # noqa: SIM115
+    try:
+        with file:
+            file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(toc)) + toc)
+            for name, array in arrays.items():
+                _pad_to(file, data_start + entries[name]["offset"])
+                file.write(np.ascontiguousarray(array).data)
+            file.flush()
+            os.fsync(file.fileno())
+        Path(file.name).replace(path)
+    except BaseException:
+        Path(file.name).unlink(missing_ok=True)
+        raise
+    logger.info("Snapshot %s written: version %s, %s arrays, %s bytes", path, version, len(arrays), path.stat().st_size)
+    return version
+
+
+def _pad_to(file: IO[bytes], position: int) -> None:
+    if (padding := position - file.tell()) > 0:
+        file.write(bytes(padding))
+
+
+class Snapshot:
+    """A version of a snapshot file mapped read-only, its arrays are views of the mapping"""
+
+    __slots__ = ("path", "version", "metadata", "size", "_mapping", "_arrays", "_entries", "_data_start")
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        with self.path.open("rb") as file:
+            self._mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self._mapping)
+        if self.size < HEADER.size:
+            message = f"Truncated snapshot {self.path}"
+            raise ValueError(message)
+        magic, format_version, toc_length = HEADER.unpack_from(self._mapping)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            message = f"Unknown snapshot format {magic!r} {format_version} in {self.path}"
+            raise ValueError(message)
+        toc = json.loads(self._mapping[HEADER.size : HEADER.size + toc_length])
+        self.version: int = toc["version"]
+        self.metadata: dict[str, Any] = toc["metadata"]
+        self._entries: dict[str, dict[str, Any]] = toc["arrays"]
+        self._data_start = _aligned(HEADER.size + toc_length)
+        self._arrays: dict[str, np.ndarray] = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    def array(self, name: str) -> np.ndarray:
+        """Read-only view of an array of the snapshot, raises KeyError when there is no such array"""
+        if (array := self._arrays.get(name)) is None:
+            entry = self._entries[name]
+            dtype = np.dtype(entry["dtype"])
+            count = math.prod(entry["shape"])
+            offset = self._data_start + entry["offset"]
+            if offset + count * dtype.itemsize > self.size:
+                message = f"Array {name} goes past the end of the snapshot {self.path}"
+                raise ValueError(message)
+            array = (
+                np.frombuffer(self._mapping, dtype=dtype, count=count, offset=offset)
+                if count
+                else np.empty(0, dtype=dtype)
+            )
+            array = self._arrays[name] = array.reshape(entry["shape"])
+        return array
+
+    def strings(self, name: str) -> "PackedStrings":
+        """Strings of the snapshot packed by pack_strings under this name"""
+        return PackedStrings(
+            self.array(f"{name}.data"),
+            self.array(f"{name}.offsets"),
+            self.array(f"{name}.hashes"),
+            self.array(f"{name}.order"),
+        )
+
+
+def _string_hashes(values: Iterable[bytes]) -> np.ndarray:
+    """Stable 64-bit hashes of the values (not hash(), which depends on the process)"""
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), "little") for value in values),
+        dtype=np.uint64,
+    )
+
+
+def pack_strings(name: str, values: Sequence[str | bytes]) -> dict[str, np.ndarray]:
+    """Arrays of a sequence of strings (or bytes) in a snapshot, read back with Snapshot.strings(name).
+    The values are concatenated, with the offsets of each one and a hash table to find the position of a value.
+    """
+    encoded = [value.encode() if isinstance(value, str) else value for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    hashes = _string_hashes(encoded)
+    order = np.argsort(hashes, kind="stable")
+    return {
+        f"{name}.data": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        f"{name}.offsets": offsets,
+        f"{name}.hashes": hashes[order],
+        f"{name}.order": order.astype(np.int64),
+    }
+
+
+class PackedStrings(Sequence[str]):
+    """Strings packed by pack_strings, decoded on access"""
+
+    __slots__ = ("data", "offsets", "hashes", "order")
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray, hashes: np.ndarray, order: np.ndarray) -> None:
+        self.data = data
+        self.offsets = offsets
+        # Hashes of the values, sorted, and the position of the value of each hash
+        self.hashes = hashes
+        self.order = order
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position: int) -> str:  # type: ignore[override]
+        return self.raw(position).decode()
+
+    def __iter__(self) -> Iterator[str]:
+        return (self[position] for position in range(len(self)))
+
+    def __contains__(self, value: object) -> bool:
+        return isinstance(value, str) and self.position(value) is not None
+
+    def raw(self, position: int) -> bytes:
+        """The value at a position, not decoded"""
+        if not -len(self) <= position < len(self):
+            raise IndexError(position)
+        position %= len(self)
+        return self.data[self.offsets[position] : self.offsets[position + 1]].tobytes()
+
+    def position(self, value: str) -> int | None:
+        """Position of the value, None when it is not in the sequence"""
+        encoded = value.encode()
+        value_hash = _string_hashes([encoded])[0]
+        start = int(np.searchsorted(self.hashes, value_hash, side="left"))
+        end = int(np.searchsorted(self.hashes, value_hash, side="right"))
+        for position in self.order[start:end].tolist():
+            if self.raw(position) == encoded:
+                return position
+        return None
+
+
+class SnapshotFile:
+    """Latest version of a snapshot file, mapped again when the file is replaced"""
+
+    def __init__(self, path: str | Path, name: str, check_interval: float = DEFAULT_CHECK_INTERVAL) -> None:
+        self.path = Path(path)
+        self.name = name
+        self.check_interval = check_interval
+        self._snapshot: Snapshot | None = None
+        self._identity: tuple[int, ...] | None = None
+        self._checked_at = -math.inf
+
+    @classmethod
+    def from_config(cls, path: str | Path, name: str) -> "SnapshotFile":
+        """Build from the ``snapshot`` section of the config"""
+        config = current_config.get().get("snapshot", {})
+        return cls(path, name, check_interval=config.get("check_interval", DEFAULT_CHECK_INTERVAL))
+
+    def current(self, refresh: bool = False) -> Snapshot | None:
+        """The mapped snapshot, None until the file exists. The file is checked at most every check_interval,
+        or now when refresh is set.
+        """
+        now = time.monotonic()
+        if refresh or now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            self._check()
+        return self._snapshot
+
+    def _check(self) -> None:
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return
+        # A new version is a new file renamed over the path
+        identity = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if identity == self._identity:
+            return
+        try:
+            snapshot = Snapshot(self.path)
+        except (OSError, ValueError, KeyError) as e:
+            SNAPSHOT_LOADS.labels(self.name, "failed").inc()
+            logger.exception("Failed to map the snapshot %s, keeping the previous version", self.path, exc_info=e)
+            return
+        self._snapshot = snapshot
+        self._identity = identity
+        SNAPSHOT_LOADS.labels(self.name, "loaded").inc()
+        SNAPSHOT_VERSION.labels(self.name).set(snapshot.version)
+        SNAPSHOT_BYTES.labels(self.name).set(snapshot.size)
+        logger.info("Snapshot %s mapped: version %s", self.path, snapshot.version)
+
+
+class WriterLock:
+    """Lock electing the worker that writes a snapshot, among the processes of the host.
+    A flock on ``<snapshot>.lock``, released by the system when the process holding it exits.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(f"{path}.lock")
+        self._file: IO[bytes] | None = None
+
+    @property
+    def held(self) -> bool:
+        """Whether this process holds the lock"""
+        return self._file is not None
+
+    def acquire(self, blocking: bool = False) -> bool:
+        """Take the lock, True when this process holds it. Without blocking, False when another process does."""
+        if self._file is not None:
+            return True
+        file = self.path.open("ab")
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            return False
+        self._file = file
+        return True
+
+    def release(self) -> None:
+        """Release the lock if this process holds it"""
+        if self._file is not None:
+            with contextlib.suppress(OSError):
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
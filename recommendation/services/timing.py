@@ -0,0 +1,87 @@
+"""Sampled timing of the stages of a recommendation.
+
+A request is sampled with the probability ``timing.sample_rate`` of the config when it starts (sample_request),
+and all the spans of a sampled request observe their duration in the ``recommendation_stage_seconds``
+histogram, by stage and filter. The spans of a request that is not sampled, or of background work, cost a
+context variable read. The histograms are exposed with the other metrics of the service on /metrics.
+"""
+
+import random
+import time
+from contextvars import ContextVar
+from types import TracebackType
+
+from msfwk.context import current_config
+from prometheus_client import Histogram
+
+DEFAULT_SAMPLE_RATE = 0.05
+
+STAGE_SECONDS = Histogram(
+    "recommendation_stage_seconds",
+    "Duration of the stages of the sampled recommendations, by stage and filter",
+    ["stage", "filter"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+# Whether the spans of the current request are timed, propagated to the tasks it starts
+_sampled: ContextVar[bool] = ContextVar("recommendation_timing_sampled", default=False)
+
+
+def sample_request() -> bool:
+    """Decide whether the current request is timed, returns the decision"""
+    sample_rate = current_config.get().get("timing", {}).get("sample_rate", DEFAULT_SAMPLE_RATE)
+    sampled = random.random() < sample_rate  # noqa: S311
+    _sampled.set(sampled)
+    return sampled
+
+
+# Labelled children of STAGE_SECONDS, labels() is too slow to be called on every span
+_stage_histograms: dict[tuple[str, str], Histogram] = {}
+
+
+class _Span:
+    """Observe the duration of the block in the stage histogram"""
+
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, stage: str, filter_name: str) -> None:
+        if (histogram := _stage_histograms.get((stage, filter_name))) is None:
+            histogram = _stage_histograms[stage, filter_name] = STAGE_SECONDS.labels(stage, filter_name)
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class _NoSpan:
+    """Span of a request that is not sampled"""
+
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(stage: str, filter_name: str = "") -> _Span | _NoSpan:
+    """Time a block of a sampled request: ``with span("merge"): ...``"""
+    return _Span(stage, filter_name) if _sampled.get() else _NO_SPAN
@@ -0,0 +1,167 @@
+"""Trending scores: exponentially decayed interaction counters.
+
+A counter loses half of its value every ``half_life`` seconds. Every counter is stored scaled to a common
+reference time, value(t) = stored * 2 ** ((reference - t) / half_life), so an interaction is a single addition
+and the counters decay together without being touched: their order only changes with the interactions, and
+the ranking is sorted again at read time only after new interactions. The reference moves forward, with a
+rescale of the counters, once the scale of the current time gets large, on an interaction or a read.
+
+The ranking is split by asset type once per order, so a request only walks the assets of its type, and at most
+``max_scan`` of them: a rare source or category returns the matches found in the scan.
+"""
+
+import time
+from typing import Any
+
+import numpy as np
+from msfwk.context import current_config
+from prometheus_client import Counter
+
+from recommendation.filters.utils import document_matches
+from recommendation.models.interfaces import EventBatch, SearchQuery
+
+DEFAULT_HALF_LIFE = 86_400.0
+DEFAULT_MAX_SCAN = 10_000
+# Half-lives since the reference time past which it is moved forward, a scale of 2 ** 64
+MAX_EXPONENT = 64.0
+# Counters decayed below this value are dropped when the reference time is moved forward
+MIN_COUNTER = 0.01
+
+TRUNCATED_SCANS = Counter(
+    "recommendation_trending_truncated_scans_total", "Trending reads stopped at max_scan before filling the limit"
+)
+
+
+class DecayedCounters:
+    """Counters losing half of their value every half_life seconds, see the module docstring"""
+
+    def __init__(self, half_life: float = DEFAULT_HALF_LIFE, now: float | None = None) -> None:
+        self.half_life = half_life
+        self._reference = time.monotonic() if now is None else now
+        self._scaled: dict[str, float] = {}
+        # Keys by decreasing counter, None when an interaction changed the order
+        self._ranked: list[str] | None = None
+
+    def __len__(self) -> int:
+        return len(self._scaled)
+
+    def add(self, key: str, amount: float, now: float | None = None) -> None:
+        """Add an amount to the counter of a key"""
+        now = time.monotonic() if now is None else now
+        # The scale first: it may move the reference and rescale the counters
+        scale = self._scale(now)
+        self._scaled[key] = self._scaled.get(key, 0.0) + amount * scale
+        self._ranked = None
+
+    def value(self, key: str, now: float | None = None) -> float:
+        """The decayed counter of a key, 0 for an unknown one"""
+        now = time.monotonic() if now is None else now
+        scale = self._scale(now)
+        return self._scaled.get(key, 0.0) / scale
+
+    def ranked(self) -> list[str]:
+        """The keys by decreasing counter"""
+        if self._ranked is None:
+            keys = list(self._scaled)
+            scaled = np.fromiter(self._scaled.values(), dtype=np.float64, count=len(keys))
+            self._ranked = [keys[position] for position in np.argsort(-scaled, kind="stable").tolist()]
+        return self._ranked
+
+    def _scale(self, now: float) -> float:
+        """Scale of the current time, the reference is moved to now first when the scale gets large"""
+        if (exponent := (now - self._reference) / self.half_life) > MAX_EXPONENT:
+            self._rebase(now, exponent)
+            return 1.0
+        return 2.0**exponent
+
+    def _rebase(self, now: float, exponent: float) -> None:
+        """Move the reference time to now, the counters keep their value. The counters are multiplied by the
+        inverse of the scale, which underflows to 0 where the scale itself would overflow.
+        """
+        decay = 2.0**-exponent
+        self._scaled = {key: value * decay for key, value in self._scaled.items() if value * decay >= MIN_COUNTER}
+        self._reference = now
+        self._ranked = None
+
+
+class TrendingIndex:
+    """Decayed interaction counters of the assets and their latest documents"""
+
+    def __init__(self, half_life: float = DEFAULT_HALF_LIFE, max_scan: int = DEFAULT_MAX_SCAN) -> None:
+        self.counters = DecayedCounters(half_life)
+        self.max_scan = max_scan
+        self.documents: dict[str, dict[str, Any]] = {}
+        # Ranking the split by type was made from, and the counted assets of each type in its order
+        self._ranked: list[str] | None = None
+        self._ranked_by_type: dict[str, list[str]] = {}
+
+    @classmethod
+    def from_config(cls) -> "TrendingIndex":
+        """Build the index from the ``trending`` section of the config"""
+        config = current_config.get().get("trending", {})
+        return cls(config.get("half_life", DEFAULT_HALF_LIFE), config.get("max_scan", DEFAULT_MAX_SCAN))
+
+    def add_documents(self, documents: dict[str, dict[str, Any]], replace: bool = True) -> None:
+        """Keep the documents of the assets, the known ones are kept unless replace is set"""
+        if replace:
+            self.documents.update(documents)
+        else:
+            for asset_id, document in documents.items():
+                self.documents.setdefault(asset_id, document)
+        # The type of an asset may have changed
+        self._ranked = None
+
+    def apply_events(self, batch: EventBatch, event_weights: dict[str, float] | None = None) -> None:
+        """Count the interactions and keep the documents of a batch of events"""
+        now = time.monotonic()
+        event_weights = event_weights or {}
+        if batch.documents:
+            self.add_documents(batch.documents)
+        events = {field: event for event, field in EventBatch.COUNTED_FIELDS.items()}
+        for asset_id, deltas in batch.count_deltas.items():
+            amount = sum(event_weights.get(events[field], 1.0) * delta for field, delta in deltas.items())
+            self.counters.add(asset_id, amount, now)
+
+    def top(self, query: SearchQuery, limit: int) -> tuple[list[dict[str, Any]], list[float]]:
+        """The documents of the most trending assets matching the query, and their decayed counters"""
+        now = time.monotonic()
+        documents, values = [], []
+        ranked = self.ranked(query.documentType.value if query.documentType is not None else None)
+        for scanned, asset_id in enumerate(ranked):
+            if scanned >= self.max_scan:
+                TRUNCATED_SCANS.inc()
+                break
+            if (document := self.documents.get(asset_id)) is None or not document_matches(document, query):
+                continue
+            documents.append(document)
+            values.append(self.counters.value(asset_id, now))
+            if len(documents) >= limit:
+                break
+        return documents, values
+
+    def ranked(self, asset_type: str | None = None) -> list[str]:
+        """The counted assets of a type by decreasing counter, all of them for None"""
+        ranked = self.counters.ranked()
+        if ranked is not self._ranked:
+            self._ranked = ranked
+            self._ranked_by_type = {}
+        if asset_type is None:
+            return ranked
+        if (ranked_of_type := self._ranked_by_type.get(asset_type)) is None:
+            ranked_of_type = self._ranked_by_type[asset_type] = [
+                asset_id
+                for asset_id in ranked
+                if (document := self.documents.get(asset_id)) is not None and document.get("documentType") == asset_type
+            ]
+        return ranked_of_type
+
+
+_trending_index: TrendingIndex | None = None
+
+
+def get_trending_index() -> TrendingIndex:
+    """Return the process-wide trending index, it outlives the filters rebuilt on a config reload"""
+    global _trending_index  # noqa: PLW0603
+    if _trending_index is None:
+        _trending_index = TrendingIndex.from_config()
+    return _trending_index
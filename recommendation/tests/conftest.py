@@ -0,0 +1,36 @@
+from collections.abc import Iterator
+from typing import Any
+
+import pytest
+from msfwk.context import current_config
+
+from recommendation.filters.filter_holder import filters_clean
+from recommendation.services.cache import get_recommendation_cache
+from recommendation.services.circuit_breaker import circuit_breakers_reset
+from recommendation.services.concurrency import concurrency_limiters_reset
+from recommendation.services.fallback import get_fallback_store
+from recommendation.services.fusion import score_fusion_reset
+from recommendation.services.hedging import upstream_policies_reset
+
+SEARCH_HOST = "http://search.test"
+
+
+@pytest.fixture
+def config() -> Iterator[dict[str, Any]]:
+    """The config of the test, to fill before building the services; the process-wide services are reset"""
+    config: dict[str, Any] = {"services": {"search": {"host": SEARCH_HOST}}}
+    token = current_config.set(config)
+    _reset()
+    yield config
+    _reset()
+    current_config.reset(token)
+
+
+def _reset() -> None:
+    filters_clean()
+    get_fallback_store().clear()
+    get_recommendation_cache().clear()
+    circuit_breakers_reset()
+    concurrency_limiters_reset()
+    score_fusion_reset()
+    upstream_policies_reset()
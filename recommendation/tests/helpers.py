@@ -0,0 +1,13 @@
+"""Builders shared by the tests"""
+
+from recommendation.models.interfaces import Candidate, CandidateList
+
+
+def candidate_list(*scored: tuple[str, float]) -> CandidateList:
+    """Candidates of the ids, with their r_score"""
+    candidates = []
+    for asset_id, r_score in scored:
+        candidate = Candidate({"id": asset_id, "name": asset_id, "documentType": "dataset"})
+        candidate.r_score = r_score
+        candidates.append(candidate)
+    return CandidateList(candidates)
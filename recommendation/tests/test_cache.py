@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+from recommendation.services.cache import RecommendationCache
+
+pytestmark = pytest.mark.unit
+
+
+async def test_clear_cancels_the_refreshes() -> None:
+    cache = RecommendationCache(ttl=0.0, stale_ttl=60.0)
+    cache.set("k", "old filters")
+    started = asyncio.Event()
+
+    async def compute() -> str:
+        started.set()
+        await asyncio.sleep(0.01)
+        return "refreshed"
+
+    # The stale entry is served and refreshed in background
+    assert await cache.get_or_compute("k", compute) == "old filters"
+    await started.wait()
+    cache.clear()
+    await asyncio.sleep(0.02)
+
+    assert cache.get("k") is None
+
+
+async def test_a_value_computed_before_a_clear_is_not_stored() -> None:
+    cache = RecommendationCache()
+
+    async def compute() -> str:
+        cache.clear()
+        return "old filters"
+
+    assert await cache.get_or_compute("k", compute) == "old filters"
+    assert cache.get("k") is None
+    cache.set("k", "new filters", generation=cache.generation)
+    assert cache.get("k") == ("new filters", False)
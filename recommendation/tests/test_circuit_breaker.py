@@ -0,0 +1,138 @@
+import pytest
+
+from recommendation.services import circuit_breaker
+from recommendation.services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, get_circuit_breaker
+
+pytestmark = pytest.mark.unit
+
+
+class FakeClock:
+    """time.monotonic of the breaker, moved by the test"""
+
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> FakeClock:
+    fake = FakeClock()
+    monkeypatch.setattr(circuit_breaker, "time", fake)
+    return fake
+
+
+def breaker() -> CircuitBreaker:
+    return CircuitBreaker("test", window=4, min_calls=4, failure_rate=0.5, slow_call_seconds=1.0, open_seconds=30.0)
+
+
+def opened(clock: FakeClock) -> CircuitBreaker:
+    breaker_ = breaker()
+    for _ in range(4):
+        breaker_.record(succeeded=False, seconds=0.1)
+    assert breaker_.state == OPEN
+    assert clock.now == breaker_._opened_at  # noqa: SLF001
+    return breaker_
+
+
+def test_failure_rate_over_the_window_opens_the_breaker(clock: FakeClock) -> None:  # noqa: ARG001
+    breaker_ = breaker()
+    breaker_.record(succeeded=False, seconds=0.1)
+    breaker_.record(succeeded=False, seconds=0.1)
+    breaker_.record(succeeded=True, seconds=0.1)
+    # Under min_calls calls, the failures do not open the breaker
+    assert breaker_.state == CLOSED
+    breaker_.record(succeeded=True, seconds=0.1)
+    assert breaker_.state == OPEN
+    assert not breaker_.allow()
+
+
+def test_only_the_last_calls_of_the_window_count(clock: FakeClock) -> None:  # noqa: ARG001
+    breaker_ = breaker()
+    breaker_.record(succeeded=False, seconds=0.1)
+    for _ in range(4):
+        breaker_.record(succeeded=True, seconds=0.1)
+    breaker_.record(succeeded=False, seconds=0.1)
+
+    assert breaker_.state == CLOSED
+    assert breaker_._failures == 1  # noqa: SLF001
+
+
+def test_slow_calls_trip_the_breaker(clock: FakeClock) -> None:  # noqa: ARG001
+    breaker_ = breaker()
+    breaker_.record(succeeded=True, seconds=0.1)
+    breaker_.record(succeeded=True, seconds=0.1)
+    breaker_.record(succeeded=True, seconds=1.5)
+    assert breaker_.state == CLOSED
+    breaker_.record(succeeded=True, seconds=2.0)
+
+    assert breaker_.state == OPEN
+
+
+def test_successful_trial_closes_the_breaker(clock: FakeClock) -> None:
+    breaker_ = opened(clock)
+    clock.now += 29.0
+    assert not breaker_.allow()
+
+    clock.now += 1.0
+    assert breaker_.allow()
+    assert breaker_.state == HALF_OPEN
+    # A single trial call at once
+    assert not breaker_.allow()
+    breaker_.record(succeeded=True, seconds=0.1)
+
+    assert breaker_.state == CLOSED
+    assert breaker_.allow()
+    # The failures before the opening are forgotten
+    for _ in range(3):
+        breaker_.record(succeeded=False, seconds=0.1)
+    assert breaker_.state == CLOSED
+
+
+def test_failed_or_slow_trial_opens_the_breaker_again(clock: FakeClock) -> None:
+    breaker_ = opened(clock)
+    clock.now += 30.0
+    assert breaker_.allow()
+    breaker_.record(succeeded=True, seconds=1.5)
+
+    assert breaker_.state == OPEN
+    assert not breaker_.allow()
+    clock.now += 30.0
+    assert breaker_.allow()
+    breaker_.record(succeeded=False, seconds=0.1)
+    assert breaker_.state == OPEN
+
+
+def test_trial_slot_is_given_back_or_replaced(clock: FakeClock) -> None:
+    breaker_ = opened(clock)
+    clock.now += 30.0
+    assert breaker_.allow()
+
+    # The trial was let through but not made
+    breaker_.release()
+    assert breaker_.allow()
+    # The trial never reports: another one is let through after the cool-off period
+    clock.now += 29.0
+    assert not breaker_.allow()
+    clock.now += 1.0
+    assert breaker_.allow()
+    assert breaker_.state == HALF_OPEN
+
+
+def test_calls_started_before_the_opening_are_ignored(clock: FakeClock) -> None:
+    breaker_ = opened(clock)
+    breaker_.record(succeeded=True, seconds=0.1)
+
+    assert breaker_.state == OPEN
+    clock.now += 30.0
+    assert breaker_.allow()
+
+
+def test_disabled_breaker_lets_every_call_through(config: dict, clock: FakeClock) -> None:  # noqa: ARG001
+    config["circuit_breaker"] = {"enabled": False, "min_calls": 1}
+    breaker_ = get_circuit_breaker("test")
+    breaker_.record(succeeded=False, seconds=0.1)
+
+    assert breaker_.state == CLOSED
+    assert breaker_.allow()
@@ -0,0 +1,91 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+
+from recommendation.filters.collaborative_filters import CollaborativeFilter
+from recommendation.models.interfaces import AssetEvent, AssetType, EventBatch, SearchQuery
+
+pytestmark = pytest.mark.unit
+
+
+@pytest.fixture
+def collaborative(config: dict, tmp_path: Path) -> CollaborativeFilter:  # noqa: ARG001
+    interactions = tmp_path / "interactions.jsonl"
+    records = [
+        *({"document": {"id": asset_id, "documentType": "dataset", "name": asset_id}} for asset_id in ("a1", "a2")),
+        {"user_id": "u1", "asset_id": "a1", "event": "liked"},
+        {"user_id": "u1", "asset_id": "a2", "event": "liked"},
+    ]
+    interactions.write_text("\n".join(json.dumps(record) for record in records))
+    return CollaborativeFilter(interactions_path=str(interactions))
+
+
+async def test_apply_answers_once_the_index_is_built(collaborative: CollaborativeFilter) -> None:
+    query = SearchQuery(text="", documentType=AssetType.dataset, seedAssets=["a1"])
+
+    assert await collaborative.apply(query) is None
+    # Received while the index is built, applied to it once built
+    await collaborative.apply_events(EventBatch([AssetEvent(event="liked", asset_id="a3", user_id="u1")]))
+    index = await collaborative.loaded()
+
+    assert "a3" in index.asset_index
+    result = await collaborative.apply(query)
+    assert [candidate.id for candidate in result[collaborative.result_name].assets] == ["a2"]
+
+
+async def test_failed_build_is_not_retried_at_every_request(collaborative: CollaborativeFilter) -> None:
+    collaborative.interactions_path = "/nonexistent/interactions.jsonl"
+    query = SearchQuery(text="", documentType=AssetType.dataset, seedAssets=["a1"])
+
+    assert await collaborative.loaded() is None
+    loading = collaborative._loading  # noqa: SLF001
+    assert await collaborative.apply(query) is None
+    await asyncio.sleep(0)
+
+    assert collaborative._loading is loading  # noqa: SLF001
+
+
+async def test_snapshot_is_written_in_background(collaborative: CollaborativeFilter, tmp_path: Path) -> None:
+    collaborative.snapshot_path = str(tmp_path / "collaborative.snapshot")
+    query = SearchQuery(text="", documentType=AssetType.dataset, seedAssets=["a1"])
+
+    assert await collaborative.apply(query) is None
+    await collaborative.loaded()
+
+    assert Path(collaborative.snapshot_path).exists()
+    result = await collaborative.apply(query)
+    assert [candidate.id for candidate in result[collaborative.result_name].assets] == ["a2"]
+
+
+async def test_reader_maps_the_events_applied_by_the_writer(
+    config: dict, collaborative: CollaborativeFilter, tmp_path: Path
+) -> None:
+    config["snapshot"] = {"check_interval": 0.0}
+    writer, reader = (
+        CollaborativeFilter(
+            interactions_path=collaborative.interactions_path,
+            snapshot_path=str(tmp_path / "collaborative.snapshot"),
+            snapshot_interval=0.0,
+        )
+        for _ in range(2)
+    )
+    query = SearchQuery(text="", documentType=AssetType.dataset, seedAssets=["a1"])
+    await writer.loaded()
+
+    # The other worker does not take the lock, it maps the snapshot of the writer
+    assert await reader.loaded() is not None
+    assert reader._writer_lock is not None and not reader._writer_lock.held  # noqa: SLF001
+    batch = EventBatch(
+        [
+            AssetEvent(event="asset_created", asset_id="a3", document={"id": "a3", "documentType": "dataset"}),
+            AssetEvent(event="liked", asset_id="a3", user_id="u1"),
+        ]
+    )
+    for curr_filter in (writer, reader):
+        await curr_filter.apply_events(batch)
+    await writer._writing  # noqa: SLF001
+
+    result = await reader.apply(query)
+    assert {candidate.id for candidate in result[reader.result_name].assets} == {"a2", "a3"}
@@ -0,0 +1,138 @@
+import asyncio
+import json
+
+import pytest
+from despsharedlibrary.schemas.collaborative_schema import AssetType
+
+from recommendation.filters.filter_holder import filters_add
+from recommendation.models.constants import RECOMMENDATION_OVERLOADED
+from recommendation.routes.recommend import recommend_assets
+from recommendation.services import concurrency
+from recommendation.services.concurrency import ROUTE, ROUTE_LIMITER, ConcurrencyLimiter, get_concurrency_limiter
+from recommendation.tests.test_filter_holder import StubFilter
+
+pytestmark = pytest.mark.unit
+
+
+class FakeClock:
+    """time.monotonic of the limiter, moved by the test"""
+
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> FakeClock:
+    fake = FakeClock()
+    monkeypatch.setattr(concurrency, "time", fake)
+    return fake
+
+
+def limiter(**settings: float) -> ConcurrencyLimiter:
+    defaults = {"initial_limit": 2, "min_limit": 1, "max_limit": 4, "latency_threshold": 1.0, "max_wait": 0.05}
+    return ConcurrencyLimiter("test", **{**defaults, **settings})
+
+
+async def test_fast_calls_near_the_limit_raise_it(clock: FakeClock) -> None:
+    limits = limiter()
+    first, second = await limits.acquire(), await limits.acquire()
+    clock.now += 0.1
+
+    first.release()
+    assert limits.limit == 2.5
+    # Half of the limit is no longer in flight, the call does not show that the limit can grow
+    second.release()
+    assert limits.limit == 2.5
+    assert limits.in_flight == 0
+
+
+async def test_failed_or_slow_calls_lower_the_limit_once_per_round_trip(clock: FakeClock) -> None:
+    limits = limiter(initial_limit=4)
+    first, second = await limits.acquire(), await limits.acquire()
+    clock.now += 0.1
+
+    first.release(succeeded=False)
+    assert limits.limit == pytest.approx(3.6)
+    # Started before the decrease, the second failure does not decrease the limit again
+    second.release(succeeded=False)
+    assert limits.limit == pytest.approx(3.6)
+
+    slow = await limits.acquire()
+    clock.now += 2.0
+    slow.release()
+    assert limits.limit == pytest.approx(3.24)
+    # Only the first release of a permit counts
+    slow.release(succeeded=False)
+    assert limits.limit == pytest.approx(3.24)
+    assert limits.in_flight == 0
+
+
+async def test_limit_stays_within_its_bounds(clock: FakeClock) -> None:
+    limits = limiter(initial_limit=1, backoff=0.5)
+    permit = await limits.acquire()
+    clock.now += 0.1
+    permit.release(succeeded=False)
+    assert limits.limit == 1
+
+    limits = limiter(initial_limit=4)
+    permits = [await limits.acquire() for _ in range(4)]
+    clock.now += 0.1
+    for permit in permits:
+        permit.release()
+    assert limits.limit == 4
+
+
+async def test_calls_past_the_queue_bound_are_shed(clock: FakeClock) -> None:  # noqa: ARG001
+    limits = limiter(initial_limit=1, max_queue=1, max_wait=1.0)
+    admitted = await limits.acquire()
+    queued = asyncio.create_task(limits.acquire())
+    await asyncio.sleep(0)
+
+    assert await limits.acquire() is None
+    assert not queued.done()
+    # The slot of the ended call is handed over to the queued one
+    admitted.release()
+    permit = await queued
+    assert permit is not None
+    assert limits.in_flight == 1
+    permit.release()
+    assert limits.in_flight == 0
+
+
+async def test_calls_waiting_too_long_are_shed() -> None:
+    limits = limiter(initial_limit=1, max_wait=0.01)
+    admitted = await limits.acquire()
+
+    assert await limits.acquire() is None
+    assert not limits._waiters  # noqa: SLF001
+    admitted.release()
+    assert limits.in_flight == 0
+
+
+async def test_disabled_limiter_admits_every_call() -> None:
+    limits = limiter(initial_limit=1, max_queue=0)
+    limits.enabled = False
+
+    permits = [await limits.acquire() for _ in range(3)]
+
+    assert all(permit is not None for permit in permits)
+    assert limits.in_flight == 0
+
+
+async def test_shed_request_without_a_stored_answer_is_rejected(config: dict) -> None:
+    config["concurrency"] = {"enabled": True, ROUTE: {"initial_limit": 1, "min_limit": 1, "max_queue": 0}}
+    filters_add([StubFilter(filter_name="stub", answers={"": {"likes_count": [("a", 1.0)]}})])
+    admitted = await get_concurrency_limiter(ROUTE_LIMITER, ROUTE).acquire()
+
+    response = await recommend_assets(type=AssetType("dataset"))
+
+    assert response.status_code == 503
+    assert json.loads(response.body)["code"] == RECOMMENDATION_OVERLOADED
+    admitted.release()
+    response = await recommend_assets(type=AssetType("dataset"))
+    assert response.status_code == 200
+    data = json.loads(response.body)["data"]
+    assert (data["count"], data["contributing_filters"]) == (1, ["stub"])
@@ -0,0 +1,123 @@
+import random
+from collections import Counter
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pytest
+from despsharedlibrary.schemas.collaborative_schema import AssetType
+
+from recommendation.filters.content_filters import ContentFilter
+from recommendation.models.interfaces import SearchQuery
+from recommendation.services.content_index import ContentIndex, build_content_index, embed, tokenize
+
+pytestmark = pytest.mark.unit
+
+WORDS = (
+    "ocean temperature glacier forecast rainfall satellite drought wind carbon soil crop flood aerosol ice salinity "
+    "storm urban heat forest river"
+).split()
+CATEGORIES = ["climate", "ocean", "land", "atmosphere"]
+DIMENSIONS = 64
+
+
+@pytest.fixture(scope="module")
+def documents() -> list[dict[str, Any]]:
+    rng = random.Random(3)
+    return [
+        {
+            "id": f"asset-{position}",
+            "name": " ".join(rng.sample(WORDS, 3)),
+            "documentType": "dataset" if position % 4 else "model",
+            "categoryId": rng.choice(CATEGORIES),
+            "metadata": {"keywords": " ".join(rng.sample(WORDS, 2))},
+        }
+        for position in range(200)
+    ]
+
+
+@pytest.fixture(scope="module")
+def index_path(documents: list[dict[str, Any]], tmp_path_factory: pytest.TempPathFactory) -> Path:
+    path = tmp_path_factory.mktemp("content_index")
+    build_content_index(documents, path, DIMENSIONS)
+    return path
+
+
+def brute_force(index: ContentIndex, vector: np.ndarray, k: int) -> list[int]:
+    similarities = np.asarray(index.vectors) @ vector
+    return np.argsort(-similarities, kind="stable")[:k].tolist()
+
+
+def test_loaded_index_holds_the_built_documents(documents: list[dict[str, Any]], index_path: Path) -> None:
+    index = ContentIndex(index_path)
+
+    assert len(index) == len(documents)
+    assert sorted(index.asset_ids) == sorted(document["id"] for document in documents)
+    vectors = embed([Counter(tokenize(document)) for document in documents], DIMENSIONS)
+    for position, document in enumerate(documents):
+        stored = index.asset_index[document["id"]]
+        assert index.document(stored) == document
+        assert np.allclose(index.vectors[stored], vectors[position])
+    # The lists cover every asset once, in order
+    assert index.list_offsets[0] == 0
+    assert index.list_offsets[-1] == len(documents)
+    assert np.all(np.diff(index.list_offsets) >= 0)
+
+
+def test_build_without_documents_fails(tmp_path: Path) -> None:
+    with pytest.raises(ValueError, match="without documents"):
+        build_content_index([], tmp_path)
+
+
+def test_search_of_every_list_is_exact(index_path: Path) -> None:
+    index = ContentIndex(index_path)
+    vector = index.query_vector(["asset-0", "asset-1"])
+
+    positions, similarities = index.search(vector, 10, nprobe=len(index.centroids))
+
+    assert positions.tolist() == brute_force(index, vector, 10)
+    assert np.all(np.diff(similarities) <= 0)
+
+
+def test_search_recall_against_brute_force(index_path: Path) -> None:
+    index = ContentIndex(index_path)
+    found = 0
+    for asset_id in index.asset_ids[:50]:
+        vector = index.query_vector([asset_id])
+        positions, _ = index.search(vector, 10)
+        found += len(set(positions.tolist()) & set(brute_force(index, vector, 10)))
+
+    assert found / (50 * 10) >= 0.8
+
+
+def test_query_vector_of_unknown_assets_is_none(index_path: Path) -> None:
+    assert ContentIndex(index_path).query_vector(["unknown"]) is None
+
+
+async def test_content_filter_excludes_the_seeds(config: dict, index_path: Path) -> None:  # noqa: ARG001
+    # Every list is probed, the search is exact
+    content_filter = ContentFilter(index_path=str(index_path), limit=5, nprobe=1000)
+    index = content_filter.get_index()
+    seeds = ["asset-1", "asset-2"]
+    query = SearchQuery(text="", documentType=AssetType("dataset"), seedAssets=seeds)
+
+    result = await content_filter.apply(query)
+
+    candidates = result[content_filter.result_name].assets
+    assert len(candidates) == 5
+    assert not {candidate.id for candidate in candidates} & set(seeds)
+    assert all(candidate.raw["documentType"] == "dataset" for candidate in candidates)
+    # The closest assets of the type, the seeds aside
+    vector = index.query_vector(seeds)
+    closest = [
+        index.asset_ids[position]
+        for position in brute_force(index, vector, len(index))
+        if index.asset_ids[position] not in seeds and index.document(position)["documentType"] == "dataset"
+    ]
+    assert [candidate.id for candidate in candidates] == closest[:5]
+
+
+async def test_content_filter_needs_seeds(config: dict, index_path: Path) -> None:  # noqa: ARG001
+    content_filter = ContentFilter(index_path=str(index_path))
+
+    assert await content_filter.apply(SearchQuery(text="ocean", documentType=AssetType("dataset"))) == {}
@@ -0,0 +1,132 @@
+import random
+
+import pytest
+
+from recommendation.models.interfaces import Candidate
+from recommendation.services.diversity import NO_DIVERSITY, DiversitySettings, diversify, diversify_ranking
+from recommendation.services.selection import Ranking
+
+pytestmark = pytest.mark.unit
+
+MMR = DiversitySettings(mode="mmr", mmr_lambda=0.7, source_similarity=0.5)
+
+
+def candidates(*assets: tuple[str, str, str, float]) -> list[Candidate]:
+    """Candidates of (id, categoryId, source, r_score)"""
+    built = []
+    for asset_id, category, source, r_score in assets:
+        candidate = Candidate({"id": asset_id, "categoryId": category, "source": source})
+        candidate.r_score = r_score
+        built.append(candidate)
+    return built
+
+
+def ids(ranked: list[Candidate]) -> list[str]:
+    return [candidate.id for candidate in ranked]
+
+
+def pairwise_mmr(ranked: list[Candidate], settings: DiversitySettings) -> list[str]:
+    """Reference MMR: the similarity of every candidate to every ranked one, at every rank"""
+
+    def similarity(first: Candidate, second: Candidate) -> float:
+        if first.raw["categoryId"] == second.raw["categoryId"]:
+            return 1.0
+        return settings.source_similarity if first.raw["source"] == second.raw["source"] else 0.0
+
+    max_score = max(candidate.r_score for candidate in ranked)
+    remaining = list(ranked)
+    selected: list[Candidate] = []
+    while remaining:
+        best = max(
+            remaining,
+            key=lambda candidate: (
+                settings.mmr_lambda / max_score * candidate.r_score
+                - (1 - settings.mmr_lambda) * max((similarity(candidate, other) for other in selected), default=0.0),
+                -ranked.index(candidate),
+            ),
+        )
+        remaining.remove(best)
+        selected.append(best)
+    return ids(selected)
+
+
+def test_mmr_ranks_an_asset_of_another_category_and_source_first() -> None:
+    ranked = candidates(("a", "c1", "x", 1.0), ("b", "c1", "x", 0.6), ("c", "c2", "x", 0.5), ("d", "c3", "y", 0.4))
+
+    reranked, _ = diversify(ranked, MMR)
+
+    # b shares the category of a, c only its source
+    assert ids(reranked) == ["a", "d", "c", "b"]
+
+
+def test_mmr_matches_the_pairwise_mmr() -> None:
+    rng = random.Random(7)
+    scores = sorted(rng.sample(range(1, 1000), 60), reverse=True)
+    ranked = candidates(
+        *((f"a{rank}", rng.choice("pqrst"), rng.choice("xyz"), score / 100) for rank, score in enumerate(scores))
+    )
+
+    reranked, _ = diversify(ranked, MMR)
+
+    assert ids(reranked) == pairwise_mmr(ranked, MMR)
+
+
+@pytest.mark.parametrize("settings", [MMR, DiversitySettings(mode="quota", max_per_category=1, window=3)])
+def test_ranking_in_parts_matches_the_whole_ranking(settings: DiversitySettings) -> None:
+    rng = random.Random(11)
+    ranked = candidates(
+        *((f"a{rank}", rng.choice("pqr"), rng.choice("xy"), 10.0 - rank / 10) for rank in range(30))
+    )
+
+    whole, _ = diversify(ranked, settings)
+    first, state = diversify(ranked[:12], settings)
+    rest, _ = diversify(ranked[12:], settings, state)
+
+    assert ids(first) == ids(whole)[:12]
+    if settings.mode == "quota":
+        # The state carries the counts of the current window over to the rest
+        assert ids(first + rest) == ids(whole)
+
+
+def test_quota_fills_a_short_window_in_rank_order() -> None:
+    ranked = candidates(
+        ("a", "c1", "x", 5.0),
+        ("b", "c1", "x", 4.0),
+        ("c", "c1", "x", 3.0),
+        ("d", "c2", "x", 2.0),
+        ("e", "c2", "x", 1.0),
+    )
+    settings = DiversitySettings(mode="quota", max_per_category=1, max_per_source=0, window=4)
+
+    reranked, state = diversify(ranked, settings)
+
+    # Once a and d filled the quotas of the window, b and c fill it; e opens the next window
+    assert ids(reranked) == ["a", "d", "b", "c", "e"]
+    assert (state.window_filled, state.category_counts) == (1, {"c2": 1})
+
+
+def test_quota_limits_the_assets_of_a_source() -> None:
+    ranked = candidates(("a", "c1", "x", 4.0), ("b", "c2", "x", 3.0), ("c", "c3", "y", 2.0), ("d", "c4", "x", 1.0))
+    settings = DiversitySettings(mode="quota", max_per_category=0, max_per_source=1, window=2)
+
+    reranked, _ = diversify(ranked, settings)
+
+    assert ids(reranked) == ["a", "c", "b", "d"]
+
+
+def test_no_diversity_keeps_the_rank_order() -> None:
+    ranked = candidates(("a", "c1", "x", 3.0), ("b", "c1", "x", 2.0), ("c", "c1", "x", 1.0))
+    ranking = Ranking.ordered(ranked)
+    settings = DiversitySettings(mode=NO_DIVERSITY)
+
+    reranked, _ = diversify(ranked, settings)
+
+    assert reranked == ranked
+    assert diversify_ranking(ranking, settings) is ranking
+
+
+def test_unknown_configured_mode_is_no_diversity(config: dict) -> None:
+    config["diversity"] = {"mode": "shuffle"}
+
+    assert DiversitySettings.from_config().mode == NO_DIVERSITY
+    assert DiversitySettings.from_config("mmr").mode == "mmr"
@@ -0,0 +1,107 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+
+from recommendation.filters.collaborative_filters import CollaborativeFilter
+from recommendation.filters.filter_holder import filters_get
+from recommendation.services import events, trending
+from recommendation.models.interfaces import AssetEvent, EventBatch
+from recommendation.services.events import (
+    DEFAULT_EXCHANGE,
+    EventConsumer,
+    InMemoryBroker,
+    events_start,
+    events_stop,
+)
+from recommendation.services.trending import get_trending_index
+
+pytestmark = pytest.mark.unit
+
+
+def write_interactions(path: Path) -> None:
+    documents = [{"id": asset_id, "documentType": "dataset", "name": asset_id} for asset_id in ("a1", "a2", "a3")]
+    records = [
+        *({"document": document} for document in documents),
+        {"user_id": "u1", "asset_id": "a1", "event": "liked"},
+        {"user_id": "u1", "asset_id": "a2", "event": "liked"},
+        {"user_id": "u2", "asset_id": "a2", "event": "downloaded"},
+    ]
+    path.write_text("\n".join(json.dumps(record) for record in records))
+
+
+@pytest.fixture
+def events_config(config: dict, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> dict:
+    interactions = tmp_path / "interactions.jsonl"
+    write_interactions(interactions)
+    config["events"] = {"enabled": True, "batch_size": 10, "max_delay": 0.01}
+    config["trending"] = {"enabled": True}
+    config["collaborative"] = {"enabled": True, "interactions": str(interactions)}
+    monkeypatch.setattr(trending, "_trending_index", None)
+    monkeypatch.setattr(events, "_event_consumer", None)
+    return config
+
+
+async def test_published_events_update_the_counters_and_the_index(events_config: dict) -> None:
+    collaborative = next(f for f in filters_get() if isinstance(f, CollaborativeFilter))
+    index = await collaborative.loaded()
+    assert "a3" not in index.asset_index
+    broker = InMemoryBroker()
+    await events_start(broker)
+    try:
+        for message in (
+            {"event": "liked", "asset_id": "a3", "user_id": "u2"},
+            {"event": "downloaded", "asset_id": "a3", "user_id": "u3"},
+            {"event": "liked", "asset_id": "a1", "user_id": "u2"},
+            {"event": "unknown", "asset_id": "a1"},
+        ):
+            await broker.publish(DEFAULT_EXCHANGE, json.dumps(message).encode())
+    finally:
+        await events_stop()
+
+    counters = get_trending_index().counters
+    assert counters.value("a3") == pytest.approx(2.0, rel=1e-3)
+    assert counters.value("a1") == pytest.approx(1.0, rel=1e-3)
+    assert counters.ranked()[0] == "a3"
+
+    index = collaborative.get_index()
+    user_assets = {index.asset_ids[position] for position in index.user_items["u2"].tolist()}
+    assert user_assets == {"a1", "a2", "a3"}
+    assert "a3" in {index.asset_ids[position] for position in index.user_items["u3"].tolist()}
+
+
+async def test_events_are_not_consumed_without_url(config: dict) -> None:
+    config["events"] = {"enabled": True}
+
+    await events_start()
+
+    assert events._broker is None  # noqa: SLF001
+
+
+async def test_stop_lets_the_current_batch_finish_then_applies_the_queued_events() -> None:
+    applying = asyncio.Event()
+    resume = asyncio.Event()
+    applied: list[list[str]] = []
+
+    async def handler(batch: EventBatch) -> None:
+        applying.set()
+        await resume.wait()
+        applied.append(sorted(batch.count_deltas))
+
+    consumer = EventConsumer([handler], batch_size=2, max_delay=0.0)
+    consumer.start()
+    for asset_id in ("a1", "a2", "a3"):
+        consumer.submit(AssetEvent(event="liked", asset_id=asset_id, user_id="u1"))
+    await applying.wait()
+
+    stopping = asyncio.create_task(consumer.stop())
+    await asyncio.sleep(0.01)
+    # The batch being applied is not cancelled
+    assert not stopping.done()
+    resume.set()
+    await stopping
+
+    # Without max_delay the background task applied a1 alone, the flush applies the rest
+    assert applied == [["a1"], ["a2", "a3"]]
+    assert consumer.applied == 3
@@ -0,0 +1,101 @@
+from collections.abc import Sequence
+from typing import Any
+
+import pytest
+from despsharedlibrary.schemas.collaborative_schema import AssetType
+
+from recommendation.filters.abstract_filter import AbstractFilter
+from recommendation.filters.filter_holder import filters_add, filters_apply, filters_apply_batch, filters_ready
+from recommendation.models.interfaces import CandidateList, SearchQuery
+from recommendation.services.circuit_breaker import get_circuit_breaker
+from recommendation.services.concurrency import get_concurrency_limiter
+from recommendation.tests.helpers import candidate_list
+
+pytestmark = pytest.mark.unit
+
+
+class StubFilter(AbstractFilter):
+    """Filter answering canned lists, by query text"""
+
+    url: str = "http://stub.test"
+    ponderation: float = 1.0
+    answers: dict[str, dict[str, list[tuple[str, float]]]] = {}
+    loaded: bool = True
+
+    @classmethod
+    def from_config(cls) -> None:
+        return None
+
+    def ready(self) -> bool:
+        return self.loaded
+
+    async def apply(self, query: SearchQuery) -> dict[str, CandidateList] | None:
+        if (answer := self.answers.get(query.text)) is None:
+            return None
+        return {name: candidate_list(*scored) for name, scored in answer.items()}
+
+
+def query(text: str) -> SearchQuery:
+    return SearchQuery(text=text, documentType=AssetType("dataset"))
+
+
+def scores(candidates: Sequence[Any]) -> dict[str, float]:
+    return {candidate.id: pytest.approx(candidate.r_score) for candidate in candidates}
+
+
+async def test_filters_apply_merges_the_lists_of_the_same_name(config: dict) -> None:
+    filters = [
+        StubFilter(filter_name="first", answers={"q": {"likes_count": [("a", 1.0), ("b", 0.5)]}}),
+        StubFilter(filter_name="second", answers={"q": {"likes_count": [("b", 0.25), ("c", 0.1)]}}),
+    ]
+
+    candidates, contributors = await filters_apply(filters, query("q"))
+
+    assert scores(candidates) == {"a": 1.0, "b": 0.75, "c": 0.1}
+    assert contributors == ["first", "second"]
+
+
+async def test_filters_apply_batch(config: dict) -> None:
+    filters = [
+        StubFilter(
+            filter_name="first",
+            answers={
+                "q1": {"likes_count": [("a", 1.0), ("b", 0.5)], "downloads_count": [("b", 1.0)]},
+                "q2": {"likes_count": [("c", 0.2)]},
+            },
+        ),
+        StubFilter(filter_name="second", answers={"q1": {"likes_count": [("a", 0.5)]}}),
+    ]
+
+    results = await filters_apply_batch(filters, [query("q1"), query("q2")])
+
+    assert len(results) == 2
+    (first, first_contributors), (second, second_contributors) = results
+    assert scores(first) == {"a": 1.5, "b": 1.5}
+    assert first_contributors == ["first", "second"]
+    assert scores(second) == {"c": 0.2}
+    assert second_contributors == ["first"]
+
+
+def test_filters_ready_leaves_out_the_loading_filters(config: dict) -> None:  # noqa: ARG001
+    filters_add([StubFilter(filter_name="loaded"), StubFilter(filter_name="loading", loaded=False)])
+
+    assert [curr_filter.filter_name for curr_filter in filters_ready()] == ["loaded"]
+
+
+async def test_shed_trial_call_does_not_hold_the_breaker_half_open(
+    config: dict,  # noqa: ARG001
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    stub = StubFilter(filter_name="stub", answers={"q": {"likes_count": [("a", 1.0)]}})
+    breaker = get_circuit_breaker("stub")
+    breaker._open()  # noqa: SLF001
+    breaker._opened_at -= breaker.open_seconds  # noqa: SLF001
+
+    async def shed() -> None:
+        return None
+
+    monkeypatch.setattr(get_concurrency_limiter("stub"), "acquire", shed)
+    assert await filters_apply([stub], query("q")) == ([], [])
+
+    assert breaker.allow()
@@ -0,0 +1,31 @@
+import pytest
+from despsharedlibrary.schemas.collaborative_schema import AssetType
+
+from recommendation.models.interfaces import SearchQuery
+from recommendation.services.cache import get_recommendation_cache, query_cache_key
+from recommendation.filters.search_filters import SearchFilter
+from recommendation.services.filter_methods import _shared_key, recommend_shed
+from recommendation.services.pool import CandidatePool
+from recommendation.services.selection import Ranking
+from recommendation.tests.helpers import candidate_list
+
+pytestmark = pytest.mark.unit
+
+QUERY = SearchQuery(text="shed", documentType=AssetType("dataset"))
+
+
+def test_shed_request_is_not_answered_from_a_shallower_cached_pool(config: dict) -> None:  # noqa: ARG001
+    pool = CandidatePool(Ranking(candidate_list(("a", 1.0), ("b", 0.5)).assets), ["stub"], 2, False)
+    get_recommendation_cache().set(query_cache_key(QUERY), pool, len(pool))
+
+    assert recommend_shed(QUERY, offset=0, limit=10) is None
+    assert recommend_shed(QUERY, offset=0, limit=2)[1] == 2
+
+
+def test_shared_key_changes_with_the_settings_of_the_filters(config: dict) -> None:
+    key = query_cache_key(QUERY)
+    shared_key = _shared_key([SearchFilter.from_config()], key)
+
+    assert _shared_key([SearchFilter.from_config()], key) == shared_key
+    config["services"]["search"]["host"] = "http://other.test"
+    assert _shared_key([SearchFilter.from_config()], key) != shared_key
@@ -0,0 +1,67 @@
+import asyncio
+import gc
+
+import aiohttp
+import pytest
+
+from benchmarks.fake_search import FakeSearch, start_fake_search
+from recommendation.services.hedging import LatencyTracker, RetryBudget, UpstreamPolicy
+
+pytestmark = pytest.mark.unit
+
+LATENCY = 0.01
+
+
+async def test_cancelled_hedges_do_not_pull_the_hedge_delay_down() -> None:
+    # A tenth of the responses are slow, the median of the latencies is hedged: the first request often answers
+    # while its hedge is in flight
+    runner, url = await start_fake_search(FakeSearch(assets=10, latency=LATENCY, slow_rate=0.1, slow_latency=0.1))
+    policy = UpstreamPolicy(
+        "fake", enabled=True, min_delay=0.0, budget=RetryBudget(1.0), latencies=LatencyTracker(50.0, min_samples=5)
+    )
+
+    async def send(base_url: str) -> dict:
+        async with session.post(f"{base_url}/multi-search", json={"queries": ["likes_count"]}) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    try:
+        async with aiohttp.ClientSession() as session:
+            for _ in range(60):
+                await policy.call([url], send)
+    finally:
+        await runner.cleanup()
+
+    # The fastest response takes half of the latency, a cancelled hedge would be observed younger
+    observed = policy.latencies._latencies[: policy.latencies._count]  # noqa: SLF001
+    assert observed.min() >= LATENCY / 2
+    assert policy.hedge_delay >= LATENCY / 2
+
+
+async def test_errors_of_the_requests_done_with_the_answer_are_retrieved() -> None:
+    loop = asyncio.get_running_loop()
+    unhandled: list[dict] = []
+    loop.set_exception_handler(lambda _, context: unhandled.append(context))
+    latencies = LatencyTracker(50.0, min_samples=1)
+    latencies.observe(LATENCY)
+    policy = UpstreamPolicy("fake", enabled=True, min_delay=0.0, budget=RetryBudget(1.0), latencies=latencies)
+
+    async def send(url: str) -> str:
+        # The first request and its hedge end together, the first one fails
+        if url == "first":
+            await release.wait()
+            raise aiohttp.ClientConnectionError
+        release.set()
+        return url
+
+    try:
+        # The done tasks come in no particular order
+        for _ in range(20):
+            release = asyncio.Event()
+            assert await policy.call(["first", "hedge"], send) == "hedge"
+        gc.collect()
+        await asyncio.sleep(0)
+    finally:
+        loop.set_exception_handler(None)
+
+    assert unhandled == []
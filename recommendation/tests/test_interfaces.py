@@ -0,0 +1,51 @@
+import pytest
+from despsharedlibrary.schemas.collaborative_schema import AssetType
+
+from recommendation.filters.search_filters import SearchFilter
+from recommendation.models.interfaces import Candidate, SearchQuery
+
+pytestmark = pytest.mark.unit
+
+DOCUMENT = {
+    "id": "a",
+    "documentType": "dataset",
+    "name": "a",
+    "metadata": {},
+    "date": "2024-01-01T00:00:00",
+    "categoryId": "vision",
+    "likes_count": 3,
+}
+
+
+def test_document_dict_follows_the_r_score() -> None:
+    candidate = Candidate(DOCUMENT)
+    candidate.r_score = 0.5
+    first = candidate.to_document_dict()
+
+    # The candidate of a cached pool is scored again when the pool is extended
+    candidate.r_score = 0.25
+
+    assert (first["r_score"], candidate.to_document_dict()["r_score"]) == (0.5, 0.25)
+
+
+def test_search_payload_requests_the_window_of_the_query(config: dict) -> None:  # noqa: ARG001
+    search_filter = SearchFilter.from_config()
+    first = SearchQuery(text="sea", documentType=AssetType("dataset"), seedAssets=["a"])
+    next_window = first.model_copy(update={"poolOffset": 20, "poolLimit": 40, "poolMaxima": {"likes_count": 3.0}})
+
+    payload = search_filter.build_payload(first)
+
+    assert (payload["limit"], "offset" in payload) == (search_filter.limit, False)
+    dumped_query, sorts = payload["queries"]["likes_count"]
+    # The recommendation context is not sent to the search service
+    assert dumped_query == {
+        "documentType": "dataset",
+        "documentSource": None,
+        "documentCategory": None,
+        "metadatas": None,
+        "text": "sea",
+    }
+    assert sorts == [{"field": "likes_count", "order": "desc"}]
+    payload = search_filter.build_payload(next_window)
+    assert (payload["limit"], payload["offset"]) == (40, 20)
+    assert payload["queries"]["downloads_count"][0] == dumped_query
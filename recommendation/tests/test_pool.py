@@ -0,0 +1,51 @@
+import pytest
+from despsharedlibrary.schemas.collaborative_schema import AssetType
+
+from recommendation.models.interfaces import Candidate, SearchQuery
+from recommendation.services import pool as pool_module
+from recommendation.services.diversity import DiversitySettings
+from recommendation.services.pool import CandidatePool, extend_pool
+from recommendation.services.selection import Ranking
+from recommendation.tests.helpers import candidate_list
+
+pytestmark = pytest.mark.unit
+
+QUERY = SearchQuery(text="", documentType=AssetType("dataset"))
+
+
+@pytest.fixture
+def window(monkeypatch: pytest.MonkeyPatch) -> None:
+    async def filters_apply(filters: object, query: SearchQuery) -> tuple[list[Candidate], list[str]]:  # noqa: ARG001
+        assert query.poolOffset == 3
+        return candidate_list(("c", 2.5), ("d", 1.5)).assets, ["stub"]
+
+    monkeypatch.setattr(pool_module, "filters_apply", filters_apply)
+
+
+def first_pool() -> CandidatePool:
+    return CandidatePool(Ranking(candidate_list(("a", 3.0), ("b", 2.0), ("c", 1.0)).assets), ["stub"], 3, False)
+
+
+def ranked(pool: CandidatePool) -> list[tuple[str, float]]:
+    return [(candidate.id, candidate.r_score) for candidate in pool.ranking.page(0, len(pool))]
+
+
+async def test_extension_ranks_again_the_unserved_candidates(config: dict, window: None) -> None:  # noqa: ARG001
+    pool = first_pool()
+    pool.serve(1, DiversitySettings())
+
+    extended = await extend_pool([], QUERY, pool, 6)
+
+    assert ranked(extended) == [("a", 3.0), ("c", 3.5), ("b", 2.0), ("d", 1.5)]
+    assert extended.served == 1
+    # The candidates of the extended pool are left untouched
+    assert ranked(pool) == [("a", 3.0), ("b", 2.0), ("c", 1.0)]
+
+
+async def test_extension_keeps_the_served_ranks(config: dict, window: None) -> None:  # noqa: ARG001
+    pool = first_pool()
+    pool.serve(3, DiversitySettings())
+
+    extended = await extend_pool([], QUERY, pool, 6)
+
+    assert ranked(extended) == [("a", 3.0), ("b", 2.0), ("c", 1.0), ("d", 1.5)]
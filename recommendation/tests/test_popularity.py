@@ -0,0 +1,205 @@
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+from despsharedlibrary.schemas.collaborative_schema import AssetType
+
+from recommendation.filters.abstract_filter import AbstractFilter
+from recommendation.filters.collaborative_filters import CollaborativeFilter
+from recommendation.filters.search_filters import SearchFilter
+from recommendation.models.interfaces import AssetEvent, CandidateList, EventBatch, SearchQuery
+from recommendation.services import popularity
+from recommendation.services.diversity import DiversitySettings
+from recommendation.services.popularity import (
+    FilterLists,
+    PopularityTable,
+    _fused,
+    _collect_seen_contexts,
+    _share_seen_contexts,
+    build_popularity_table,
+    popularity_apply_events,
+    popularity_lookup,
+    popularity_table_from_snapshot,
+    write_popularity_snapshot,
+)
+from recommendation.services.selection import Ranking
+from recommendation.services.snapshot import Snapshot, WriterLock
+from recommendation.tests.helpers import candidate_list
+
+pytestmark = pytest.mark.unit
+
+KEY = ("dataset", None, None)
+
+
+def document(asset_id: str, **counters: int) -> dict:
+    return {"id": asset_id, "documentType": "dataset", "name": asset_id, **counters}
+
+
+class RankedFilter(AbstractFilter):
+    """Filter answering the same list to every query"""
+
+    filter_name: str = "Ranked Filter"
+    url: str = "http://ranked.test"
+    ponderation: float = 1.0
+
+    @classmethod
+    def from_config(cls) -> None:
+        return None
+
+    async def apply(self, query: SearchQuery) -> dict[str, CandidateList] | None:  # noqa: ARG002
+        return {"likes_count": candidate_list(("a", 1.0))}
+
+
+def liked(asset_id: str, times: int) -> list[AssetEvent]:
+    return [AssetEvent(event="liked", asset_id=asset_id, user_id=f"u{user}") for user in range(times)]
+
+
+def test_updated_table_scores_the_changed_lists_with_their_filter(config: dict) -> None:
+    search = SearchFilter.from_config().model_copy(update={"ponderation": 2.0})
+    collaborative = CollaborativeFilter(interactions_path="unused")
+    lists: FilterLists = {
+        (search.filter_name, "likes_count"): (
+            [document("a", likes_count=10), document("b", likes_count=5)],
+            np.asarray([2.0, 1.0]),
+        ),
+        (search.filter_name, "downloads_count"): (
+            [document("b", downloads_count=8), document("c", downloads_count=4)],
+            np.asarray([2.0, 1.0]),
+        ),
+        (collaborative.filter_name, "item_similarity"): ([document("b")], np.asarray([0.5])),
+    }
+    table = PopularityTable({KEY: (_fused(lists), [search.filter_name])}, time.monotonic(), {KEY: lists})
+
+    updated = table.updated(
+        EventBatch(liked("b", 10)), {search.filter_name: search, collaborative.filter_name: collaborative}
+    )
+
+    ranking, contributors = updated.get(KEY)
+    scores = {candidate.id: candidate.r_score for candidate in ranking.page(0, len(ranking))}
+    # likes_count normalized by its new max (15), the collaborative score is kept
+    assert scores == pytest.approx({"b": 2.0 + 2.0 + 0.5, "a": 10 / 15 * 2.0, "c": 1.0})
+    assert [candidate.id for candidate in ranking.page(0, 3)] == ["b", "a", "c"]
+    assert contributors == [search.filter_name]
+    # The previous table is left untouched
+    assert {candidate.id: candidate.r_score for candidate in table.get(KEY)[0].candidates}["b"] == pytest.approx(3.5)
+
+
+def test_updated_table_adds_the_new_assets_of_a_context(config: dict) -> None:
+    search = SearchFilter.from_config()
+    lists: FilterLists = {(search.filter_name, "likes_count"): ([document("a", likes_count=4)], np.asarray([1.0]))}
+    table = PopularityTable({KEY: (_fused(lists), [search.filter_name])}, time.monotonic(), {KEY: lists})
+    created = AssetEvent(event="asset_created", asset_id="n", document=document("n", likes_count=2))
+    other_type = AssetEvent(event="asset_created", asset_id="m", document={**document("m"), "documentType": "model"})
+
+    ranking, _ = table.updated(EventBatch([created, other_type]), {search.filter_name: search}).get(KEY)
+
+    assert {candidate.id: candidate.r_score for candidate in ranking.candidates} == pytest.approx({"a": 1.0, "n": 0.5})
+
+
+def test_table_re_ranks_a_context_once_per_settings(config: dict) -> None:
+    search = SearchFilter.from_config()
+    lists: FilterLists = {(search.filter_name, "likes_count"): ([document("a", likes_count=4)], np.asarray([1.0]))}
+    other_key = ("model", None, None)
+    table = PopularityTable(
+        {KEY: (_fused(lists), [search.filter_name]), other_key: (_fused({}), [search.filter_name])},
+        time.monotonic(),
+        {KEY: lists},
+    )
+    settings = DiversitySettings(mode="mmr")
+
+    ranking, _ = table.get(KEY, settings)
+    other_ranking, _ = table.get(other_key, settings)
+
+    assert table.get(KEY, settings)[0] is ranking
+    assert table.get(KEY, DiversitySettings())[0] is table.get(KEY)[0]
+    # The re-ranked rankings of the contexts the events left untouched are kept
+    updated = table.updated(EventBatch(liked("a", 1)), {search.filter_name: search})
+    assert updated.get(other_key, settings)[0] is other_ranking
+    assert updated.get(KEY, settings)[0] is not ranking
+
+
+def test_table_of_a_snapshot_decodes_the_returned_page_only(tmp_path: Path) -> None:
+    ranking = Ranking(candidate_list(("a", 1.0), ("b", 3.0), ("c", 2.0)).assets)
+    table = PopularityTable({KEY: (ranking, ["Global Search Filter"])}, time.monotonic())
+    path = tmp_path / "popularity.snapshot"
+    write_popularity_snapshot(table, path)
+
+    loaded, contributors = popularity_table_from_snapshot(Snapshot(path)).get(KEY)
+
+    assert contributors == ["Global Search Filter"]
+    assert not isinstance(loaded.candidates, list)
+    assert [(candidate.id, candidate.r_score) for candidate in loaded.page(0, 2)] == [("b", 3.0), ("c", 2.0)]
+
+
+async def test_build_ranks_the_requested_contexts_up_to_the_max(config: dict) -> None:  # noqa: ARG001
+    requested = [("model", "user", "nlp"), ("dataset", None, "vision"), ("paper", None, None)]
+
+    table = await build_popularity_table([RankedFilter()], requested, max_contexts=len(AssetType) + 1)
+
+    # The fallback context of every type first, then the most requested contexts
+    assert set(table.entries) == {*((asset_type.value, None, None) for asset_type in AssetType), requested[0]}
+
+
+def test_lookups_count_the_contexts(monkeypatch: pytest.MonkeyPatch, config: dict) -> None:  # noqa: ARG001
+    monkeypatch.setattr(popularity, "_popularity_table", PopularityTable({}, time.monotonic()))
+    monkeypatch.setattr(popularity, "_seen_contexts", {})
+    dataset = SearchQuery(text="", documentType=AssetType("dataset"), documentCategory=[" vision"])
+
+    assert popularity_lookup(dataset) is None
+    assert popularity_lookup(dataset.model_copy(update={"documentCategory": ["vision "]})) is None
+    assert popularity_lookup(dataset.model_copy(update={"text": "live"})) is None
+
+    assert popularity._seen_contexts == {("dataset", None, "vision"): 2}
+
+
+async def test_writer_writes_the_table_updated_by_the_events(
+    monkeypatch: pytest.MonkeyPatch, config: dict, tmp_path: Path
+) -> None:
+    path = tmp_path / "popularity.snapshot"
+    config["popularity"] = {"snapshot": str(path), "snapshot_interval": 0.0}
+    search = SearchFilter.from_config()
+    monkeypatch.setattr(popularity, "filters_get", lambda: (search,))
+    for name, value in (("_writing", None), ("_written_table", None), ("_written_at", -np.inf)):
+        monkeypatch.setattr(popularity, name, value)
+    lists: FilterLists = {(search.filter_name, "likes_count"): ([document("a", likes_count=4)], np.asarray([1.0]))}
+    table = PopularityTable({KEY: (_fused(lists), [search.filter_name])}, time.monotonic(), {KEY: lists})
+    writer_lock, reader_lock = WriterLock(path), WriterLock(path)
+    assert writer_lock.acquire()
+    created = AssetEvent(event="asset_created", asset_id="n", document=document("n", likes_count=2))
+
+    # Another worker leaves the events to the writer
+    monkeypatch.setattr(popularity, "_writer_lock", reader_lock)
+    monkeypatch.setattr(popularity, "_popularity_table", table)
+    await popularity_apply_events(EventBatch([created]))
+    assert popularity._popularity_table is table
+    assert not path.exists()
+
+    monkeypatch.setattr(popularity, "_writer_lock", writer_lock)
+    await popularity_apply_events(EventBatch([created]))
+    await popularity._writing
+
+    loaded, _ = popularity_table_from_snapshot(Snapshot(path)).get(KEY)
+    assert {candidate.id for candidate in loaded.candidates} == {"a", "n"}
+    writer_lock.release()
+
+
+def test_writer_ranks_the_contexts_looked_up_by_the_readers(
+    monkeypatch: pytest.MonkeyPatch, config: dict, tmp_path: Path  # noqa: ARG001
+) -> None:
+    path = str(tmp_path / "popularity.snapshot")
+    monkeypatch.setattr(popularity, "_popularity_table", PopularityTable({}, time.monotonic()))
+    monkeypatch.setattr(popularity, "_seen_contexts", {})
+    query = SearchQuery(text="", documentType=AssetType("model"), documentCategory=["nlp"])
+    with monkeypatch.context() as reader:
+        reader.setattr(popularity.os, "getpid", lambda: 1)
+        popularity_lookup(query)
+        popularity_lookup(query)
+        _share_seen_contexts(path)
+
+    seen = _collect_seen_contexts(path, {("model", None, "nlp"): 1, KEY: 5}, max_age=60.0)
+
+    assert seen == {("model", None, "nlp"): 3, KEY: 5}
+    # The file of a worker that exited is deleted
+    assert _collect_seen_contexts(path, {}, max_age=-1.0) == {}
+    assert not list(tmp_path.glob("popularity.snapshot.seen.*"))
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from recommendation.services import shared_cache as shared_cache_module
+from recommendation.services.pool import CandidatePool
+from recommendation.services.selection import Ranking
+from recommendation.services.shared_cache import InMemoryRedis, SharedCache, decode_pool, encode_pool
+from recommendation.tests.helpers import candidate_list
+
+pytestmark = pytest.mark.unit
+
+
+def pool_of(*scored: tuple[str, float]) -> CandidatePool:
+    return CandidatePool(Ranking(candidate_list(*scored).assets), ["stub"], 20, True, {"likes_count": 3.0})
+
+
+def ranked(pool: CandidatePool) -> list[tuple[str, float]]:
+    return [(candidate.id, candidate.r_score) for candidate in pool.ranking.page(0, len(pool))]
+
+
+def test_pool_round_trip() -> None:
+    pool = pool_of(("a", 1.0), ("b", 3.0), ("c", 2.0))
+
+    decoded = decode_pool(encode_pool(pool))
+
+    assert ranked(decoded) == [("b", 3.0), ("c", 2.0), ("a", 1.0)]
+    assert (decoded.contributors, decoded.depth, decoded.exhausted) == (["stub"], 20, True)
+    assert decoded.maxima == {"likes_count": 3.0}
+    # Another replica may have served any of its ranks
+    assert decoded.served == len(decoded)
+    with pytest.raises(ValueError, match="format"):
+        decode_pool(b"XXXX" + encode_pool(pool)[4:])
+
+
+async def test_set_many_and_version_bump() -> None:
+    shared_cache = SharedCache(InMemoryRedis())
+    await shared_cache.set_many({"k1": pool_of(("a", 1.0)), "k2": pool_of(("b", 2.0))})
+
+    first, second, missing = await shared_cache.get_many(["k1", "k2", "k3"])
+
+    assert (ranked(first), ranked(second), missing) == ([("a", 1.0)], [("b", 2.0)], None)
+    assert await shared_cache.invalidate() == 1
+    assert await shared_cache.get_many(["k1", "k2"]) == [None, None]
+
+
+async def test_a_single_replica_refills_a_missing_key(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(shared_cache_module, "REFILL_POLL_INTERVAL", 0.001)
+    client = InMemoryRedis()
+    replicas = [SharedCache(client, max_refills=1, refill_wait=1.0) for _ in range(3)]
+    computed = 0
+
+    async def compute() -> CandidatePool:
+        nonlocal computed
+        computed += 1
+        await asyncio.sleep(0.01)
+        return pool_of(("a", 1.0))
+
+    pools = await asyncio.gather(*(replica.get_or_refill("k", compute) for replica in replicas))
+
+    assert computed == 1
+    assert [ranked(pool) for pool in pools] == [[("a", 1.0)]] * 3
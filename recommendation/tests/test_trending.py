@@ -0,0 +1,74 @@
+import pytest
+
+from recommendation.filters.trending_filters import TrendingFilter
+from recommendation.models.interfaces import AssetEvent, AssetType, Candidate, CandidateList, EventBatch, SearchQuery
+from recommendation.services import trending
+from recommendation.services.trending import DecayedCounters, TrendingIndex
+
+pytestmark = pytest.mark.unit
+
+
+def test_counters_are_read_after_thousands_of_idle_half_lives() -> None:
+    counters = DecayedCounters(half_life=1.0, now=0.0)
+    counters.add("a", 4.0, now=0.0)
+
+    assert counters.value("a", now=2.0) == pytest.approx(1.0)
+    assert counters.value("a", now=5000.0) == 0.0
+    counters.add("b", 1.0, now=5001.0)
+    assert counters.value("b", now=5002.0) == pytest.approx(0.5)
+
+
+async def test_filter_is_ready_once_an_interaction_is_counted(config: dict, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(trending, "_trending_index", None)
+    config["trending"] = {"enabled": True}
+    trending_filter = TrendingFilter.from_config()
+    document = {"id": "a1", "documentType": "dataset", "name": "a1"}
+
+    assert not trending_filter.ready()
+    events = [
+        AssetEvent(event="asset_created", asset_id="a1", document=document),
+        AssetEvent(event="liked", asset_id="a1", user_id="u1"),
+    ]
+    await trending_filter.apply_events(EventBatch(events))
+    await trending_filter._loading  # noqa: SLF001
+
+    assert trending_filter.ready()
+    result = await trending_filter.apply(SearchQuery(text="", documentType=AssetType.dataset))
+    assert [candidate.id for candidate in result[trending_filter.result_name].assets] == ["a1"]
+
+
+def test_rescore_reads_the_current_decayed_counters(config: dict, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(trending, "_trending_index", None)
+    config["trending"] = {"enabled": True}
+    trending_filter = TrendingFilter.from_config()
+    stored = [{"id": asset_id, "documentType": "dataset", "trending_score": 9.0} for asset_id in ("a1", "a2")]
+    asset_list = CandidateList([Candidate(document) for document in stored])
+
+    liked = [AssetEvent(event="liked", asset_id="a2", user_id=f"u{user}") for user in range(2)]
+    trending.get_trending_index().apply_events(EventBatch([*liked, AssetEvent(event="liked", asset_id="a1")]))
+
+    assert trending_filter.rescore(trending_filter.result_name, asset_list)
+    assert [candidate.r_score for candidate in asset_list.assets] == pytest.approx([0.5, 1.0], rel=1e-3)
+    # The stored documents of the previous lists are left untouched
+    assert stored[0]["trending_score"] == 9.0
+
+
+def test_top_walks_the_assets_of_the_type_of_the_query() -> None:
+    index = TrendingIndex(max_scan=2)
+    documents = [
+        AssetEvent(event="asset_created", asset_id=f"d{position}", document={"documentType": "dataset"})
+        for position in range(5)
+    ]
+    model = AssetEvent(event="asset_created", asset_id="m", document={"documentType": "model", "categoryId": "c"})
+    liked = [AssetEvent(event="liked", asset_id=event.asset_id) for event in [*documents, model]]
+    index.apply_events(EventBatch([*documents, model, *liked]))
+
+    top, _ = index.top(SearchQuery(text="", documentType=AssetType.model), limit=10)
+    assert [document["id"] for document in top] == ["m"]
+    # A rare category of a common type is looked for among the first max_scan assets only
+    top, _ = index.top(SearchQuery(text="", documentType=AssetType.dataset, documentCategory=["c"]), limit=10)
+    assert top == []
+    # A document changing type moves the asset to the ranking of its new type
+    updated = AssetEvent(event="asset_updated", asset_id="m", document={"documentType": "paper"})
+    index.apply_events(EventBatch([updated]))
+    assert index.ranked("model") == []